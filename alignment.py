@@ -0,0 +1,97 @@
+import time
+import torch as th
+import torch.nn.functional as F
+from collections import OrderedDict
+
+# Channel multiples favoured by vectorised CPU (AVX2/AVX-512) and GPU kernels
+CANDIDATE_MULTIPLES = (8, 16, 32, 64)
+
+
+def align_width(width, align=None):
+    r""" Round a width up to a multiple of align.
+
+    :param width: Requested number of channels/features
+    :param align: Multiple to round up to, None or 1 keeps the width
+
+    :return: aligned width
+    """
+
+    if not align or align <= 1:
+        return width
+    return -(-width // align) * align
+
+
+def benchmark_widths(widths, in_channels, input_size, kernel_size=3,
+                     batch_size=32, repeat=10, device=None):
+    r""" Measure the forward time of a convolution at several output widths.
+
+    :param widths: Numbers of output channels to be measured
+    :param in_channels: Number of input channels of the convolution
+    :param input_size: Height and width of the input
+    :param kernel_size: Kernel size of the convolution, padded to keep the
+     input size
+    :param batch_size: Batch size of the input
+    :param repeat: Number of timed forward passes per width
+    :param device: Device to measure on, the CPU by default
+
+    :return: OrderedDict with the median time (s) of every width
+    """
+
+    inputs = th.rand(batch_size, in_channels, input_size, input_size,
+                     device=device)
+    timings = OrderedDict()
+    with th.no_grad():
+        for width in widths:
+            weight = th.rand(width, in_channels, kernel_size, kernel_size,
+                             device=device)
+            times = []
+            for i in range(repeat + 2):
+                if inputs.is_cuda:
+                    th.cuda.synchronize()
+                start = time.time()
+                F.conv2d(inputs, weight, padding=kernel_size // 2)
+                if inputs.is_cuda:
+                    th.cuda.synchronize()
+                # The first runs are warm-up
+                if i >= 2:
+                    times.append(time.time() - start)
+            timings[width] = sorted(times)[len(times) // 2]
+    return timings
+
+
+def fastest_width(width, in_channels, input_size, max_extra=0.25,
+                  multiples=CANDIDATE_MULTIPLES, **kwargs):
+    r""" Fastest convolution width at or above the requested width.
+
+    The requested width and its roundings to every multiple (up to max_extra
+    more channels) are measured on the current machine by benchmark_widths().
+    A wider layer which is not slower gives the student extra capacity for
+    free.
+
+    :param width: Requested number of output channels
+    :param in_channels: Number of input channels of the convolution
+    :param input_size: Height and width of the input
+    :param max_extra: Largest fraction of extra channels to consider
+    :param multiples: Multiples the width is rounded up to
+    :param kwargs: Further arguments of benchmark_widths()
+
+    :return: fastest width and the OrderedDict of measured times
+    """
+
+    candidates = sorted(set(
+        [width] + [align_width(width, multiple) for multiple in multiples
+                   if align_width(width, multiple) <= width * (1 + max_extra)]))
+    timings = benchmark_widths(candidates, in_channels, input_size, **kwargs)
+    # Prefer the wider one if equally fast
+    best = min(candidates, key=lambda w: (timings[w], -w))
+    return best, timings
+
+
+if __name__ == '__main__':
+    for requested in (20, 40, 75, 130):
+        chosen, measured = fastest_width(requested, in_channels=64,
+                                         input_size=16)
+        print('requested {}: fastest {} ({})'.format(
+            requested, chosen, ', '.join(
+                '{}: {:.2f} ms'.format(w, t * 1000)
+                for w, t in measured.items())))
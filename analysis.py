@@ -0,0 +1,214 @@
+import torch.nn as nn
+from collections import OrderedDict
+
+import resnet
+from param_activation import ParamActivation
+
+# Layers which keep the shape of their input and have no MACs
+ELEMENTWISE_LAYERS = (nn.ReLU, nn.ReLU6, nn.LeakyReLU, nn.PReLU, nn.ELU,
+                      nn.Sigmoid, nn.Tanh, nn.Dropout, nn.Dropout2d,
+                      ParamActivation)
+
+
+def _pair(value):
+    return tuple(value) if isinstance(value, (tuple, list)) else (value, value)
+
+
+def _prod(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _window_output(size, kernel, stride, padding, dilation=1,
+                   ceil_mode=False):
+    # Output size of a convolution/pooling window along one dimension
+    span = size + 2 * padding - dilation * (kernel - 1) - 1
+    if ceil_mode:
+        return -(-span // stride) + 1
+    return span // stride + 1
+
+
+def _spatial_output(shape, kernel, stride, padding, dilation=(1, 1),
+                    ceil_mode=False):
+    return tuple(_window_output(size, k, s, p, d, ceil_mode) for size, k, s, p, d
+                 in zip(shape[1:], kernel, stride, padding, dilation))
+
+
+class _Analyser(object):
+    # Propagates the input shape (without batch dimension) through a network
+    # and records the cost of every layer. out_widths overrides the number of
+    # output units of layers which are widened by a pending transform and
+    # groups the number of groups of the depthwise convolutions it widens, the
+    # layers in deeper are followed by the layers deepening would add.
+
+    def __init__(self, batch_size, dtype_bytes, out_widths=None, deeper=None,
+                 groups=None):
+        self.batch_size = batch_size
+        self.dtype_bytes = dtype_bytes
+        self.out_widths = out_widths or {}
+        self.deeper = deeper or {}
+        self.groups = groups or {}
+        self.layers = OrderedDict()
+
+    def record(self, name, module, input_shape, output_shape, params=0,
+               macs=0):
+        self.layers[name] = {
+            'type': module if isinstance(module, str)
+            else module.__class__.__name__,
+            'input_shape': tuple(input_shape),
+            'output_shape': tuple(output_shape),
+            'params': params,
+            'macs': macs * self.batch_size,
+            'activation_bytes': _prod(output_shape) * self.batch_size *
+            self.dtype_bytes}
+        return tuple(output_shape)
+
+    def conv(self, name, module, shape, out_channels, kernel, stride,
+             padding, dilation, groups, bias):
+        assert len(shape) == 3 and shape[0] % groups == 0, \
+            '{}: Input shape {} is not compatible'.format(name, shape)
+        output_shape = (out_channels,) + _spatial_output(
+            shape, kernel, stride, padding, dilation)
+        weights = out_channels * shape[0] // groups * _prod(kernel)
+        return self.record(name, module, shape, output_shape,
+                           params=weights + (out_channels if bias else 0),
+                           macs=weights * _prod(output_shape[1:]))
+
+    def linear(self, name, module, shape, out_features, bias):
+        in_features = _prod(shape)
+        return self.record(name, module, shape, (out_features,),
+                           params=in_features * out_features +
+                           (out_features if bias else 0),
+                           macs=in_features * out_features)
+
+    def bnorm(self, name, module, shape, affine=True):
+        return self.record(name, module, shape, shape,
+                           params=2 * shape[0] if affine else 0)
+
+    def deepen(self, name, module, shape):
+        # Layers added by Transform.deeper: optional BN and an identity layer
+        args = self.deeper[name]
+        if isinstance(module, nn.Conv2d):
+            if args['bnorm']:
+                shape = self.bnorm(name + '.bnorm', 'BatchNorm2d', shape)
+            kh, kw = module.kernel_size
+            return self.conv(name + '.conv_new', 'Conv2d', shape, shape[0],
+                             (kh, kw), (1, 1), (kh // 2, kw // 2), (1, 1),
+                             self.groups.get(name, module.groups),
+                             module.bias is not None)
+        if args['bnorm']:
+            shape = self.bnorm(name + '.bnorm', 'BatchNorm1d', shape)
+        return self.linear(name + '.conv_new', 'Linear', shape, shape[0],
+                           module.bias is not None)
+
+    def chain(self, name, modules, shape):
+        prefix = name + '.' if name else ''
+        for child_name, child in modules:
+            if isinstance(child, nn.modules.loss._Loss):
+                continue
+            shape = self.run(prefix + child_name, child, shape)
+        return shape
+
+    def run(self, name, module, shape):
+        if isinstance(module, nn.Conv2d):
+            shape = self.conv(
+                name, module, shape,
+                self.out_widths.get(name, module.out_channels),
+                _pair(module.kernel_size), _pair(module.stride),
+                _pair(module.padding), _pair(module.dilation),
+                self.groups.get(name, module.groups), module.bias is not None)
+        elif isinstance(module, nn.Linear):
+            shape = self.linear(
+                name, module, shape,
+                self.out_widths.get(name, module.out_features),
+                module.bias is not None)
+        elif isinstance(module, nn.modules.batchnorm._BatchNorm):
+            return self.bnorm(name, module, shape, module.affine)
+        elif isinstance(module, (nn.MaxPool2d, nn.AvgPool2d)):
+            kernel = _pair(module.kernel_size)
+            stride = _pair(module.stride or module.kernel_size)
+            dilation = _pair(getattr(module, 'dilation', 1))
+            return self.record(name, module, shape, shape[:1] + _spatial_output(
+                shape, kernel, stride, _pair(module.padding), dilation,
+                module.ceil_mode))
+        elif isinstance(module, nn.AdaptiveAvgPool2d):
+            size = _pair(module.output_size)
+            return self.record(name, module, shape, shape[:1] + tuple(
+                s if o is None else o for s, o in zip(shape[1:], size)))
+        elif isinstance(module, ELEMENTWISE_LAYERS):
+            params = sum(p.numel() for p in module.parameters())
+            return self.record(name, module, shape, shape, params=params)
+        elif isinstance(module, nn.Sequential):
+            return self.chain(name, module.named_children(), shape)
+        elif isinstance(module, (resnet.BasicBlock, resnet.Bottleneck)):
+            output_shape = self.chain(
+                name, [(n, m) for n, m in module.named_children()
+                       if n != 'shortcut'], shape)
+            shortcut_shape = self.run(name + '.shortcut', module.shortcut,
+                                      shape)
+            assert shortcut_shape == output_shape, \
+                '{}: Shortcut shape {} does not match {}'.format(
+                    name, shortcut_shape, output_shape)
+            return output_shape
+        elif isinstance(module, resnet.ResNet):
+            # forward() pools the output of layer4 with F.avg_pool2d(out, 4)
+            children = list(module.named_children())
+            shape = self.chain(name, children[:-1], shape)
+            shape = shape[:1] + _spatial_output(shape, (4, 4), (4, 4), (0, 0))
+            return self.chain(name, children[-1:], shape)
+        elif len(module._modules) > 0:
+            # Containers like ConvNet apply their children in declaration order
+            return self.chain(name, module.named_children(), shape)
+        else:
+            raise RuntimeError(
+                "{} Module not supported".format(module.__class__.__name__))
+
+        if name in self.deeper:
+            shape = self.deepen(name, module, shape)
+        return shape
+
+
+def analyse(model, input_shape, batch_size=1, transform=None, dtype_bytes=4):
+    r""" Static shape, parameter, MAC and memory inference of a network.
+
+    Shapes are propagated layer by layer without allocating any tensor, so
+    candidate students can be checked against a budget before they are built.
+    Layers are visited in the order of ResNet/ConvNet forward passes, other
+    containers are assumed to apply their children in declaration order and
+    functional operations in forward() are not counted.
+
+    :param model: Network to be analysed, e.g. the teacher
+    :param input_shape: Shape of a single input without batch dimension
+    :param batch_size: Batch size the MACs and activation memory are given for
+    :param transform: Pending Transform whose wider/deeper operations are
+     taken into account, the model is left unchanged
+    :param dtype_bytes: Bytes per element of the activations
+
+    :return: dict with an OrderedDict 'layers' holding the 'type',
+     'input_shape', 'output_shape', 'params', 'macs' and 'activation_bytes'
+     of every layer, and the totals 'params', 'macs', 'activation_bytes' and
+     'output_shape'
+    """
+
+    out_widths, deeper, groups = {}, {}, {}
+    if transform is not None:
+        layers, deeper, _ = transform._plan(model)
+        out_widths = dict((name, plan.out_width)
+                          for name, plan in layers.items())
+        groups = dict((name, plan.groups) for name, plan in layers.items())
+
+    analyser = _Analyser(batch_size, dtype_bytes, out_widths, deeper, groups)
+    output_shape = analyser.run('', model, tuple(input_shape))
+    report = {'layers': analyser.layers, 'output_shape': output_shape}
+    for key in ('params', 'macs', 'activation_bytes'):
+        report[key] = sum(layer[key] for layer in analyser.layers.values())
+    return report
+
+
+def output_shape(model, input_shape):
+    r""" Output shape of a network for an input shape without batch dimension.
+    """
+
+    return analyse(model, input_shape)['output_shape']
@@ -1,6 +1,7 @@
 import torch.nn as nn
 import torch.nn.functional as F
 
+import analysis
 import net2net
 import netmorph
 import net2net_original
@@ -12,6 +13,7 @@ BASE_WIDTH = 4
 
 class CIFAR10(object):
     INPUT_CHANNELS = 3
+    INPUT_SIZE = 32
     NUM_OUTPUT_CLASSES = 10
     CLASSES = ['plane', 'car', 'bird', 'cat', 'deer', 'dog', 'frog',
                'horse', 'ship', 'truck']
@@ -19,7 +21,8 @@ class CIFAR10(object):
 
 class MNIST(object):
     INPUT_CHANNELS = 1
-    OUTPUT_CLASSES = 10
+    INPUT_SIZE = 28
+    NUM_OUTPUT_CLASSES = 10
 
 
 class ConvNet(nn.Module):
@@ -58,8 +61,7 @@ class ConvNet(nn.Module):
 
         self.fc1 = nn.Linear(
             out_features=self.net_dataset.NUM_OUTPUT_CLASSES,
-            in_features=self.conv3.out_channels * self.conv3.kernel_size[0] *
-                        self.conv3.kernel_size[1])
+            in_features=self._flat_features())
 
         self.criterion = nn.CrossEntropyLoss()
 
@@ -76,13 +78,30 @@ class ConvNet(nn.Module):
         except RuntimeError:
             print(x.size())
 
-    def wider(self, operation, widening_factor):
+    def _flat_shape(self):
+        # (C, H, W) shape of the conv3 output after pooling, flattened for fc1
+        size = self.net_dataset.INPUT_SIZE
+        return analysis.output_shape(
+            nn.Sequential(self.conv1, self.pool1, self.conv2, self.pool2,
+                          self.conv3, self.pool3),
+            (self.net_dataset.INPUT_CHANNELS, size, size))
+
+    def _flat_features(self):
+        # Number of conv3 output features after pooling, fed to fc1
+        shape = self._flat_shape()
+        return shape[0] * shape[1] * shape[2]
+
+    def wider(self, operation, widening_factor, align=None, scores=None):
         r""" Widen the Convolutional net by given widening factor
 
         :param operation: Net2Net or NetMorph
         :param widening_factor: factor to increase the width of all layers in
          convolutional net except input channel of first convolutional layer
          and output channel of output layer
+        :param align: Round the new widths up to a multiple of align
+        :param scores: dict with the importance of the units of conv1, conv2
+         and conv3, see importance.collect_scores. The most important units
+         are replicated instead of random ones.
 
         :return:
         """
@@ -93,16 +112,38 @@ class ConvNet(nn.Module):
             wider = net2net.wider
         elif operation == 'net2net_original':
             wider = net2net_original.wider
+        scores = scores or {}
 
         self.conv1, self.conv2, self.bn1 = wider(
             self.conv1, self.conv2, self.conv1.out_channels * widening_factor,
-            self.bn1)
+            self.bn1, align=align, scores=scores.get('conv1'))
         self.conv2, self.conv3, self.bn2 = wider(
             self.conv2, self.conv3, self.conv2.out_channels * widening_factor,
-            self.bn2)
+            self.bn2, align=align, scores=scores.get('conv2'))
         self.conv3, self.fc1, self.bn3 = wider(
             self.conv3, self.fc1, self.conv3.out_channels * widening_factor,
-            self.bn3)
+            self.bn3, align=align, scores=scores.get('conv3'),
+            out_size=self._flat_shape()[1:])
+
+    def narrower(self, narrowing_factor, importance='norm'):
+        r""" Narrow the Convolutional net by given narrowing factor
+
+        :param narrowing_factor: factor to decrease the width of all layers in
+         convolutional net except input channel of first convolutional layer
+         and output channel of output layer
+        :param importance: Ranking of the units to be kept, see
+         net2net.narrower
+        """
+
+        self.conv1, self.conv2, self.bn1 = net2net.narrower(
+            self.conv1, self.conv2, self.conv1.out_channels // narrowing_factor,
+            self.bn1, importance=importance)
+        self.conv2, self.conv3, self.bn2 = net2net.narrower(
+            self.conv2, self.conv3, self.conv2.out_channels // narrowing_factor,
+            self.bn2, importance=importance)
+        self.conv3, self.fc1, self.bn3 = net2net.narrower(
+            self.conv3, self.fc1, self.conv3.out_channels // narrowing_factor,
+            self.bn3, importance=importance)
 
     def define_wider(self, widening_factor):
         self.conv1 = nn.Conv2d(
@@ -121,7 +162,7 @@ class ConvNet(nn.Module):
             kernel_size=(3, 3), stride=1, padding=1)
         self.bn3 = nn.BatchNorm2d(num_features=self.conv3.out_channels)
         self.fc1 = nn.Linear(
-            in_features=self.conv3.out_channels * self.conv3.kernel_size[0] * self.conv3.kernel_size[1],
+            in_features=self._flat_features(),
             out_features=self.net_dataset.NUM_OUTPUT_CLASSES)
 
     def define_deeper(self, deepening_factor=2):
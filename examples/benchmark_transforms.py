@@ -0,0 +1,284 @@
+from __future__ import division
+
+import argparse
+import copy
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import torch as th
+import torch.nn as nn
+import torch.nn.functional as F
+
+sys.path.append('../')
+import net2net
+import net2net_original
+import netmorph
+import verify
+
+OPERATORS = {
+    'net2net': net2net.wider,
+    'netmorph': netmorph.wider,
+    'net2net_original': net2net_original.wider,
+}
+
+
+def _width(layer):
+    return layer.out_channels if isinstance(layer, nn.Conv2d) \
+        else layer.out_features
+
+
+# Deeper operators adding a layer on top of a layer, without BN and
+# activation in between so that the preservation error is comparable
+DEEPER_OPERATORS = {
+    'net2net': lambda layer: net2net.deeper(
+        layer, bnorm=False, filters=_width(layer)),
+    'netmorph': lambda layer: netmorph.deeper(
+        layer, None, bnorm=False, filters=_width(layer)),
+    'net2net_original': lambda layer: net2net_original.deeper(
+        layer, None, bnorm_flag=False),
+}
+
+# Spatial size of the input, the feature map seen by a Linear layer
+# following a conv layer is SPATIAL_SIZE x SPATIAL_SIZE.
+SPATIAL_SIZE = 4
+IN_CHANNELS = 8
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the wider and deeper operators of all '
+                'implementations')
+parser.add_argument('--operators', default=','.join(sorted(OPERATORS)),
+                    help='comma separated operators to benchmark')
+parser.add_argument('--operations', default='wider,deeper',
+                    help='comma separated operations: wider (layer pair '
+                         'widened 2x), deeper (layer added on top of the '
+                         'first layer, conv and linear layer types only, '
+                         'conv only for netmorph)')
+parser.add_argument('--layer-types', default='conv,conv_linear,linear',
+                    help='comma separated layer pairs: conv (conv->conv), '
+                         'conv_linear (conv->linear), linear (linear->linear)')
+parser.add_argument('--widths', default='16,64,256,1024',
+                    help='comma separated teacher widths (widened 2x)')
+parser.add_argument('--kernel-sizes', default='1,3',
+                    help='comma separated kernel sizes of conv layers')
+parser.add_argument('--threads', default='1,{}'.format(th.get_num_threads()),
+                    help='comma separated number of CPU threads')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='number of timed runs per case (best is reported)')
+parser.add_argument('--output', help='write the results as JSON to this file')
+parser.add_argument('--baseline',
+                    help='JSON results to compare against, regressions fail')
+parser.add_argument('--max-slowdown', type=float, default=1.5,
+                    help='allowed ratio of wall time against the baseline')
+parser.add_argument('--max-memory-growth', type=float, default=1.5,
+                    help='allowed ratio of peak memory against the baseline')
+parser.add_argument('--max-error', type=float, default=verify.ERROR_TOLERANCE,
+                    help='allowed preservation error if the baseline case '
+                         'was preserving')
+
+
+class PairNet(nn.Module):
+    def __init__(self, layer1, bnorm, layer2):
+        super(PairNet, self).__init__()
+        self.layer1 = layer1
+        self.bnorm = bnorm
+        self.layer2 = layer2
+
+    def forward(self, x):
+        x = F.relu(self.bnorm(self.layer1(x)))
+        if isinstance(self.layer2, nn.Linear):
+            x = x.view(x.size(0), -1)
+        return self.layer2(x)
+
+
+def build_teacher(layer_type, width, kernel_size):
+    if layer_type == 'linear':
+        layer1 = nn.Linear(IN_CHANNELS, width)
+        bnorm = nn.BatchNorm1d(width)
+        layer2 = nn.Linear(width, width)
+        input_shape = (IN_CHANNELS,)
+    else:
+        layer1 = nn.Conv2d(IN_CHANNELS, width, kernel_size,
+                           padding=kernel_size // 2)
+        bnorm = nn.BatchNorm2d(width)
+        if layer_type == 'conv':
+            layer2 = nn.Conv2d(width, width, kernel_size,
+                               padding=kernel_size // 2)
+        else:
+            layer2 = nn.Linear(width * SPATIAL_SIZE ** 2, 10)
+        input_shape = (IN_CHANNELS, SPATIAL_SIZE, SPATIAL_SIZE)
+
+    bnorm.running_mean.uniform_(-1, 1)
+    bnorm.running_var.uniform_(0.5, 2)
+    return PairNet(layer1, bnorm, layer2), input_shape
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _widen(net, width):
+    net.layer1, net.layer2, net.bnorm = OPERATORS[net.operator](
+        net.layer1, net.layer2, width, net.bnorm)
+
+
+def _deepen(net, width):
+    net.layer1 = DEEPER_OPERATORS[net.operator](net.layer1)
+
+
+def run_case(case):
+    th.set_num_threads(case['threads'])
+    th.manual_seed(0)
+    teacher, input_shape = build_teacher(case['layer_type'], case['width'],
+                                         case['kernel_size'])
+    operation = _deepen if case.get('operation') == 'deeper' else _widen
+    new_width = case['width'] * 2
+
+    # Warm up on a tiny layer pair so one-off library initialisation is
+    # neither timed nor counted as memory of the case.
+    warmup, _ = build_teacher(case['layer_type'], IN_CHANNELS,
+                              case['kernel_size'])
+    warmup.operator = case['operator']
+    try:
+        operation(warmup, 2 * IN_CHANNELS)
+    except Exception:
+        pass
+
+    rss_before = max_rss_bytes()
+    times = []
+    for _ in range(case['repeat']):
+        student = copy.deepcopy(teacher)
+        student.operator = case['operator']
+        start = time.time()
+        operation(student, new_width)
+        times.append(time.time() - start)
+    peak_memory = max(max_rss_bytes() - rss_before, 0)
+
+    report = verify.compare_outputs(teacher, student, input_shape=input_shape,
+                                    batch_size=4)
+    return {'wall_time': min(times),
+            'peak_memory': peak_memory,
+            'error': report['max_abs_error']}
+
+
+def _run_case_worker(case, queue):
+    try:
+        queue.put(run_case(case))
+    except Exception as e:
+        queue.put({'failed': '{}: {}'.format(e.__class__.__name__, e)})
+
+
+def run_isolated(case):
+    # Every case runs in its own freshly started process, so the peak resident
+    # memory is not polluted by earlier cases and an operator calling exit()
+    # or crashing only fails its own case.
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('spawn')
+    else:
+        context = multiprocessing
+    queue = context.Queue()
+    process = context.Process(target=_run_case_worker, args=(case, queue))
+    process.start()
+    process.join()
+    if queue.empty():
+        return {'failed': 'process exited with code {}'.format(
+            process.exitcode)}
+    return queue.get()
+
+
+def case_key(result):
+    # Results written before deeper was benchmarked are wider cases
+    return (result['operator'], result.get('operation', 'wider'),
+            result['layer_type'], result['width'], result['kernel_size'],
+            result['threads'])
+
+
+def find_regressions(results, baseline, args):
+    baseline = dict((case_key(r), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None or 'failed' in base:
+            continue
+        name = '{}/{}/{}/w{}/k{}/t{}'.format(*case_key(result))
+        if 'failed' in result:
+            regressions.append('{}: failed ({})'.format(name, result['failed']))
+            continue
+        if result['wall_time'] > base['wall_time'] * args.max_slowdown:
+            regressions.append('{}: wall time {:.4f}s, baseline {:.4f}s'.format(
+                name, result['wall_time'], base['wall_time']))
+        if (base['peak_memory'] > 0 and result['peak_memory'] >
+                base['peak_memory'] * args.max_memory_growth):
+            regressions.append('{}: peak memory {}B, baseline {}B'.format(
+                name, result['peak_memory'], base['peak_memory']))
+        if base['error'] < args.max_error <= result['error']:
+            regressions.append('{}: error {}, baseline {}'.format(
+                name, result['error'], base['error']))
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+
+    cases = []
+    for operation in args.operations.split(','):
+        for operator in args.operators.split(','):
+            for layer_type in args.layer_types.split(','):
+                if operation == 'deeper' and layer_type == 'conv_linear':
+                    # Deepening only sees the first layer
+                    continue
+                if operation == 'deeper' and operator == 'netmorph' and \
+                        layer_type == 'linear':
+                    # The NetMorph filter decomposition needs a conv layer
+                    continue
+                kernel_sizes = [1] if layer_type == 'linear' else [
+                    int(k) for k in args.kernel_sizes.split(',')]
+                for width in [int(w) for w in args.widths.split(',')]:
+                    for kernel_size in kernel_sizes:
+                        for threads in [int(t) for t in
+                                        args.threads.split(',')]:
+                            cases.append({
+                                'operation': operation, 'operator': operator,
+                                'layer_type': layer_type, 'width': width,
+                                'kernel_size': kernel_size,
+                                'threads': threads, 'repeat': args.repeat})
+
+    results = []
+    for case in cases:
+        result = dict(case)
+        result.update(run_isolated(case))
+        results.append(result)
+        name = '{:<8}{:<17}{:<12}w={:<6}k={:<3}t={:<3}'.format(
+            case['operation'], case['operator'], case['layer_type'],
+            case['width'], case['kernel_size'], case['threads'])
+        if 'failed' in result:
+            print(name + 'FAILED {}'.format(result['failed']))
+        else:
+            print(name + '{:>10.4f}s {:>12}B  err={:.2e}'.format(
+                result['wall_time'], result['peak_memory'], result['error']))
+
+    output = {'machine': platform.platform(),
+              'processor': platform.processor(),
+              'torch': th.__version__,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file),
+                                           args)
+        if regressions:
+            print('\nRegressions against {}:'.format(args.baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+from __future__ import division
+
+import argparse
+import copy
+import itertools
+import json
+import sys
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import datasets, transforms
+
+sys.path.append('../')
+import importance
+from convnet import ConvNet, CIFAR10
+
+DATA_DIRECTORY = './data'
+LAYERS = ('conv1', 'conv2', 'conv3')
+
+parser = argparse.ArgumentParser(
+    description='Time to accuracy of students widened with random and '
+                'importance guided channel selection')
+parser.add_argument('--operator', default='net2net',
+                    help='net2net, netmorph or net2net_original')
+parser.add_argument('--criterion', default='variance',
+                    help='importance criterion: variance, gradient or norm')
+parser.add_argument('--score-batches', type=int, default=4,
+                    help='number of batches the importance is collected on')
+parser.add_argument('--widening-factor', type=int, default=2,
+                    help='factor the width of every layer is increased by')
+parser.add_argument('--teacher-epochs', type=int, default=3,
+                    help='number of epochs the teacher is trained')
+parser.add_argument('--epochs', type=int, default=10,
+                    help='maximum number of epochs a student is trained')
+parser.add_argument('--target-accuracy', type=float, default=60.,
+                    help='test accuracy (%%) the students are timed to')
+parser.add_argument('--batch-size', type=int, default=64)
+parser.add_argument('--test-batch-size', type=int, default=1000)
+parser.add_argument('--lr', type=float, default=0.001)
+parser.add_argument('--momentum', type=float, default=0.9)
+parser.add_argument('--no-cuda', action='store_true', default=False)
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--output', help='write the results as JSON to this file')
+
+args = parser.parse_args()
+args.cuda = not args.no_cuda and torch.cuda.is_available()
+device = torch.device('cuda' if args.cuda else 'cpu')
+torch.manual_seed(args.seed)
+
+normalize = transforms.Normalize(mean=(0.4914, 0.4822, 0.4465),
+                                 std=(0.2023, 0.1994, 0.2010))
+train_loader = torch.utils.data.DataLoader(
+    datasets.CIFAR10(DATA_DIRECTORY, train=True, download=True,
+                     transform=transforms.Compose([
+                         transforms.RandomCrop(32, padding=4),
+                         transforms.RandomHorizontalFlip(),
+                         transforms.ToTensor(), normalize])),
+    batch_size=args.batch_size, shuffle=True)
+test_loader = torch.utils.data.DataLoader(
+    datasets.CIFAR10(DATA_DIRECTORY, train=False, download=True,
+                     transform=transforms.Compose([transforms.ToTensor(),
+                                                   normalize])),
+    batch_size=args.test_batch_size, shuffle=False)
+
+
+def train_epoch(net, optimizer):
+    net.train()
+    for data, target in train_loader:
+        data, target = data.to(device), target.to(device)
+        optimizer.zero_grad()
+        net.criterion(net(data), target).backward()
+        optimizer.step()
+
+
+def test(net):
+    net.eval()
+    correct = 0
+    with torch.no_grad():
+        for data, target in test_loader:
+            data, target = data.to(device), target.to(device)
+            correct += net(data).max(1)[1].eq(target).sum().item()
+    return 100. * correct / len(test_loader.dataset)
+
+
+def time_to_accuracy(net):
+    r""" Train until the target accuracy is reached.
+
+    :return: dict with the accuracy after every epoch and the 'epochs' and
+     training 'time' (s) needed to reach the target, None if never reached
+    """
+
+    optimizer = optim.SGD(net.parameters(), lr=args.lr,
+                          momentum=args.momentum)
+    result = {'accuracy': [], 'epochs': None, 'time': None}
+    elapsed = 0.
+    for epoch in range(1, args.epochs + 1):
+        start = time.time()
+        train_epoch(net, optimizer)
+        elapsed += time.time() - start
+        accuracy = test(net)
+        result['accuracy'].append(accuracy)
+        print('  epoch {}: {:.2f}%'.format(epoch, accuracy))
+        if accuracy >= args.target_accuracy:
+            result['epochs'], result['time'] = epoch, elapsed
+            break
+    return result
+
+
+if __name__ == '__main__':
+    teacher = ConvNet(CIFAR10).to(device)
+    teacher_optimizer = optim.SGD(teacher.parameters(), lr=args.lr,
+                                  momentum=args.momentum)
+    for _ in range(args.teacher_epochs):
+        train_epoch(teacher, teacher_optimizer)
+    print('teacher: {:.2f}%'.format(test(teacher)))
+
+    batches = [(data.to(device), target.to(device)) for data, target in
+               itertools.islice(train_loader, args.score_batches)]
+    scores = importance.collect_scores(teacher, LAYERS, batches,
+                                       criterion=args.criterion,
+                                       loss_fn=teacher.criterion)
+
+    results = {}
+    for selection in ('random', args.criterion):
+        print('{} selection'.format(selection))
+        student = copy.deepcopy(teacher)
+        student.wider(args.operator, args.widening_factor,
+                      scores=scores if selection != 'random' else None)
+        results[selection] = time_to_accuracy(student.to(device))
+
+    for selection, result in sorted(results.items()):
+        if result['epochs'] is None:
+            print('{}: target not reached in {} epochs'.format(
+                selection, args.epochs))
+        else:
+            print('{}: {} epochs, {:.1f} s to {}%'.format(
+                selection, result['epochs'], result['time'],
+                args.target_accuracy))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
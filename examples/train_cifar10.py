@@ -16,6 +16,7 @@ sys.path.append('../')
 
 from convnet import ConvNet, CIFAR10
 from resnet import ResNet18
+import shared_params
 
 DATA_DIRECTORY = './data'
 DISPLAY_INTERVAL = 200
@@ -242,7 +243,8 @@ def plot_live_data(plot, win_accuracy, win_loss, net_type, epoch,
     return win_accuracy, win_loss
 
 
-def run_training(net, net_type, plot=None, win_accuracy=None, win_loss=None):
+def run_training(net, net_type, plot=None, win_accuracy=None, win_loss=None,
+                 teacher=None):
     log = {'model_type': net_type, 'epoch': [],
            'train_accuracy': [], 'test_accuracy': [],
            'train_loss': [], 'test_loss': [],
@@ -251,6 +253,9 @@ def run_training(net, net_type, plot=None, win_accuracy=None, win_loss=None):
 
     global optimizer, scheduler
     optimizer = optim.SGD(net.parameters(), lr=args.lr, momentum=args.momentum, weight_decay=0.001)
+    if teacher is not None:
+        # Parameters shared with the teacher are copied on the first update
+        shared_params.copy_on_write(optimizer, teacher)
     # scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=60, gamma=0.1)
 
     for epoch in range(1, args.epochs + 1):
@@ -314,13 +319,13 @@ if __name__ == "__main__":
     print("\n\n > Wider Student training ... ")
     colors.append('blue')
     trace_names.extend(['Wider Net2Net Train', 'Wider Net2Net Test'])
-    n2n_model_wider = copy.deepcopy(teacher_model)
+    n2n_model_wider = shared_params.shared_copy(teacher_model)
     n2n_model_wider.wider('net2net', widening_factor=2)
     n2n_model_wider.cuda()
     print n2n_model_wider
     log_net2net, win_accuracy, win_loss = run_training(
         n2n_model_wider, 'WideNet2Net', visdom_live_plot, win_accuracy,
-        win_loss)
+        win_loss, teacher=teacher_model)
     logs.append(log_net2net)
 
     # # wider teacher training
@@ -36,9 +36,14 @@ NOISE_RATIO = 1e-5
 
 
 def add_noise(weights, other_weights):
-    noise_range = NOISE_RATIO * np.ptp(other_weights.flatten())
-    noise = th.Tensor(weights.shape).uniform_(
-        -noise_range / 2.0, noise_range / 2.0).cuda()
+    if th.is_tensor(other_weights):
+        noise_range = NOISE_RATIO * (
+            other_weights.max() - other_weights.min()).item()
+    else:
+        noise_range = NOISE_RATIO * np.ptp(other_weights.flatten())
+    # Noise is created on the device of the weights it is added to
+    noise = th.zeros_like(weights).uniform_(
+        -noise_range / 2.0, noise_range / 2.0)
 
     return th.add(noise, weights)
 
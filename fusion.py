@@ -0,0 +1,282 @@
+import copy
+import re
+import time
+import torch as th
+import torch.nn as nn
+from collections import OrderedDict
+
+import im2col
+import verify
+from initialization import skip_init
+from param_activation import ParamActivation
+
+
+class Identity(nn.Module):
+    r""" Placeholder for a layer which has been fused or annealed away. """
+
+    def forward(self, x):
+        return x
+
+
+def _is_identity(module):
+    # Layers which can be skipped when looking for consecutive linear layers
+    if isinstance(module, (Identity, nn.Dropout)):
+        return True
+    if isinstance(module, nn.Sequential) and len(module) == 0:
+        return True
+    # A parametric activation with alpha = 1 is the identity
+    return isinstance(module, ParamActivation) and \
+        bool((module.weight.data == 1).all())
+
+
+def _last_layer(module):
+    # Layer producing the output of a (possibly deepened) layer
+    while isinstance(module, nn.Sequential) and len(module) > 0:
+        module = list(module.children())[-1]
+    return module
+
+
+def fold_batchnorm(layer, bnorm):
+    r""" Fold an eval-mode BN layer into the preceding Conv2d/Linear layer.
+
+    :param layer: Layer whose output is normalised by bnorm, updated in place
+    :param bnorm: BN layer with running statistics
+    """
+
+    with th.no_grad():
+        scale = 1. / th.sqrt(bnorm.running_var + bnorm.eps)
+        shift = -bnorm.running_mean * scale
+        if bnorm.affine:
+            shift = shift * bnorm.weight + bnorm.bias
+            scale = scale * bnorm.weight
+
+        weight = layer.weight.data
+        layer.weight.data = weight * scale.view(
+            (-1,) + (1,) * (weight.dim() - 1)).to(weight)
+        if layer.bias is None:
+            layer.bias = nn.Parameter(shift.to(weight))
+        else:
+            layer.bias.data = layer.bias.data * scale.to(weight) + \
+                shift.to(weight)
+
+
+def _foldable(layer, bnorm):
+    return isinstance(layer, (nn.Conv2d, nn.Linear)) and \
+        isinstance(bnorm, nn.modules.batchnorm._BatchNorm) and \
+        bnorm.running_mean is not None and \
+        layer.weight.size(0) == bnorm.num_features
+
+
+def _fold_all(model):
+    folded = 0
+    for parent in list(model.modules()):
+        children = list(parent.named_children())
+
+        # Consecutive layers of a Sequential, e.g. the layers added by deeper
+        if isinstance(parent, nn.Sequential):
+            for (_, layer), (name, bnorm) in zip(children, children[1:]):
+                if _foldable(layer, bnorm):
+                    fold_batchnorm(layer, bnorm)
+                    setattr(parent, name, Identity())
+                    folded += 1
+
+        # Sibling layers named convX and bnX as in ConvNet and ResNet
+        for name, module in children:
+            match = re.match(r'^conv(\d+)$', name)
+            if match is None:
+                continue
+            bnorm_name = 'bn' + match.group(1)
+            layer = _last_layer(module)
+            bnorm = getattr(parent, bnorm_name, None)
+            if _foldable(layer, bnorm):
+                fold_batchnorm(layer, bnorm)
+                setattr(parent, bnorm_name, Identity())
+                folded += 1
+    return folded
+
+
+def _trimmed_kernel(conv):
+    # Drop rows/columns of the kernel which are zero on both sides together
+    # with the same amount of padding, e.g. an identity 3x3 layer added by
+    # deeper becomes a 1x1 layer without padding.
+    weight = conv.weight.data
+    padding = list(conv.padding)
+    support = weight.abs().sum(1).sum(0) > 0
+    if not bool(support.any()):
+        return weight, tuple(padding)
+
+    slices = [slice(None), slice(None)]
+    for dim in (0, 1):
+        nonzero = (support.sum(1 - dim) > 0).nonzero().view(-1)
+        size = support.size(dim)
+        trim = min(int(nonzero[0]), size - 1 - int(nonzero[-1]),
+                   padding[dim])
+        slices.append(slice(trim, size - trim))
+        padding[dim] -= trim
+    return weight[tuple(slices)], tuple(padding)
+
+
+def merge_linear_layers(first, second):
+    r""" Merge two consecutive layers without non-linearity in between.
+
+    Linear-Linear pairs are always merged. Conv2d pairs are only merged if
+    the merged convolution is exact, i.e. no dilation or groups and either
+    the second layer is a 1x1 convolution with stride 1 and no padding, or
+    the first layer has stride 1 and the second one does not pad (or pads
+    the output of a bias free 1x1 first layer, which is zero as well).
+
+    :param first: First layer
+    :param second: Layer applied to the output of the first one
+
+    :return: merged layer, None if the layers cannot be merged exactly
+    """
+
+    if isinstance(first, nn.Linear) and isinstance(second, nn.Linear):
+        with skip_init():
+            merged = nn.Linear(first.in_features, second.out_features)
+        with th.no_grad():
+            merged.weight.data = th.mm(second.weight.data, first.weight.data)
+            bias = second.bias.data.clone() if second.bias is not None \
+                else th.zeros_like(merged.bias.data)
+            if first.bias is not None:
+                bias += th.mv(second.weight.data, first.bias.data)
+            merged.bias.data = bias
+        return merged
+
+    if not (isinstance(first, nn.Conv2d) and isinstance(second, nn.Conv2d)):
+        return None
+    for conv in (first, second):
+        if conv.groups != 1 or tuple(conv.dilation) != (1, 1) or \
+                getattr(conv, 'padding_mode', 'zeros') != 'zeros':
+            return None
+
+    w1, p1 = _trimmed_kernel(first)
+    w2, p2 = _trimmed_kernel(second)
+    s1, s2 = tuple(first.stride), tuple(second.stride)
+    zero_bias = first.bias is None or bool((first.bias.data == 0).all())
+    if tuple(w2.shape[2:]) == (1, 1) and p2 == (0, 0) and s2 == (1, 1):
+        stride = s1
+    elif s1 == (1, 1) and (p2 == (0, 0) or (
+            tuple(w1.shape[2:]) == (1, 1) and p1 == (0, 0) and zero_bias)):
+        stride = s2
+    else:
+        return None
+    padding = (p1[0] + p2[0], p1[1] + p2[1])
+
+    weight = th.from_numpy(im2col.compose_filters(
+        w1.detach().cpu().double().numpy(),
+        w2.detach().cpu().double().numpy())).to(w1)
+    bias = second.bias.data.clone() if second.bias is not None \
+        else th.zeros(second.out_channels).to(w1)
+    if first.bias is not None:
+        bias += th.mv(second.weight.data.sum(3).sum(2), first.bias.data)
+
+    with skip_init():
+        merged = nn.Conv2d(first.in_channels, second.out_channels,
+                           kernel_size=tuple(weight.shape[2:]), stride=stride,
+                           padding=padding)
+    merged.weight.data = weight
+    merged.bias.data = bias
+    return merged
+
+
+def _merge_all(model):
+    merged = 0
+    for parent in list(model.modules()):
+        if not isinstance(parent, nn.Sequential):
+            continue
+        children = OrderedDict()
+        changed = False
+        for name, module in parent.named_children():
+            if _is_identity(module):
+                changed = True
+                continue
+            if children:
+                last_name = next(reversed(children))
+                layer = merge_linear_layers(children[last_name], module)
+                if layer is not None:
+                    children[last_name] = layer
+                    merged += 1
+                    changed = True
+                    continue
+            children[name] = module
+        if changed:
+            parent._modules = children
+    return merged
+
+
+def fuse(model):
+    r""" Inference copy of a network with BN and linear layers fused.
+
+    Every eval-mode BN layer directly following a Conv2d/Linear layer (in a
+    Sequential, or as convX/bnX siblings) is folded into that layer, then
+    consecutive linear layers of Sequential containers (e.g. a deepened layer
+    without non-linearity) are merged where this is exact. The model is left
+    unchanged.
+
+    :param model: Network to be fused
+
+    :return: fused copy of the network in eval mode and a dict with the
+     number of 'folded_bnorms' and 'merged_layers'
+    """
+
+    fused = copy.deepcopy(model)
+    fused.eval()
+    folded = _fold_all(fused)
+    merged = _merge_all(fused)
+    return fused, {'folded_bnorms': folded, 'merged_layers': merged}
+
+
+def measure_latency(model, inputs, repeat=20):
+    r""" Median forward latency of a network in eval mode, in seconds. """
+
+    training = model.training
+    model.eval()
+    times = []
+    try:
+        with th.no_grad():
+            for i in range(repeat + 2):
+                if inputs.is_cuda:
+                    th.cuda.synchronize()
+                start = time.time()
+                model(inputs)
+                if inputs.is_cuda:
+                    th.cuda.synchronize()
+                # The first runs are warm-up
+                if i >= 2:
+                    times.append(time.time() - start)
+    finally:
+        model.train(training)
+    return sorted(times)[len(times) // 2]
+
+
+def fuse_and_report(model, input_shape, batch_size=32, repeat=20):
+    r""" Fuse a network and report the latency change and the error.
+
+    :param model: Network to be fused, left unchanged
+    :param input_shape: Shape of a single input without batch dimension
+    :param batch_size: Batch size used to measure the latency
+    :param repeat: Number of timed forward passes
+
+    :return: fused network and a dict with the fused layer counts,
+     'latency_before', 'latency_after' (s), 'speedup' and 'max_abs_error'
+    """
+
+    fused, report = fuse(model)
+    device = next(model.parameters()).device
+    inputs = th.rand((batch_size,) + tuple(input_shape), device=device)
+
+    report['latency_before'] = measure_latency(model, inputs, repeat)
+    report['latency_after'] = measure_latency(fused, inputs, repeat)
+    report['speedup'] = report['latency_before'] / report['latency_after']
+    report['max_abs_error'] = verify.compare_outputs(
+        model, fused, inputs=inputs)['max_abs_error']
+    return fused, report
+
+
+if __name__ == '__main__':
+    from resnet import ResNet18
+
+    _, fusion_report = fuse_and_report(ResNet18(), (3, 32, 32))
+    for key in sorted(fusion_report):
+        print('{}: {}'.format(key, fusion_report[key]))
@@ -0,0 +1,295 @@
+import sys
+import torch as th
+import torch.nn as nn
+
+import alignment
+import importance
+from initialization import skip_init
+
+sys.path.append('./')
+from utils import add_noise
+
+
+def _capacity(capacity, size):
+    # Amortised growth: double the capacity until the size fits
+    capacity = max(capacity, 1)
+    while capacity < size:
+        capacity *= 2
+    return capacity
+
+
+class Growable(object):
+    r""" Mixin for layers which can be widened in place.
+
+    The tensors of the layer are views on larger storage tensors, so widening
+    within the reserved capacity only rebinds the views and the caller writes
+    the new slice. When the capacity is exceeded it is doubled, so repeated
+    widening costs amortised O(new units). The Parameter objects are kept, so
+    optimizers and hooks stay attached. The state of an optimizer has to be
+    widened as well, see grow_optimizer_state().
+
+    Storage is only allocated on the first grow() or reserve(). If the input
+    width has headroom, the active weight is a strided view which some
+    convolution backends copy on every forward, reserve() only the capacity
+    which is going to be used.
+    """
+
+    # Names of the growable tensors and the width ('out' or 'in') every
+    # leading dimension follows, set by the subclasses.
+    growable_tensors = {}
+
+    def _widths(self):
+        raise NotImplementedError
+
+    def _set_widths(self, out_width, in_width):
+        raise NotImplementedError
+
+    def _storage_dict(self):
+        if '_storage' not in self.__dict__:
+            self.__dict__['_storage'] = {}
+        return self.__dict__['_storage']
+
+    def _set_tensor(self, name, tensor):
+        if name in self._parameters:
+            self._parameters[name].data = tensor
+        else:
+            self._buffers[name] = tensor
+
+    def _resize(self, out_width, in_width, grow):
+        widths = dict(zip(('out', 'in'), self._widths()))
+        new_widths = {'out': out_width or widths['out'],
+                      'in': in_width or widths['in']}
+        storage = self._storage_dict()
+
+        for name, dims in self.growable_tensors.items():
+            tensor = getattr(self, name)
+            if tensor is None:
+                continue
+            active = tensor.data
+            shape = list(active.shape)
+            for i, dim in enumerate(dims):
+                shape[i] = new_widths[dim]
+
+            stored = storage.get(name)
+            if stored is None or stored.dim() != active.dim() or \
+                    stored.data_ptr() != active.data_ptr():
+                # No storage yet or the tensor was replaced from outside
+                stored = active
+            if any(size > stored_size
+                   for size, stored_size in zip(shape, stored.shape)):
+                new_shape = [_capacity(stored_size, size) if grow
+                             else max(stored_size, size)
+                             for size, stored_size in zip(shape, stored.shape)]
+                new_stored = th.zeros(new_shape, dtype=active.dtype,
+                                      device=active.device)
+                new_stored[tuple(slice(0, s) for s in active.shape)] = active
+                stored = new_stored
+            storage[name] = stored
+
+            if not grow:
+                shape = active.shape
+            self._set_tensor(name, stored[tuple(slice(0, s) for s in shape)])
+
+        if grow:
+            self._set_widths(new_widths['out'], new_widths['in'])
+
+    def reserve(self, out_width=None, in_width=None):
+        r""" Reserve capacity without changing the active width.
+
+        :param out_width: Number of output units to reserve storage for
+        :param in_width: Number of input units to reserve storage for
+        """
+
+        self._resize(out_width, in_width, grow=False)
+
+    def grow(self, out_width=None, in_width=None):
+        r""" Widen the layer in place, new units are zero.
+
+        :param out_width: New number of output channels/features
+        :param in_width: New number of input channels/features
+        """
+
+        widths = self._widths()
+        assert (out_width or widths[0]) >= widths[0] and \
+            (in_width or widths[1]) >= widths[1], 'New size should be larger'
+        self._resize(out_width, in_width, grow=True)
+
+    def _apply(self, fn):
+        super(Growable, self)._apply(fn)
+        storage = self._storage_dict()
+        for name in list(storage):
+            tensor = getattr(self, name)
+            storage[name] = fn(storage[name])
+            self._set_tensor(name, storage[name][
+                tuple(slice(0, s) for s in tensor.shape)])
+        return self
+
+
+class GrowableConv2d(Growable, nn.Conv2d):
+    growable_tensors = {'weight': ('out', 'in'), 'bias': ('out',)}
+
+    def _widths(self):
+        return self.out_channels, self.in_channels
+
+    def _set_widths(self, out_width, in_width):
+        self.out_channels, self.in_channels = out_width, in_width
+
+
+class GrowableLinear(Growable, nn.Linear):
+    growable_tensors = {'weight': ('out', 'in'), 'bias': ('out',)}
+
+    def _widths(self):
+        return self.out_features, self.in_features
+
+    def _set_widths(self, out_width, in_width):
+        self.out_features, self.in_features = out_width, in_width
+
+
+class GrowableBatchNorm2d(Growable, nn.BatchNorm2d):
+    growable_tensors = {'weight': ('out',), 'bias': ('out',),
+                        'running_mean': ('out',), 'running_var': ('out',)}
+
+    def _widths(self):
+        return self.num_features, self.num_features
+
+    def _set_widths(self, out_width, in_width):
+        self.num_features = out_width
+
+
+def from_module(module):
+    r""" Growable copy of a Conv2d, Linear or BatchNorm2d layer.
+
+    :param module: Layer to be converted
+
+    :return: growable layer with a copy of the tensors of the given layer
+    """
+
+    if isinstance(module, Growable):
+        return module
+    with skip_init():
+        if isinstance(module, nn.Conv2d):
+            growable = GrowableConv2d(
+                module.in_channels, module.out_channels, module.kernel_size,
+                stride=module.stride, padding=module.padding,
+                dilation=module.dilation, groups=module.groups,
+                bias=module.bias is not None)
+        elif isinstance(module, nn.Linear):
+            growable = GrowableLinear(module.in_features, module.out_features,
+                                      bias=module.bias is not None)
+        elif isinstance(module, nn.BatchNorm2d):
+            growable = GrowableBatchNorm2d(
+                module.num_features, eps=module.eps, momentum=module.momentum,
+                affine=module.affine,
+                track_running_stats=module.track_running_stats)
+        else:
+            raise RuntimeError(
+                "{} Module not supported".format(module.__class__.__name__))
+    state = module.state_dict()
+    growable.load_state_dict(state)
+    return growable.to(list(state.values())[0].device)
+
+
+def grow_optimizer_state(optimizer, params):
+    r""" Widen the optimizer state (e.g. momentum) of grown parameters.
+
+    The state of the existing units is kept and the state of the new units
+    is zero, as if they had just been added to the optimizer.
+
+    :param optimizer: Optimizer holding the parameters
+    :param params: Parameters which have been grown
+    """
+
+    for param in params:
+        state = optimizer.state.get(param)
+        if not state:
+            continue
+        for key, value in state.items():
+            if not th.is_tensor(value) or value.shape == param.shape or \
+                    value.dim() != param.dim():
+                continue
+            new_value = th.zeros_like(param.data)
+            new_value[tuple(slice(0, s) for s in value.shape)] = value
+            state[key] = new_value
+
+
+def wider(layer1, layer2, new_width, bnorm=None, noise=True,
+          return_mapping=False, align=None, scores=None):
+    r""" Net2Net widening of growable layers in place.
+
+    Only the new slices of the layers are written: the new output units of
+    layer1 (and the BN layer) are copies of randomly selected teacher units,
+    the new input channels of layer2 are the selected input channels divided
+    by their replication factor and the replicated input channels are
+    divided in place.
+
+    :param layer1: Growable layer to be widened
+    :param layer2: Growable layer following layer1
+    :param new_width: New number of output units of layer1
+    :param bnorm: Growable BN layer between the layers if any
+    :param noise: Add noise to the new units of layer1 to break symmetry
+    :param return_mapping: Also return the teacher unit of every unit
+    :param align: Round new_width up to a multiple of align
+    :param scores: Importance of every unit of layer1, the most important
+     units are replicated instead of random ones
+
+    :return: layer1, layer2, bnorm (and the mapping) widened in place
+    """
+
+    new_width = alignment.align_width(new_width, align)
+
+    old_width = layer1.weight.size(0)
+    assert new_width > old_width, 'New size should be larger'
+    assert getattr(layer1, 'groups', 1) == 1 and \
+        getattr(layer2, 'groups', 1) == 1, 'Grouped convolutions not supported'
+    assert layer2.weight.size(1) % old_width == 0, \
+        'Module weights are not compatible'
+    features = layer2.weight.size(1) // old_width
+    if bnorm is not None:
+        assert isinstance(bnorm, Growable), 'BN layer is not growable'
+
+    with th.no_grad():
+        device = layer1.weight.device
+        if scores is not None:
+            rand_ids = importance.top_units(
+                scores, new_width - old_width).to(device)
+        else:
+            rand_ids = th.randint(low=0, high=old_width,
+                                  size=(new_width - old_width,),
+                                  dtype=th.long).to(device)
+        counts = th.bincount(rand_ids, minlength=old_width) + 1
+
+        layer1.grow(out_width=new_width)
+        w1 = layer1.weight.data
+        new_units = w1[rand_ids]
+        if noise:
+            new_units = add_noise(new_units, w1.narrow(0, 0, old_width))
+        w1.narrow(0, old_width, rand_ids.numel()).copy_(new_units)
+        if layer1.bias is not None:
+            b1 = layer1.bias.data
+            b1.narrow(0, old_width, rand_ids.numel()).copy_(b1[rand_ids])
+
+        if bnorm is not None:
+            bnorm.grow(out_width=new_width)
+            for name in ('running_mean', 'running_var', 'weight', 'bias'):
+                tensor = getattr(bnorm, name)
+                if tensor is not None:
+                    tensor = tensor.data
+                    tensor.narrow(0, old_width, rand_ids.numel()).copy_(
+                        tensor[rand_ids])
+
+        layer2.grow(in_width=new_width * features)
+        w2 = layer2.weight.data
+        if features > 1:
+            # Linear layer following a conv layer, every channel is a block
+            # of features.
+            w2 = w2.view(w2.size(0), new_width, features)
+        replicated = th.unique(rand_ids)
+        scale = (1. / counts[replicated].to(w2.dtype)).view(
+            (1, -1) + (1,) * (w2.dim() - 2))
+        w2[:, replicated] = w2[:, replicated] * scale
+        w2.narrow(1, old_width, rand_ids.numel()).copy_(w2[:, rand_ids])
+
+    if return_mapping:
+        mapping = th.cat((th.arange(old_width), rand_ids.cpu()))
+        return layer1, layer2, bnorm, mapping
+    return layer1, layer2, bnorm
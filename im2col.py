@@ -1,4 +1,5 @@
 import numpy as np
+from contextlib import contextmanager
 
 
 def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
@@ -78,7 +79,7 @@ def im2col(input_data, filter_h, filter_w, stride=1, padding=0):
     out_w = (W + 2 * padding - filter_w) // stride + 1
 
     img = np.pad(input_data, [(0, 0), (0, 0), (padding, padding), (padding, padding)], 'constant')
-    col = np.zeros((N, C, filter_h, filter_w, out_h, out_w))
+    col = np.zeros((N, C, filter_h, filter_w, out_h, out_w), dtype=img.dtype)
 
     for y in range(filter_h):
         y_max = y + stride*out_h
@@ -108,7 +109,8 @@ def col2im(col, input_shape, filter_h, filter_w, stride=1, padding=0):
     out_w = (W + 2 * padding - filter_w) // stride + 1
 
     col = col.reshape(N, out_h, out_w, C, filter_h, filter_w).transpose(0, 3, 4, 5, 1, 2)
-    img = np.zeros((N, C, H + 2 * padding + stride - 1, W + 2 * padding + stride - 1))
+    img = np.zeros((N, C, H + 2 * padding + stride - 1, W + 2 * padding + stride - 1),
+                   dtype=col.dtype)
     for y in range(filter_h):
         y_max = y + stride*out_h
         for x in range(filter_w):
@@ -118,6 +120,189 @@ def col2im(col, input_shape, filter_h, filter_w, stride=1, padding=0):
     return img[:, :, padding:H + padding, padding:W + padding]
 
 
+@contextmanager
+def blas_threads(num_threads=None):
+    """
+    Limit the number of threads used by the BLAS backend of numpy.
+
+    Uses threadpoolctl when it is installed, otherwise the thread count
+    configured for the process is left untouched.
+
+    Parameters
+    ----------
+    num_threads: Number of BLAS threads, None keeps the current setting
+    """
+    if num_threads is None:
+        yield
+        return
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        yield
+        return
+
+    with threadpool_limits(limits=num_threads, user_api='blas'):
+        yield
+
+
+def conv2d_forward(input_data, weight, bias=None, stride=1, padding=0,
+                   groups=1, num_threads=None):
+    """
+    Batched 2D convolution (cross-correlation, as in torch.nn.Conv2d) built on
+    im2col and a single matrix multiplication.
+
+    Parameters
+    ----------
+    input_data: Input of shape (N, C, H, W)
+    weight: Filters of shape (F, C // groups, filter_h, filter_w)
+    bias: Optional bias of shape (F,)
+    stride: stride
+    padding: Zero padding added to both sides of the input
+    groups: Number of blocked connections from input to output channels
+    num_threads: Number of BLAS threads used for the multiplication
+    Returns
+    -------
+    out : Output of shape (N, F, out_h, out_w)
+    """
+    N, C, H, W = input_data.shape
+    F, C_group, filter_h, filter_w = weight.shape
+    assert C % groups == 0 and F % groups == 0, \
+        'Channels need to be divisible by groups'
+    assert C_group == C // groups, 'Input and weight are not compatible'
+
+    out_h = (H + 2 * padding - filter_h) // stride + 1
+    out_w = (W + 2 * padding - filter_w) // stride + 1
+
+    # Columns are ordered (C, filter_h, filter_w), so the receptive field of
+    # every group is a contiguous slice of a row.
+    col = im2col(input_data, filter_h, filter_w, stride, padding)
+    col = col.reshape(col.shape[0], groups, -1).transpose(1, 0, 2)
+    weight_col = weight.reshape(groups, F // groups, -1).transpose(0, 2, 1)
+
+    with blas_threads(num_threads):
+        out = np.matmul(col, weight_col)
+
+    # (groups, N * out_h * out_w, F // groups) -> (N, F, out_h, out_w)
+    out = out.transpose(1, 0, 2).reshape(N, out_h, out_w, F)
+    out = out.transpose(0, 3, 1, 2)
+    if bias is not None:
+        out = out + bias.reshape(1, -1, 1, 1)
+
+    return np.ascontiguousarray(out)
+
+
+def conv2d_transpose(input_data, weight, bias=None, stride=1, padding=0,
+                     groups=1, num_threads=None):
+    """
+    Batched 2D transposed convolution (as in torch.nn.ConvTranspose2d) built
+    on a single matrix multiplication followed by col2im.
+
+    Parameters
+    ----------
+    input_data: Input of shape (N, C, H, W)
+    weight: Filters of shape (C, F // groups, filter_h, filter_w)
+    bias: Optional bias of shape (F,)
+    stride: stride
+    padding: Padding removed from both sides of the output
+    groups: Number of blocked connections from input to output channels
+    num_threads: Number of BLAS threads used for the multiplication
+    Returns
+    -------
+    out : Output of shape (N, F, (H - 1) * stride - 2 * padding + filter_h,
+          (W - 1) * stride - 2 * padding + filter_w)
+    """
+    N, C, H, W = input_data.shape
+    C_weight, F_group, filter_h, filter_w = weight.shape
+    assert C == C_weight, 'Input and weight are not compatible'
+    assert C % groups == 0, 'Channels need to be divisible by groups'
+    F = F_group * groups
+
+    out_h = (H - 1) * stride - 2 * padding + filter_h
+    out_w = (W - 1) * stride - 2 * padding + filter_w
+
+    x = input_data.transpose(0, 2, 3, 1).reshape(N * H * W, groups, -1)
+    x = x.transpose(1, 0, 2)
+    weight_col = weight.reshape(groups, C // groups, -1)
+
+    with blas_threads(num_threads):
+        col = np.matmul(x, weight_col)
+
+    # (groups, N * H * W, F // groups * filter_h * filter_w) -> rows ordered
+    # like im2col with columns (F, filter_h, filter_w)
+    col = col.transpose(1, 0, 2).reshape(N * H * W, -1)
+    out = col2im(col, (N, F, out_h, out_w), filter_h, filter_w, stride, padding)
+    if bias is not None:
+        out = out + bias.reshape(1, -1, 1, 1)
+
+    return out
+
+
+def convolve2d_same(input_data, weight, bias=None):
+    """
+    Batched equivalent of summing scipy.signal.convolve2d(mode='same') over
+    the input channels for every filter, for odd filter sizes.
+
+    Parameters
+    ----------
+    input_data: Input of shape (C, H, W)
+    weight: Filters of shape (F, C, filter_h, filter_w)
+    bias: Optional bias of shape (F,)
+    Returns
+    -------
+    out : Output of shape (F, H, W)
+    """
+    assert weight.shape[2] == weight.shape[3] and weight.shape[2] % 2 == 1, \
+        'Only odd square filters are supported'
+
+    # Flipping the filters turns the convolution into a cross-correlation
+    return conv2d_forward(input_data[np.newaxis], weight[:, :, ::-1, ::-1],
+                          bias, padding=weight.shape[2] // 2)[0]
+
+
+def _shift_matrix(size1, size2, dtype=np.float64):
+    # shift[u, v, t] = 1 if u + v == t, used to sum kernel offsets of the
+    # two filters into the offsets of the composed filter.
+    shift = np.zeros((size1, size2, size1 + size2 - 1), dtype=dtype)
+    u, v = np.meshgrid(np.arange(size1), np.arange(size2), indexing='ij')
+    shift[u, v, u + v] = 1
+    return shift
+
+
+def compose_filters(f1, f2):
+    """
+    Compose two convolution filters into the single equivalent filter.
+
+    Applying f1 and then f2 (both as cross-correlations with stride 1 and no
+    non-linearity in between) is equal to applying the returned filter, i.e.
+    the full convolution of the two kernels summed over the intermediate
+    channels. The composition is computed with one tensordot over the
+    channels and one einsum over the kernel offsets and needs no input data.
+
+    Parameters
+    ----------
+    f1: First filter of shape (c_mid, c1, k1_h, k1_w)
+    f2: Second filter of shape (c2, c_mid, k2_h, k2_w)
+    Returns
+    -------
+    filter : Composed filter of shape (c2, c1, k1_h + k2_h - 1, k1_w + k2_w - 1)
+    """
+    c_mid, c1, k1_h, k1_w = f1.shape
+    c2, c_mid2, k2_h, k2_w = f2.shape
+    assert c_mid == c_mid2, 'Filters are not compatible'
+
+    # Sum over the intermediate channels first with a single BLAS call, the
+    # result has shape (c2, k2_h, k2_w, c1, k1_h, k1_w) ...
+    products = np.tensordot(f2, f1, axes=([1], [0]))
+    # ... then add up all pairs of kernel offsets which land on the same
+    # offset of the composed filter.
+    shift_h = _shift_matrix(k1_h, k2_h, products.dtype)
+    shift_w = _shift_matrix(k1_w, k2_w, products.dtype)
+
+    return np.einsum('ovxcuy,uvt,yxs->octs', products, shift_h, shift_w,
+                     optimize=True)
+
+
 def recover_input(input, kernel_size, stride, outshape):
     """
     :param input: it is of the shape (height, width)
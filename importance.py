@@ -0,0 +1,153 @@
+import torch as th
+
+CRITERIA = ('variance', 'gradient', 'norm')
+
+
+def top_units(scores, count):
+    r""" Units to be replicated, the most important first.
+
+    If more units are requested than there are, the ranking is repeated, so
+    the most important units are replicated most often.
+
+    :param scores: Importance of every unit
+    :param count: Number of units to be replicated
+
+    :return: LongTensor with count unit indices
+    """
+
+    order = th.sort(scores.detach().cpu().double(), descending=True)[1]
+    repeats = -(-count // order.numel())
+    return order.repeat(repeats)[:count]
+
+
+def weight_norm(layer):
+    r""" L2 norm of the weights of every output unit of a Conv2d/Linear layer.
+    """
+
+    weight = layer.weight.data
+    return weight.view(weight.size(0), -1).norm(2, 1)
+
+
+class ChannelStats(object):
+    r""" Streaming per-channel statistics of the outputs of layers.
+
+    Forward hooks stream the mean and variance of every output channel
+    (dimension 1) with the parallel form of Welford's algorithm and, if a
+    backward pass follows, the mean absolute gradient of every channel. No
+    activations are retained between batches.
+
+    :param model: Network, e.g. the teacher
+    :param layers: Names of the layers to be monitored
+    """
+
+    def __init__(self, model, layers):
+        self.stats = {}
+        self.handles = []
+        modules = dict(model.named_modules())
+        for name in layers:
+            self.stats[name] = {'count': 0, 'mean': 0., 'm2': 0.,
+                                'grad_count': 0, 'grad': 0.}
+            self.handles.append(modules[name].register_forward_hook(
+                self._forward_hook(self.stats[name])))
+
+    @staticmethod
+    def _channels(tensor):
+        # (channels, values) view of a (N, C, ...) tensor
+        tensor = tensor.detach().double()
+        return tensor.transpose(0, 1).contiguous().view(tensor.size(1), -1)
+
+    def _forward_hook(self, stat):
+        def hook(module, input, output):
+            values = self._channels(output)
+            n = values.size(1)
+            batch_mean = values.mean(1)
+            batch_m2 = ((values - batch_mean.unsqueeze(1)) ** 2).sum(1)
+            total = stat['count'] + n
+            delta = batch_mean - stat['mean']
+            stat['mean'] = stat['mean'] + delta * n / total
+            stat['m2'] = stat['m2'] + batch_m2 + \
+                delta ** 2 * stat['count'] * n / total
+            stat['count'] = total
+
+            if output.requires_grad:
+                output.register_hook(self._backward_hook(stat))
+        return hook
+
+    def _backward_hook(self, stat):
+        def hook(grad):
+            values = self._channels(grad).abs()
+            stat['grad'] = stat['grad'] + values.sum(1)
+            stat['grad_count'] += values.size(1)
+        return hook
+
+    def remove(self):
+        r""" Remove the hooks from the network. """
+
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def scores(self, name, criterion='variance'):
+        r""" Importance of every output channel of a monitored layer.
+
+        :param name: Name of the layer
+        :param criterion: 'variance' of the activations or mean absolute
+         'gradient'
+
+        :return: tensor with a score per channel
+        """
+
+        stat = self.stats[name]
+        if criterion == 'variance':
+            assert stat['count'] > 0, 'No batch has been seen'
+            return stat['m2'] / stat['count']
+        assert criterion == 'gradient', 'Unknown criterion {}'.format(criterion)
+        assert stat['grad_count'] > 0, 'No gradient has been seen'
+        return stat['grad'] / stat['grad_count']
+
+
+def collect_scores(model, layers, batches, criterion='variance',
+                   loss_fn=None):
+    r""" Importance of the output units of layers from a few batches.
+
+    The network is run in eval mode, so BN statistics are not updated, and is
+    left unchanged. Gradients are only computed for the 'gradient' criterion.
+
+    :param model: Network, e.g. the teacher
+    :param layers: Names of the layers
+    :param batches: Iterable of (inputs, targets) pairs, e.g. a few batches
+     of a DataLoader
+    :param criterion: 'variance', 'gradient' or 'norm' (weight norm, no
+     batches needed)
+    :param loss_fn: Loss of (outputs, targets), needed for 'gradient'
+
+    :return: dict with the scores of every layer
+    """
+
+    assert criterion in CRITERIA, 'Unknown criterion {}'.format(criterion)
+    if criterion == 'norm':
+        modules = dict(model.named_modules())
+        return dict((name, weight_norm(modules[name])) for name in layers)
+    assert criterion != 'gradient' or loss_fn is not None, \
+        'A loss is needed for gradient scores'
+
+    training = model.training
+    model.eval()
+    stats = ChannelStats(model, layers)
+    try:
+        for inputs, targets in batches:
+            if criterion == 'gradient':
+                with th.enable_grad():
+                    outputs = model(inputs)
+                    grads = th.autograd.grad(
+                        loss_fn(outputs, targets),
+                        [p for p in model.parameters() if p.requires_grad],
+                        allow_unused=True)
+                del grads
+            else:
+                with th.no_grad():
+                    model(inputs)
+    finally:
+        stats.remove()
+        model.train(training)
+    return dict((name, stats.scores(name, criterion)) for name in layers)
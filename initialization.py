@@ -0,0 +1,51 @@
+import functools
+import torch.nn as nn
+from contextlib import contextmanager
+
+# Layers whose weights are initialised in reset_parameters(). The parameters
+# of BN layers are cheap to initialise and are left alone.
+INITIALISED_LAYERS = (nn.Linear, nn.modules.conv._ConvNd)
+
+
+def _skip_reset_parameters(self):
+    pass
+
+
+@contextmanager
+def skip_init(enabled=True):
+    r""" Construct Conv/Linear layers without initialising their weights.
+
+    Inside the context the parameters of new Conv/Linear layers are allocated
+    but left uninitialised, which is only correct if every one of them is
+    overwritten afterwards, e.g. by a transform or a checkpoint load. The
+    layer classes are patched while the context is active, so layers built
+    by other threads are affected as well.
+
+    :param enabled: Skip initialisation only if True, for conditional use
+    """
+
+    if not enabled:
+        yield
+        return
+
+    originals = [(cls, cls.__dict__['reset_parameters'])
+                 for cls in INITIALISED_LAYERS]
+    for cls, _ in originals:
+        cls.reset_parameters = _skip_reset_parameters
+    try:
+        yield
+    finally:
+        for cls, reset_parameters in originals:
+            cls.reset_parameters = reset_parameters
+
+
+def without_init(fn):
+    r""" Decorator running a function inside skip_init(), for transforms which
+    overwrite the weights of every layer they construct.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with skip_init():
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,166 @@
+import torch as th
+
+ERROR_TOLERANCE = 1e-3
+
+
+class RunningStat(object):
+    r""" Streaming mean, variance and maximum of a sequence of tensors.
+
+    Batches are merged with the parallel form of Welford's algorithm, so no
+    values are retained between updates.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = 0.0
+
+    def update(self, values):
+        values = values.detach().double()
+        n = values.numel()
+        if n == 0:
+            return
+
+        batch_mean = values.mean().item()
+        batch_m2 = ((values - batch_mean) ** 2).sum().item()
+        total = self.count + n
+        delta = batch_mean - self.mean
+
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.max = max(self.max, values.max().item())
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else 0.0
+
+    def __repr__(self):
+        return 'RunningStat(count={}, mean={}, std={}, max={})'.format(
+            self.count, self.mean, self.variance ** 0.5, self.max)
+
+
+class DriftMonitor(object):
+    r""" Per-layer deviation between a teacher and a student network.
+
+    Forward hooks are registered on the modules with the same name in both
+    networks. Running the networks in lockstep on the same batch streams the
+    absolute difference of every module output into a RunningStat. For
+    widened layers only the channels which exist in the teacher are compared
+    and a deepened layer (a Sequential replacing a module of the same name) is
+    compared as a whole. Teacher outputs are only kept until the student has
+    consumed them within the same step.
+
+    Note that modules behaving differently in train and eval mode (e.g. BN)
+    should be in the same mode in both networks.
+
+    :param teacher: Network before the transformation
+    :param student: Network after the transformation
+    :param layers: Names of the modules to be monitored, default all modules
+     present in both networks.
+    :param tolerance: Deviation above which preservation is considered broken
+    :param max_steps: Remove the hooks after this many steps, e.g. to monitor
+     only the first steps of training the student.
+    """
+
+    def __init__(self, teacher, student, layers=None, tolerance=ERROR_TOLERANCE,
+                 max_steps=None):
+        self.teacher = teacher
+        self.student = student
+        self.tolerance = tolerance
+        self.max_steps = max_steps
+        self.steps = 0
+
+        teacher_modules = dict(teacher.named_modules())
+        student_modules = dict(student.named_modules())
+        if layers is None:
+            layers = [name for name in teacher_modules
+                      if name and name in student_modules]
+
+        self.stats = dict((name, RunningStat()) for name in layers)
+        self.order = []
+        self._pending = {}
+        self._handles = []
+        for name in layers:
+            self._handles.append(teacher_modules[name].register_forward_hook(
+                self._teacher_hook(name)))
+            self._handles.append(student_modules[name].register_forward_hook(
+                self._student_hook(name)))
+
+    def _teacher_hook(self, name):
+        def hook(module, input, output):
+            if not th.is_tensor(output):
+                return
+            if name not in self.order:
+                self.order.append(name)
+            self._pending[name] = output.detach()
+        return hook
+
+    def _student_hook(self, name):
+        def hook(module, input, output):
+            teacher_output = self._pending.pop(name, None)
+            if teacher_output is None or not th.is_tensor(output):
+                return
+
+            output = output.detach()
+            if output.shape != teacher_output.shape:
+                # Widened layer: compare the channels of the teacher only
+                if (output.dim() != teacher_output.dim() or
+                        output.size(0) != teacher_output.size(0) or
+                        output.shape[2:] != teacher_output.shape[2:] or
+                        output.size(1) < teacher_output.size(1)):
+                    return
+                output = output.narrow(1, 0, teacher_output.size(1))
+
+            self.stats[name].update((output - teacher_output).abs())
+        return hook
+
+    def step(self, inputs):
+        r""" Run the teacher and the student on the same batch.
+
+        The teacher runs under torch.no_grad, the student output is returned
+        unchanged so it can be used for training.
+        """
+
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            self.remove()
+            return self.student(inputs)
+
+        with th.no_grad():
+            self.teacher(inputs)
+        output = self.student(inputs)
+        self._pending.clear()
+        self.steps += 1
+        return output
+
+    def first_divergence(self):
+        r""" Name of the first module (in execution order of the teacher)
+        whose deviation exceeds the tolerance, None if preserved.
+        """
+
+        for name in self.order:
+            if self.stats[name].max > self.tolerance:
+                return name
+        return None
+
+    def report(self):
+        r""" Per-layer deviation statistics in execution order.
+
+        :return: list of dicts with name, count, mean, std and max deviation
+        """
+
+        return [{'name': name,
+                 'count': self.stats[name].count,
+                 'mean': self.stats[name].mean,
+                 'std': self.stats[name].variance ** 0.5,
+                 'max': self.stats[name].max}
+                for name in self.order]
+
+    def remove(self):
+        r""" Remove all hooks from the networks. """
+
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._pending.clear()
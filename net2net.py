@@ -1,8 +1,14 @@
 import torch as th
 import torch.nn as nn
 import numpy as np
-import random
 import sys
+import alignment
+import growable
+import im2col
+import importance
+import profiling
+import transform
+from initialization import without_init
 
 sys.path.append('./')
 from utils import add_noise
@@ -39,42 +45,13 @@ def _test_wider_operation():
 
 def verify_weights(teacher_w1, teacher_b1, teacher_w2,
                    student_w1, student_b1, student_w2):
-    import scipy.signal
     test_input = np.random.rand(teacher_w1.shape[1], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4)
-    ori1 = np.zeros((teacher_w1.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    ori2 = np.zeros((teacher_w2.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    new1 = np.zeros((student_w1.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    new2 = np.zeros((student_w2.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-
-    for i in range(teacher_w1.shape[0]):
-        for j in range(test_input.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(test_input[j], teacher_w1[i, j], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(test_input[j], teacher_w1[i, j], mode='same')
-        ori1[i] = tmp + teacher_b1[i]
-    for i in range(teacher_w2.shape[0]):
-        for j in range(ori1.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(ori1[j], teacher_w2[i, j], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(ori1[j], teacher_w2[i, j], mode='same')
-        ori2[i] = tmp
 
-    for i in range(student_w1.shape[0]):
-        for j in range(test_input.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(test_input[j], student_w1[i, j], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(test_input[j], student_w1[i, j], mode='same')
-        new1[i] = tmp + student_b1[i]
-    for i in range(student_w2.shape[0]):
-        for j in range(new1.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(new1[j], student_w2[i, j], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(new1[j], student_w2[i, j], mode='same')
-        new2[i] = tmp
+    ori1 = im2col.convolve2d_same(test_input, teacher_w1, teacher_b1)
+    ori2 = im2col.convolve2d_same(ori1, teacher_w2)
+
+    new1 = im2col.convolve2d_same(test_input, student_w1, student_b1)
+    new2 = im2col.convolve2d_same(new1, student_w2)
 
     err = np.abs(np.sum(ori2 - new2))
 
@@ -82,112 +59,143 @@ def verify_weights(teacher_w1, teacher_b1, teacher_w2,
     assert err < ERROR_TOLERANCE, 'Verification failed: [ERROR] {}'.format(err)
 
 
-def wider(layer1, layer2, new_width, bnorm=None):
+@profiling.profiled('net2net.wider')
+@without_init
+def wider(layer1, layer2, new_width, bnorm=None, return_mapping=False,
+          align=None, scores=None, out_size=None):
+    r""" Net2Net widening of a layer and the input of the next layer.
+
+    A Linear layer following a conv layer sees the flattened (C, H, W)
+    output, i.e. every channel is a block of H * W consecutive features
+    whatever the spatial shape and pooling in between.
+
+    :param layer1: Layer to be widened
+    :param layer2: Layer following layer1
+    :param new_width: New number of output channels/features of layer1
+    :param bnorm: BN layer between the layers if any
+    :param return_mapping: Also return the teacher unit of every unit
+    :param align: Round new_width up to a multiple of align
+    :param scores: Importance of every unit of layer1, the most important
+     units are replicated instead of random ones
+    :param out_size: Spatial shape (H, W) of the output of layer1 as seen by
+     a Linear layer2, e.g. from analysis.analyse(), checked if given
+
+    :return: widened layers and BN layer (and the mapping)
+    """
 
     print 'Net2Net Widening... '
+    new_width = alignment.align_width(new_width, align)
+    if getattr(layer1, 'groups', 1) > 1 or getattr(layer2, 'groups', 1) > 1:
+        # Units are replicated within their group, the group counts are kept
+        assert not return_mapping, 'No mapping for grouped convolutions'
+        transform.wider_layers('net2net', layer1, layer2, new_width,
+                               bnorm1=bnorm, scores=scores)
+        return layer1, layer2, bnorm
+    if isinstance(layer1, growable.Growable) and \
+            isinstance(layer2, growable.Growable):
+        # Widened in place, the layers keep their Parameter objects
+        return growable.wider(layer1, layer2, new_width, bnorm,
+                              return_mapping=return_mapping, scores=scores)
+
     w1 = layer1.weight.data
     w2 = layer2.weight.data
-    b1 = layer1.bias.data
-    b2 = layer2.bias.data
+    b1 = layer1.bias.data if layer1.bias is not None else None
+    b2 = layer2.bias.data if layer2.bias is not None else None
 
     if isinstance(layer1, nn.Conv2d) and (isinstance(layer2, nn.Conv2d)
                                           or isinstance(layer2, nn.Linear)):
 
-        # Convert Linear layers to Conv if linear layer follows target layer
+        # View the Linear weights as (out, channels, spatial positions) if a
+        # linear layer follows the target layer
+        features = 1
         if isinstance(layer1, nn.Conv2d) and isinstance(layer2, nn.Linear):
-	    print w2.shape
-	    print w1.shape
-	    print w2.size(1)
-	    print w1.size(0)
             assert w2.size(1) % w1.size(0) == 0, 'Linear units need to be multiple'
-            if w1.dim() == 4:
-                kernel_size = int(np.sqrt(w2.size(1) // w1.size(0)))
-		print kernel_size
-		exit()
-                w2 = w2.view(
-                    w2.size(0), w2.size(1) // kernel_size ** 2, kernel_size, kernel_size)
+            features = w2.size(1) // w1.size(0)
+            assert out_size is None or int(np.prod(out_size)) == features, \
+                'Output size {} does not match the Linear layer'.format(
+                    out_size)
+            w2 = w2.view(w2.size(0), w1.size(0), features)
         else:
             assert w1.size(0) == w2.size(1), "Module weights are not compatible"
 
         assert new_width > w1.size(0), "New size should be larger"
 
-        nw1 = w1.clone()
-        nb1 = b1.clone()
-        nw2 = w2.clone()
+        # The teacher tensors are not cloned, the first concatenation below
+        # copies them before anything is written.
+        nw1 = w1
+        nb1 = b1
+        nw2 = w2
 
         old_width = w1.size(0)
 
-        if bnorm is not None:
-            nrunning_mean = bnorm.running_mean.clone().resize_(new_width)
-            nrunning_var = bnorm.running_var.clone().resize_(new_width)
-            if bnorm.affine:
-                nweight = bnorm.weight.data.clone().resize_(new_width)
-                nbias = bnorm.bias.data.clone().resize_(new_width)
-
-        if isinstance(layer1, nn.Conv2d):
-            new_current_layer = nn.Conv2d(
-                out_channels=new_width, in_channels=layer1.in_channels,
-                kernel_size=(3, 3), stride=1, padding=1)
-        else:
-            new_current_layer = nn.Linear(
-                in_features=layer1.out_channels * layer1.kernel_size[0] * layer1.kernel_size[1],
-                out_features=layer2.out_features)
-
-        rand_ids = th.tensor(random.sample(range(w1.shape[0]), new_width - w1.shape[0]))
-        replication_factor = np.bincount(rand_ids)
-
-        for i in range(rand_ids.numel()):
-            teacher_index = int(rand_ids[i].item())
-            new_weight = w1.select(0, teacher_index)
-            new_weight = add_noise(new_weight, nw1)
-            new_weight = new_weight.unsqueeze(0)
-            nw1 = th.cat((nw1, new_weight), dim=0)
-
-            new_bias = b1[teacher_index].unsqueeze(0)
-            nb1 = th.cat((nb1, new_bias))
-
+        with profiling.span('bnorm_resize'):
             if bnorm is not None:
-                nrunning_mean[old_width + i] = bnorm.running_mean[teacher_index]
-                nrunning_var[old_width + i] = bnorm.running_var[teacher_index]
+                nrunning_mean = bnorm.running_mean.clone().resize_(new_width)
+                nrunning_var = bnorm.running_var.clone().resize_(new_width)
                 if bnorm.affine:
-                    nweight[old_width + i] = bnorm.weight.data[teacher_index]
-                    nbias[old_width + i] = bnorm.bias.data[teacher_index]
+                    nweight = bnorm.weight.data.clone().resize_(new_width)
+                    nbias = bnorm.bias.data.clone().resize_(new_width)
+
+        with profiling.span('construct'):
+            new_current_layer = transform.resized_layer(layer1,
+                                                        out_width=new_width)
+
+        with profiling.span('sample'):
+            if scores is not None:
+                # Replicate the most important channels
+                rand_ids = importance.top_units(scores, new_width - w1.shape[0])
+            else:
+                rand_ids = th.randint(low=0, high=w1.shape[0],
+                                      size=(new_width - w1.shape[0],))
+
+        with profiling.span('replicate_out'):
+            for i in range(rand_ids.numel()):
+                teacher_index = int(rand_ids[i].item())
+                new_weight = w1.select(0, teacher_index)
+                with profiling.span('noise'):
+                    new_weight = add_noise(new_weight, nw1)
+                new_weight = new_weight.unsqueeze(0)
+                nw1 = th.cat((nw1, new_weight), dim=0)
+                profiling.record_copy(nw1)
+
+                if b1 is not None:
+                    new_bias = b1[teacher_index].unsqueeze(0)
+                    nb1 = th.cat((nb1, new_bias))
+                    profiling.record_copy(nb1)
+
+                if bnorm is not None:
+                    nrunning_mean[old_width + i] = bnorm.running_mean[teacher_index]
+                    nrunning_var[old_width + i] = bnorm.running_var[teacher_index]
+                    if bnorm.affine:
+                        nweight[old_width + i] = bnorm.weight.data[teacher_index]
+                        nbias[old_width + i] = bnorm.bias.data[teacher_index]
 
         new_current_layer.weight.data = nw1
-        new_current_layer.bias.data = nb1
+        if b1 is not None:
+            new_current_layer.bias.data = nb1
         layer1 = new_current_layer
 
-        # Copy the weights from input channel of next layer and append it after
-        # dividing the selected filter by replication factor.
-        for i in range(rand_ids.numel()):
-            teacher_index = int(rand_ids[i].item())
-            factor = replication_factor[teacher_index] + 1
-            assert factor > 1, 'Error in Net2Wider'
-            # Calculate new weight according to replication factor
-            new_weight = w2.select(1, teacher_index) * (1. / factor)
-            # Append the new weight increasing its input channel
-            new_weight_re = new_weight.unsqueeze(1)
-            nw2 = th.cat((nw2, new_weight_re), dim=1)
-            # Assign the calculated new weight to replicated filter
-            nw2[:, teacher_index, :, :] = new_weight
-
-        if isinstance(layer2, nn.Conv2d):
-            new_next_layer = nn.Conv2d(out_channels=layer2.out_channels,
-                                       in_channels=new_width,
-                                       kernel_size=(3, 3), stride=1, padding=1)
-            new_next_layer.weight.data = nw2
-        else:
-            new_next_layer = nn.Linear(
-                in_features=layer1.out_channels * layer1.kernel_size[0] * layer1.kernel_size[1],
-                out_features=layer2.out_features)
-            # Convert the 4D tensor to 2D tensor for linear layer i.e. reverse
-            # the earlier effect when linear layer was converted to
-            # convolutional layer.
-            new_next_layer.weight.data = nw2.view(
-                layer2.weight.size(0), new_width * kernel_size ** 2)
+        # Gather the input channels (blocks of features) of the next layer in
+        # a single step, every replicated channel divided by its replication
+        # factor.
+        with profiling.span('replicate_in'):
+            mapping = th.cat((th.arange(old_width), rand_ids.long())).to(
+                w2.device)
+            factors = th.bincount(mapping, minlength=old_width).to(w2.dtype)
+            scale = (1. / factors[mapping]).view(
+                (1, -1) + (1,) * (w2.dim() - 2))
+            nw2 = w2[:, mapping] * scale
+            profiling.record_copy(nw2)
+
+        with profiling.span('construct'):
+            new_next_layer = transform.resized_layer(
+                layer2, in_width=new_width * features)
+            # Back to the (out, in_features) shape of a linear layer
+            new_next_layer.weight.data = nw2.view(new_next_layer.weight.shape)
 
         # Set the bias for new next layer as previous bias for next layer
-        new_next_layer.bias.data = b2
+        if b2 is not None:
+            new_next_layer.bias.data = b2
         layer2 = new_next_layer
 
         if bnorm is not None:
@@ -198,9 +206,187 @@ def wider(layer1, layer2, new_width, bnorm=None):
                 bnorm.weight.data = nweight
                 bnorm.bias.data = nbias
 
+        if return_mapping:
+            # Teacher channel each student channel was replicated from
+            return layer1, layer2, bnorm, mapping.cpu()
+
         return layer1, layer2, bnorm
 
 
+@profiling.profiled('net2net.wider_depthwise')
+def wider_depthwise(layer1, depthwise, layer2, new_width, bnorm1=None,
+                    bnorm2=None, align=None, scores=None):
+    r""" Widen a layer, the depthwise convolution following it and the
+    input of the next layer, e.g. the pointwise convolutions around the
+    depthwise convolution of a MobileNet block.
+
+    Every replicated channel of layer1 gets a copy of the depthwise group of
+    its channel, so the depthwise convolution keeps one group per channel.
+    The layers are widened in place.
+
+    :param layer1: Layer whose output channels are replicated
+    :param depthwise: Depthwise convolution following layer1
+    :param layer2: Layer consuming the output of the depthwise convolution
+    :param new_width: New number of output channels of layer1
+    :param bnorm1: BN layer between layer1 and depthwise if any
+    :param bnorm2: BN layer between depthwise and layer2 if any
+    :param align: Round new_width up to a multiple of align
+    :param scores: Importance of every channel of layer1
+
+    :return: the widened layers and BN layers
+    """
+
+    print 'Net2Net Depthwise Widening... '
+    new_width = alignment.align_width(new_width, align)
+    transform.wider_layers('net2net', layer1, layer2, new_width,
+                           bnorm1=bnorm1, depthwise=depthwise, bnorm2=bnorm2,
+                           scores=scores)
+    return layer1, depthwise, layer2, bnorm1, bnorm2
+
+
+def _effective_units(layer1, bnorm):
+    # Incoming weights and bias of every unit after the (eval-mode) BN layer,
+    # i.e. the affine function feeding the non-linearity.
+    rows = layer1.weight.data.view(layer1.weight.size(0), -1)
+    if layer1.bias is not None:
+        shift = layer1.bias.data
+    else:
+        shift = th.zeros_like(rows[:, 0])
+    if bnorm is not None:
+        scale = 1. / th.sqrt(bnorm.running_var + bnorm.eps)
+        shift = (shift - bnorm.running_mean) * scale
+        if bnorm.affine:
+            scale = scale * bnorm.weight.data
+            shift = shift * bnorm.weight.data + bnorm.bias.data
+        rows = rows * scale.view(-1, 1)
+    return th.cat((rows, shift.view(-1, 1)), dim=1)
+
+
+@profiling.profiled('net2net.narrower')
+@without_init
+def narrower(layer1, layer2, new_width, bnorm=None, mapping=None,
+             importance='norm', return_mapping=False):
+    r""" Inverse of the wider operator removing units of a layer.
+
+    The surviving units are the most important ones. If the mapping returned
+    by wider is given, one unit of every group of replicated units survives
+    first, so narrowing a freshly widened pair back to its original width
+    restores the teacher function. The input channels of layer2 belonging to
+    a removed unit are folded into the surviving unit it was replicated from
+    or, without mapping, the most similar one. The input slice of the removed
+    unit is scaled by the least squares factor between the two units (after
+    BN). This is exact for replicated units, as ReLU is positively
+    homogeneous.
+
+    :param layer1: Layer to be narrowed (Conv2d or Linear)
+    :param layer2: Layer following layer1 (Conv2d or Linear)
+    :param new_width: Number of output channels/features of layer1 to keep
+    :param bnorm: BN layer between the two layers if any, narrowed in place
+    :param mapping: Teacher unit of every unit as returned by wider
+    :param importance: 'norm' to rank units by the norm of their incoming
+     (after BN) times outgoing weights, or a tensor of scores per unit e.g.
+     mean absolute activations.
+    :param return_mapping: Also return the index of every surviving unit
+
+    :return: narrowed layer1, layer2 and bnorm (and the surviving units)
+    """
+
+    print 'Net2Net Narrowing... '
+    for layer in (layer1, layer2):
+        if not isinstance(layer, (nn.Conv2d, nn.Linear)):
+            raise RuntimeError(
+                "{} Module not supported".format(layer.__class__.__name__))
+    assert getattr(layer1, 'groups', 1) == 1 and \
+        getattr(layer2, 'groups', 1) == 1, 'Grouped convolutions not supported'
+
+    w1 = layer1.weight.data
+    w2 = layer2.weight.data
+    old_width = w1.size(0)
+    assert 0 < new_width < old_width, 'New size should be smaller'
+    assert w2.size(1) % old_width == 0, 'Module weights are not compatible'
+    # Input slice of every unit: kernel positions of a conv layer or the
+    # flattened positions seen by a Linear layer following a conv layer.
+    w2 = w2.view(w2.size(0), old_width, -1)
+
+    with profiling.span('select'):
+        units = _effective_units(layer1, bnorm)
+        if isinstance(importance, str):
+            assert importance == 'norm', \
+                'Unknown importance {}'.format(importance)
+            scores = units.norm(2, 1) * \
+                w2.transpose(0, 1).contiguous().view(old_width, -1).norm(2, 1)
+        else:
+            scores = th.as_tensor(importance, dtype=units.dtype,
+                                  device=units.device)
+            assert scores.numel() == old_width, 'One score per unit needed'
+        scores = scores.tolist()
+
+        representative = {}
+        if mapping is not None:
+            mapping = th.as_tensor(mapping).long().tolist()
+            assert len(mapping) == old_width, \
+                'Mapping does not match the layer'
+            for unit, teacher_unit in enumerate(mapping):
+                representative.setdefault(teacher_unit, unit)
+        first_units = set(representative.values())
+
+        order = sorted(range(old_width),
+                       key=lambda unit: (unit not in first_units,
+                                         -scores[unit]))
+        keep = sorted(order[:new_width])
+        removed = sorted(order[new_width:])
+
+    with profiling.span('fold'):
+        position = dict((unit, i) for i, unit in enumerate(keep))
+        keep_ids = th.tensor(keep, dtype=th.long, device=w1.device)
+        new_w2 = w2[:, keep_ids]
+        profiling.record_copy(new_w2)
+
+        kept_units = units[keep_ids]
+        norms = kept_units.norm(2, 1).clamp(min=1e-12)
+        for unit in removed:
+            similarity = th.mv(kept_units, units[unit])
+            target = representative.get(mapping[unit]) \
+                if mapping is not None else None
+            if target is None or target not in position:
+                target = keep[int((similarity / norms).argmax())]
+            i = position[target]
+            # Least squares factor between the two units, relu(a * x) is
+            # a * relu(x) only for a positive factor.
+            factor = similarity[i].item() / norms[i].item() ** 2
+            if factor > 0:
+                new_w2[:, i] += factor * w2[:, unit]
+
+    with profiling.span('construct'):
+        new_current_layer = transform.resized_layer(layer1,
+                                                    out_width=new_width)
+        new_current_layer.weight.data = w1[keep_ids]
+        if layer1.bias is not None:
+            new_current_layer.bias.data = layer1.bias.data[keep_ids]
+
+        # A Linear layer sees every position of the kept units
+        in_width = new_width if isinstance(layer2, nn.Conv2d) \
+            else new_w2[0].numel()
+        new_next_layer = transform.resized_layer(layer2, in_width=in_width)
+        new_next_layer.weight.data = new_w2.view(new_next_layer.weight.shape)
+        if layer2.bias is not None:
+            new_next_layer.bias.data = layer2.bias.data
+
+    if bnorm is not None:
+        bnorm.num_features = new_width
+        bnorm.running_mean = bnorm.running_mean[keep_ids]
+        bnorm.running_var = bnorm.running_var[keep_ids]
+        if bnorm.affine:
+            bnorm.weight.data = bnorm.weight.data[keep_ids]
+            bnorm.bias.data = bnorm.bias.data[keep_ids]
+
+    if return_mapping:
+        return new_current_layer, new_next_layer, bnorm, keep_ids
+    return new_current_layer, new_next_layer, bnorm
+
+
+@profiling.profiled('net2net.deeper')
+@without_init
 def deeper(layer, activation_fn=nn.ReLU(), bnorm=True, prefix='', filters=16):
     r""" Function preserving deeper operator adding a new layer on top of the
     given layer.
@@ -227,9 +413,12 @@ def deeper(layer, activation_fn=nn.ReLU(), bnorm=True, prefix='', filters=16):
             # Create new linear layer with input and output features equal to
             # output features of a dense layer on top of which a new dense layer
             # is being added.
-            new_layer = th.nn.Linear(layer.out_features, layer.out_features)
-            new_layer.weight.data = th.eye(layer.out_features)
-            new_layer.bias.data = th.zeros(layer.out_features)
+            with profiling.span('construct'):
+                new_layer = th.nn.Linear(layer.out_features, layer.out_features,
+                                         bias=layer.bias is not None)
+                new_layer.weight.data = th.eye(layer.out_features)
+                if new_layer.bias is not None:
+                    new_layer.bias.data = th.zeros(layer.out_features)
 
             if bnorm:
                 new_num_features = layer.out_features
@@ -240,24 +429,41 @@ def deeper(layer, activation_fn=nn.ReLU(), bnorm=True, prefix='', filters=16):
             # Create new convolutional layer with number of input and output
             # channels equal to number of output channel of the layer on top of
             # which new layer will be placed. The filter shape will be same. And
-            # a padding of 1 is added to maintain previous output dimension.
-            new_layer = th.nn.Conv2d(new_num_channels, new_num_channels,
-                                     kernel_size=layer.kernel_size, padding=1)
-
-            new_layer_weight = th.zeros(
-                (new_num_channels, new_num_channels) + new_kernel_shape)
-            center = tuple(map(lambda x: int((x - 1) / 2), new_kernel_shape))
-            for i in range(new_num_channels):
-                filter_weight = th.zeros((new_num_channels,) + new_kernel_shape)
-                index = (i,) + center
-                filter_weight[index] = 1
-                new_layer_weight[i, ...] = filter_weight
-
-            new_layer_bias = th.zeros(new_num_channels)
+            # the padding keeps the output size with the dilation of the layer.
+            # Grouped (e.g. depthwise) layers get a grouped identity layer.
+            assert all(k % 2 == 1 for k in new_kernel_shape), \
+                'Kernel size needs to be odd'
+            groups = layer.groups
+            group_channels = new_num_channels // groups
+            padding = tuple(d * (k - 1) // 2 for k, d in
+                            zip(new_kernel_shape, layer.dilation))
+            with profiling.span('construct'):
+                new_layer = th.nn.Conv2d(new_num_channels, new_num_channels,
+                                         kernel_size=layer.kernel_size,
+                                         padding=padding,
+                                         dilation=layer.dilation,
+                                         groups=groups,
+                                         bias=layer.bias is not None)
+
+                new_layer_weight = th.zeros(
+                    (new_num_channels, group_channels) + new_kernel_shape)
+                center = tuple(map(lambda x: int((x - 1) / 2),
+                                   new_kernel_shape))
+                for i in range(new_num_channels):
+                    filter_weight = th.zeros(
+                        (group_channels,) + new_kernel_shape)
+                    index = (i % group_channels,) + center
+                    filter_weight[index] = 1
+                    new_layer_weight[i, ...] = filter_weight
+
+                new_layer_bias = th.zeros(new_num_channels)
             # Set new weight and bias for new convolutional layer
             # new_layer.weight.data = new_layer_weight
-            new_layer.weight.data = add_noise(new_layer_weight.cuda(), layer.weight.data)
-            new_layer.bias.data = new_layer_bias
+            with profiling.span('noise'):
+                new_layer.weight.data = add_noise(
+                    new_layer_weight.to(layer.weight.device), layer.weight.data)
+            if new_layer.bias is not None:
+                new_layer.bias.data = new_layer_bias
 
             # Set noise as initial weight and bias for all parameter values for
             # BN layer
@@ -266,19 +472,25 @@ def deeper(layer, activation_fn=nn.ReLU(), bnorm=True, prefix='', filters=16):
                 new_bn_layer = nn.BatchNorm2d(num_features=new_num_features)
 
         if bnorm:
-            new_bn_layer.weight.data = add_noise(
-                th.ones(new_num_features).cuda(), th.Tensor([0, 1]))
-            new_bn_layer.bias.data = add_noise(
-                th.zeros(new_num_features).cuda(), th.Tensor([0, 1]))
-            new_bn_layer.running_mean.data = add_noise(
-                th.zeros(new_num_features).cuda(), th.Tensor([0, 1]))
-            new_bn_layer.running_var.data = add_noise(
-                th.ones(new_num_features).cuda(), th.Tensor([0, 1]))
+            with profiling.span('bnorm'):
+                device = layer.weight.device
+                new_bn_layer.weight.data = add_noise(
+                    th.ones(new_num_features, device=device),
+                    th.Tensor([0, 1]))
+                new_bn_layer.bias.data = add_noise(
+                    th.zeros(new_num_features, device=device),
+                    th.Tensor([0, 1]))
+                new_bn_layer.running_mean.data = add_noise(
+                    th.zeros(new_num_features, device=device),
+                    th.Tensor([0, 1]))
+                new_bn_layer.running_var.data = add_noise(
+                    th.ones(new_num_features, device=device),
+                    th.Tensor([0, 1]))
     else:
         raise RuntimeError(
             "{} Module not supported".format(layer.__class__.__name__))
 
-    seq_container = th.nn.Sequential().cuda()
+    seq_container = th.nn.Sequential()
     seq_container.add_module(prefix + '_conv', layer)
     if bnorm:
         seq_container.add_module(prefix + '_bnorm', new_bn_layer)
@@ -2,9 +2,17 @@ import torch as th
 import numpy as np
 from collections import Counter
 
+import alignment
+import importance
+import profiling
+import transform
+from initialization import without_init
 
+
+@profiling.profiled('net2net_original.wider')
 def wider(m1, m2, new_width, bnorm=None, out_size=None, noise=True,
-          random_init=False, weight_norm=True):
+          random_init=False, weight_norm=True, return_mapping=False,
+          align=None, scores=None):
     """
     Convert m1 layer to its wider version by adapthing next weight layer and
     possible batch norm layer in btw.
@@ -13,68 +21,86 @@ def wider(m1, m2, new_width, bnorm=None, out_size=None, noise=True,
         m2 - follwing module to be adapted to m1
         new_width - new width for m1.
         bn (optional) - batch norm layer, if there is btw m1 and m2
-        out_size (list, optional) - necessary for m1 == conv3d and m2 == linear. It
-            is 3rd dim size of the output feature map of m1. Used to compute
-            the matching Linear layer size
+        out_size (list, optional) - spatial size of the output feature map of
+            m1 when m2 is linear, (H, W) for conv2d, necessary (D, H, W) for
+            conv3d. Checked against the Linear layer size, conv2d channels
+            are blocks of consecutive features whatever their shape.
         noise (bool, True) - add a slight noise to break symmetry btw weights.
         random_init (optional, True) - if True, new weights are initialized
             randomly.
         weight_norm (optional, True) - If True, weights are normalized before
             transfering.
+        return_mapping (optional, False) - If True, also return the teacher
+            unit each unit of the wider m1 was copied from.
+        align (optional, None) - round new_width up to a multiple of align.
+        scores (optional, None) - importance of every unit of m1, the most
+            important units are replicated instead of random ones.
     """
 
+    new_width = alignment.align_width(new_width, align)
+    if getattr(m1, 'groups', 1) > 1 or getattr(m2, 'groups', 1) > 1:
+        # Units are replicated within their group, the group counts are kept
+        assert not return_mapping, 'No mapping for grouped convolutions'
+        assert not random_init, 'Grouped convolutions are only replicated'
+        transform.wider_layers('net2net_original', m1, m2, new_width,
+                               bnorm1=bnorm, scores=scores, noise=noise)
+        return m1, m2, bnorm
+
     w1 = m1.weight.data
     w2 = m2.weight.data
-    b1 = m1.bias.data
+    b1 = m1.bias.data if m1.bias is not None else None
 
     if "Conv" in m1.__class__.__name__ or "Linear" in m1.__class__.__name__:
         # Convert Linear layers to Conv if linear layer follows target layer
         if "Conv" in m1.__class__.__name__ and "Linear" in m2.__class__.__name__:
             assert w2.size(1) % w1.size(0) == 0, "Linear units need to be multiple"
-            if w1.dim() == 4:
-                factor = int(np.sqrt(w2.size(1) // w1.size(0)))
-                w2 = w2.view(w2.size(0), w2.size(1)//factor**2, factor, factor)
-            elif w1.dim() == 5:
-                assert out_size is not None,\
+            factor = w2.size(1) // w1.size(0)
+            if out_size is None:
+                assert w1.dim() == 4,\
                        "For conv3d -> linear out_size is necessary"
-                factor = out_size[0] * out_size[1] * out_size[2]
-                w2 = w2.view(w2.size(0), w2.size(1)//factor, out_size[0],
-                             out_size[1], out_size[2])
+                out_size = (factor, 1)
+            assert int(np.prod(out_size)) == factor,\
+                   "Output size does not match the Linear layer"
+            w2 = w2.view((w2.size(0), w1.size(0)) + tuple(out_size))
         else:
             assert w1.size(0) == w2.size(1), "Module weights are not compatible"
         assert new_width > w1.size(0), "New size should be larger"
 
         old_width = w1.size(0)
-        nw1 = m1.weight.data.clone()
-        nw2 = w2.clone()
-
-        if nw1.dim() == 4:
-            nw1.resize_(new_width, nw1.size(1), nw1.size(2), nw1.size(3))
-            nw2.resize_(nw2.size(0), new_width, nw2.size(2), nw2.size(3))
-        # elif nw1.dim() == 5:
-        #     nw1.resize_(new_width, nw1.size(1), nw1.size(2), nw1.size(3), nw1.size(4))
-        #     nw2.resize_(nw2.size(0), new_width, nw2.size(2), nw2.size(3), nw2.size(4))
-        # else:
-        #     nw1.resize_(new_width, nw1.size(1))
-        #     nw2.resize_(nw2.size(0), new_width)
-
-        if b1 is not None:
-            nb1 = m1.bias.data.clone()
-            nb1.resize_(new_width)
+        with profiling.span('resize'):
+            nw1 = m1.weight.data.clone()
+            nw2 = w2.clone()
+
+            if nw1.dim() == 4:
+                nw1.resize_(new_width, nw1.size(1), nw1.size(2), nw1.size(3))
+                nw2.resize_(nw2.size(0), new_width, nw2.size(2), nw2.size(3))
+            # elif nw1.dim() == 5:
+            #     nw1.resize_(new_width, nw1.size(1), nw1.size(2), nw1.size(3), nw1.size(4))
+            #     nw2.resize_(nw2.size(0), new_width, nw2.size(2), nw2.size(3), nw2.size(4))
+            # else:
+            #     nw1.resize_(new_width, nw1.size(1))
+            #     nw2.resize_(nw2.size(0), new_width)
+
+            if b1 is not None:
+                nb1 = m1.bias.data.clone()
+                nb1.resize_(new_width)
 
-        if bnorm is not None:
-            nrunning_mean = bnorm.running_mean.clone().resize_(new_width)
-            nrunning_var = bnorm.running_var.clone().resize_(new_width)
-            if bnorm.affine:
-                nweight = bnorm.weight.data.clone().resize_(new_width)
-                nbias = bnorm.bias.data.clone().resize_(new_width)
+            if bnorm is not None:
+                nrunning_mean = bnorm.running_mean.clone().resize_(new_width)
+                nrunning_var = bnorm.running_var.clone().resize_(new_width)
+                if bnorm.affine:
+                    nweight = bnorm.weight.data.clone().resize_(new_width)
+                    nbias = bnorm.bias.data.clone().resize_(new_width)
+            profiling.record_copy(nw1)
+            profiling.record_copy(nw2)
 
         w2 = w2.transpose(0, 1)
         nw2 = nw2.transpose(0, 1)
 
         nw1.narrow(0, 0, old_width).copy_(w1)
         nw2.narrow(0, 0, old_width).copy_(w2)
-        nb1.narrow(0, 0, old_width).copy_(b1)
+        if b1 is not None:
+            nb1.narrow(0, 0, old_width).copy_(b1)
 
         # if bnorm is not None:
         #     nrunning_var.narrow(0, 0, old_width).copy_(bnorm.running_var)
@@ -85,49 +111,61 @@ def wider(m1, m2, new_width, bnorm=None, out_size=None, noise=True,
 
         # TEST:normalize weights
         if weight_norm:
+            # Normalise a copy, the weights of m1 may be shared with a teacher
+            w1 = w1.clone()
             for i in range(old_width):
                 norm = w1.select(0, i).norm()
                 w1.select(0, i).div_(norm)
 
-        # select weights randomly
-        tracking = dict()
-        for i in range(old_width, new_width):
-            idx = np.random.randint(0, old_width)
-            try:
-                tracking[idx].append(i)
-            except:
-                tracking[idx] = [idx]
-                tracking[idx].append(i)
-
-            # TEST:random init for new units
+        with profiling.span('replicate'):
+            # select weights randomly
+            tracking = dict()
+            mapping = list(range(old_width))
+            if scores is not None:
+                top_ids = importance.top_units(scores, new_width - old_width)
+            for i in range(old_width, new_width):
+                if scores is not None:
+                    idx = int(top_ids[i - old_width])
+                else:
+                    idx = np.random.randint(0, old_width)
+                mapping.append(idx)
+                try:
+                    tracking[idx].append(i)
+                except:
+                    tracking[idx] = [idx]
+                    tracking[idx].append(i)
+
+                # TEST:random init for new units
+                if not random_init:
+                    nw1.select(0, i).copy_(w1.select(0, idx).clone())
+                    nw2.select(0, i).copy_(w2.select(0, idx).clone())
+                else:
+                    n = m1.kernel_size[0] * m1.kernel_size[1] * m1.out_channels
+                    if m2.weight.dim() == 4:
+                        n2 = m2.kernel_size[0] * m2.kernel_size[1] * m2.out_channels
+                    elif m2.weight.dim() == 5:
+                        n2 = m2.kernel_size[0] * m2.kernel_size[1] * m2.kernel_size[
+                            2] * m2.out_channels
+                    elif m2.weight.dim() == 2:
+                        n2 = m2.out_features * m2.in_features
+                    nw1.select(0, i).normal_(0, np.sqrt(2. / n))
+                    nw2.select(0, i).normal_(0, np.sqrt(2. / n2))
+                if b1 is not None:
+                    nb1[i] = b1[idx]
+
+                if bnorm is not None:
+                    nrunning_mean[i] = bnorm.running_mean[idx]
+                    nrunning_var[i] = bnorm.running_var[idx]
+                    if bnorm.affine:
+                        nweight[i] = bnorm.weight.data[idx]
+                        nbias[i] = bnorm.bias.data[idx]
+                    bnorm.num_features = new_width
+
+        with profiling.span('divide'):
             if not random_init:
-                nw1.select(0, i).copy_(w1.select(0, idx).clone())
-                nw2.select(0, i).copy_(w2.select(0, idx).clone())
-            else:
-                n = m1.kernel_size[0] * m1.kernel_size[1] * m1.out_channels
-                if m2.weight.dim() == 4:
-                    n2 = m2.kernel_size[0] * m2.kernel_size[1] * m2.out_channels
-                elif m2.weight.dim() == 5:
-                    n2 = m2.kernel_size[0] * m2.kernel_size[1] * m2.kernel_size[
-                        2] * m2.out_channels
-                elif m2.weight.dim() == 2:
-                    n2 = m2.out_features * m2.in_features
-                nw1.select(0, i).normal_(0, np.sqrt(2. / n))
-                nw2.select(0, i).normal_(0, np.sqrt(2. / n2))
-            nb1[i] = b1[idx]
-
-            if bnorm is not None:
-                nrunning_mean[i] = bnorm.running_mean[idx]
-                nrunning_var[i] = bnorm.running_var[idx]
-                if bnorm.affine:
-                    nweight[i] = bnorm.weight.data[idx]
-                    nbias[i] = bnorm.bias.data[idx]
-                bnorm.num_features = new_width
-
-        if not random_init:
-            for idx, d in tracking.items():
-                for item in d:
-                    nw2[item].div_(len(d))
+                for idx, d in tracking.items():
+                    for item in d:
+                        nw2[item].div_(len(d))
 
         w2.transpose_(0, 1)
         nw2.transpose_(0, 1)
@@ -135,28 +173,26 @@ def wider(m1, m2, new_width, bnorm=None, out_size=None, noise=True,
         m1.out_channels = new_width
         m2.in_channels = new_width
 
-        if noise:
-            # NOISE_RATIO = 1e-5
-            # noise_range = NOISE_RATIO * np.ptp(w1.flatten())
-            # noise = th.Tensor(nw1.shape).uniform_(-noise_range / 2.0, noise_range / 2.0).cuda()
-            # nw1 = th.add(noise, nw1)
-            noise = np.random.normal(scale=5e-2 * nw1.std(),
-                                     size=list(nw1.size()))
-            nw1 += th.FloatTensor(noise).type_as(nw1)
+        with profiling.span('noise'):
+            if noise:
+                # NOISE_RATIO = 1e-5
+                # noise_range = NOISE_RATIO * np.ptp(w1.flatten())
+                # noise = th.Tensor(nw1.shape).uniform_(-noise_range / 2.0, noise_range / 2.0).cuda()
+                # nw1 = th.add(noise, nw1)
+                noise = np.random.normal(scale=5e-2 * nw1.std(),
+                                         size=list(nw1.size()))
+                nw1 += th.FloatTensor(noise).type_as(nw1)
 
         m1.weight.data = nw1
 
         if "Conv" in m1.__class__.__name__ and "Linear" in m2.__class__.__name__:
-            if w1.dim() == 4:
-                m2.weight.data = nw2.view(m2.weight.size(0), new_width*factor**2)
-                m2.in_features = new_width*factor**2
-            elif w2.dim() == 5:
-                m2.weight.data = nw2.view(m2.weight.size(0), new_width*factor)
-                m2.in_features = new_width*factor
+            m2.weight.data = nw2.view(m2.weight.size(0), new_width*factor)
+            m2.in_features = new_width*factor
         else:
             m2.weight.data = nw2
 
-        m1.bias.data = nb1
+        if b1 is not None:
+            m1.bias.data = nb1
 
         if bnorm is not None:
             bnorm.running_var = nrunning_var
@@ -164,10 +200,15 @@ def wider(m1, m2, new_width, bnorm=None, out_size=None, noise=True,
             if bnorm.affine:
                 bnorm.weight.data = nweight
                 bnorm.bias.data = nbias
+
+        if return_mapping:
+            return m1, m2, bnorm, th.LongTensor(mapping)
         return m1, m2, bnorm
 
 
 # TODO: Consider adding noise to new layer as wider operator.
+@profiling.profiled('net2net_original.deeper')
+@without_init
 def deeper(m, nonlin, bnorm_flag=True, weight_norm=False, noise=True, prefix=''):
     """
     Deeper operator adding a new layer on topf of the given layer.
@@ -181,27 +222,36 @@ def deeper(m, nonlin, bnorm_flag=True, weight_norm=False, noise=True, prefix='')
     """
 
     if "Linear" in m.__class__.__name__:
-        m2 = th.nn.Linear(m.out_features, m.out_features)
-        m2.weight.data.copy_(th.eye(m.out_features))
-        m2.bias.data.zero_()
+        with profiling.span('construct'):
+            m2 = th.nn.Linear(m.out_features, m.out_features,
+                              bias=m.bias is not None)
+            m2.weight.data.copy_(th.eye(m.out_features))
+            if m2.bias is not None:
+                m2.bias.data.zero_()
 
         if bnorm_flag:
-            bnorm = th.nn.BatchNorm1d(m2.weight.size(1))
-            bnorm.weight.data.fill_(1)
-            bnorm.bias.data.fill_(0)
-            bnorm.running_mean.fill_(0)
-            bnorm.running_var.fill_(1)
+            with profiling.span('bnorm'):
+                bnorm = th.nn.BatchNorm1d(m2.weight.size(1))
+                bnorm.weight.data.fill_(1)
+                bnorm.bias.data.fill_(0)
+                bnorm.running_mean.fill_(0)
+                bnorm.running_var.fill_(1)
 
     elif "Conv" in m.__class__.__name__:
         assert m.kernel_size[0] % 2 == 1, "Kernel size needs to be odd"
 
         if m.weight.dim() == 4:
-            pad_h = int((m.kernel_size[0] - 1) / 2)
-            # pad_w = pad_h
-            m2 = th.nn.Conv2d(m.out_channels, m.out_channels,
-                              kernel_size=m.kernel_size, padding=pad_h)
-            m2.weight.data.zero_()
-            c = m.kernel_size[0] // 2 + 1
+            assert m.kernel_size[1] % 2 == 1, "Kernel size needs to be odd"
+            # Padding keeping the output size with the dilation of m
+            pad_h = m.dilation[0] * (m.kernel_size[0] - 1) // 2
+            pad_w = m.dilation[1] * (m.kernel_size[1] - 1) // 2
+            with profiling.span('construct'):
+                m2 = th.nn.Conv2d(m.out_channels, m.out_channels,
+                                  kernel_size=m.kernel_size,
+                                  padding=(pad_h, pad_w), dilation=m.dilation,
+                                  bias=m.bias is not None)
+                m2.weight.data.zero_()
+            c_h, c_w = m.kernel_size[0] // 2, m.kernel_size[1] // 2
 
         # elif m.weight.dim() == 5:
         #     pad_hw = int((m.kernel_size[1] - 1) / 2)  # pad height and width
@@ -228,19 +278,22 @@ def deeper(m, nonlin, bnorm_flag=True, weight_norm=False, noise=True, prefix='')
         #         weight.div_(norm)
         #         m.weight.data = weight
 
-        for i in range(0, m.out_channels):
-            if m.weight.dim() == 4:
-                m2.weight.data.narrow(0, i, 1).narrow(1, i, 1).narrow(2, c, 1).narrow(3, c, 1).fill_(1)
-            # elif m.weight.dim() == 5:
-            #     m2.weight.data.narrow(0, i, 1).narrow(1, i, 1).narrow(2, c_d, 1).narrow(3, c_wh, 1).narrow(4, c_wh, 1).fill_(1)
+        with profiling.span('identity'):
+            for i in range(0, m.out_channels):
+                if m.weight.dim() == 4:
+                    m2.weight.data.narrow(0, i, 1).narrow(1, i, 1).narrow(2, c_h, 1).narrow(3, c_w, 1).fill_(1)
+                # elif m.weight.dim() == 5:
+                #     m2.weight.data.narrow(0, i, 1).narrow(1, i, 1).narrow(2, c_d, 1).narrow(3, c_wh, 1).narrow(4, c_wh, 1).fill_(1)
 
         # print m2.weight.data.shape
         # print m2.weight.data[2]
         # exit()
         if noise:
-            noise = np.random.normal(scale=5e-2 * m2.weight.data.std(),
-                                     size=list(m2.weight.size()))
-            m2.weight.data += th.FloatTensor(noise).type_as(m2.weight.data)
+            with profiling.span('noise'):
+                noise = np.random.normal(scale=5e-2 * m2.weight.data.std(),
+                                         size=list(m2.weight.size()))
+                m2.weight.data += th.FloatTensor(noise).type_as(
+                    m2.weight.data)
 
         # if restore:
         #     m2.weight.data = m2.weight.data.view(m2.weight.size(0),
@@ -248,17 +301,19 @@ def deeper(m, nonlin, bnorm_flag=True, weight_norm=False, noise=True, prefix='')
         #                                          m2.kernel_size[0],
         #                                          m2.kernel_size[0])
 
-        m2.bias.data.zero_()
+        if m2.bias is not None:
+            m2.bias.data.zero_()
 
         if bnorm_flag:
-            if m.weight.dim() == 4:
-                bnorm = th.nn.BatchNorm2d(m2.out_channels)
-            # elif m.weight.dim() == 5:
-            #     bnorm = th.nn.BatchNorm3d(m2.out_channels)
-            bnorm.weight.data.fill_(1)
-            bnorm.bias.data.fill_(0)
-            bnorm.running_mean.fill_(0)
-            bnorm.running_var.fill_(1)
+            with profiling.span('bnorm'):
+                if m.weight.dim() == 4:
+                    bnorm = th.nn.BatchNorm2d(m2.out_channels)
+                # elif m.weight.dim() == 5:
+                #     bnorm = th.nn.BatchNorm3d(m2.out_channels)
+                bnorm.weight.data.fill_(1)
+                bnorm.bias.data.fill_(0)
+                bnorm.running_mean.fill_(0)
+                bnorm.running_var.fill_(1)
 
     else:
         raise RuntimeError("{} Module not supported".format(m.__class__.__name__))
@@ -2,7 +2,12 @@ import torch as th
 import torch.nn as nn
 import numpy as np
 import sys
+import alignment
 import im2col
+import importance
+import profiling
+import transform
+from initialization import without_init
 
 sys.path.append('./')
 from utils import add_noise
@@ -73,49 +78,23 @@ def verify_weights_deeper(teacher_w1, student_w1):
 
 def verify_weights_wider(teacher_w1, teacher_b1, teacher_w2,
                    student_w1, student_b1, student_w2):
-    import scipy.signal
     inputs = np.random.rand(teacher_w1.shape[1], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4)
-    ori1 = np.zeros((teacher_w1.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    ori2 = np.zeros((teacher_w2.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    new1 = np.zeros((student_w1.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-    new2 = np.zeros((student_w2.shape[0], teacher_w1.shape[3] * 4, teacher_w1.shape[2] * 4))
-
-    for i in range(teacher_w1.shape[0]):
-        for j in range(inputs.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(inputs[j, :, :], teacher_w1[i, j, :, :], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(inputs[j, :, :], teacher_w1[i, j, :, :], mode='same')
-        ori1[i, :, :] = tmp + teacher_b1[i]
-    for i in range(teacher_w2.shape[0]):
-        for j in range(ori1.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(ori1[j, :, :], teacher_w2[i, j, :, :], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(ori1[j, :, :], teacher_w2[i, j, :, :], mode='same')
-        ori2[i, :, :] = tmp
 
-    for i in range(student_w1.shape[0]):
-        for j in range(inputs.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(inputs[j, :, :], student_w1[i, j, :, :], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(inputs[j, :, :], student_w1[i, j, :, :], mode='same')
-        new1[i, :, :] = tmp + student_b1[i]
-    for i in range(student_w2.shape[0]):
-        for j in range(new1.shape[0]):
-            if j == 0:
-                tmp = scipy.signal.convolve2d(new1[j, :, :], student_w2[i, j, :, :], mode='same')
-            else:
-                tmp += scipy.signal.convolve2d(new1[j, :, :], student_w2[i, j, :, :], mode='same')
-        new2[i, :, :] = tmp
+    ori1 = im2col.convolve2d_same(inputs, teacher_w1, teacher_b1)
+    ori2 = im2col.convolve2d_same(ori1, teacher_w2)
+
+    new1 = im2col.convolve2d_same(inputs, student_w1, student_b1)
+    new2 = im2col.convolve2d_same(new1, student_w2)
 
     err = np.abs(np.sum(ori2 - new2))
 
     assert err < ERROR_TOLERANCE, 'Verification failed: [ERROR] {}'.format(err)
 
 
-def wider(layer1, layer2, new_width, bnorm=None):
+@profiling.profiled('netmorph.wider')
+@without_init
+def wider(layer1, layer2, new_width, bnorm=None, return_mapping=False,
+          align=None, scores=None, out_size=None):
     r""" Widens the layers in the network.
 
     Implemented according to NetMorph Widening operation. The next adjacent
@@ -127,17 +106,31 @@ def wider(layer1, layer2, new_width, bnorm=None):
     :param new_width: Width of the new layer (output channels/features of first
     layer and input channels/features of next layer.
     :param bnorm: BN layer to be widened if provided.
+    :param return_mapping: Also return the teacher channel each channel of the
+    widened layer was copied from.
+    :param align: Round new_width up to a multiple of align.
+    :param scores: Importance of every channel of the first layer, the most
+    important channels are replicated instead of random ones.
+    :param out_size: Spatial shape (H, W) of the output of the first layer as
+    seen by a Linear next layer, checked if given.
     :return: widened layers
     """
 
     print 'NetMorph Widening... '
+    new_width = alignment.align_width(new_width, align)
+    if getattr(layer1, 'groups', 1) > 1 or getattr(layer2, 'groups', 1) > 1:
+        # Units are replicated within their group, the group counts are kept
+        assert not return_mapping, 'No mapping for grouped convolutions'
+        transform.wider_layers('netmorph', layer1, layer2, new_width,
+                               bnorm1=bnorm, scores=scores)
+        return layer1, layer2, bnorm
     if (isinstance(layer1, nn.Conv2d) or isinstance(layer1, nn.Linear)) and (
             isinstance(layer2, nn.Conv2d) or isinstance(layer2, nn.Linear)):
 
         teacher_w1 = layer1.weight.data
-        teacher_b1 = layer1.bias.data
+        teacher_b1 = layer1.bias.data if layer1.bias is not None else None
         teacher_w2 = layer2.weight.data
-        teacher_b2 = layer2.bias.data
+        teacher_b2 = layer2.bias.data if layer2.bias is not None else None
 
         assert new_width > teacher_w1.size(0), "New size should be larger"
 
@@ -145,89 +138,116 @@ def wider(layer1, layer2, new_width, bnorm=None):
         # Randomly select weight from the first teacher layer and corresponding
         # bias and add it to first student layer. Add noise to newly created
         # student layer.
-        student_w1 = teacher_w1.clone()
-        student_b1 = teacher_b1.clone()
-
-        rand_ids = th.randint(low=0, high=teacher_w1.shape[0],
-                              size=((new_width - teacher_w1.shape[0]),))
-
-        for i in range(rand_ids.numel()):
-            teacher_index = int(rand_ids[i].item())
-            new_weight = teacher_w1[teacher_index, ...]
-            new_weight.unsqueeze_(0)
-            student_w1 = th.cat((student_w1, new_weight), dim=0)
-            new_bias = teacher_b1[teacher_index]
-            new_bias.unsqueeze_(0)
-            student_b1 = th.cat((student_b1, new_bias))
-
-        if isinstance(layer1, nn.Conv2d):
-            new_current_layer = nn.Conv2d(
-                out_channels=new_width, in_channels=layer1.in_channels,
-                kernel_size=(3, 3), stride=1, padding=1)
-        else:
-            new_current_layer = nn.Linear(
-                in_features=layer1.out_channels * layer1.kernel_size[0] * layer1.kernel_size[1],
-                out_features=layer2.out_features)
-
-        new_current_layer.weight.data = add_noise(student_w1, teacher_w1)
-        new_current_layer.bias.data = add_noise(student_b1, teacher_b1)
+        # The teacher tensors are not cloned, the concatenation and noise
+        # below copy them before anything is written.
+        student_w1 = teacher_w1
+        student_b1 = teacher_b1
+
+        with profiling.span('sample'):
+            if scores is not None:
+                rand_ids = importance.top_units(
+                    scores, new_width - teacher_w1.shape[0])
+            else:
+                rand_ids = th.randint(low=0, high=teacher_w1.shape[0],
+                                      size=((new_width - teacher_w1.shape[0]),))
+            mapping = th.cat((th.arange(teacher_w1.shape[0]), rand_ids.long()))
+
+        with profiling.span('replicate_out'):
+            for i in range(rand_ids.numel()):
+                teacher_index = int(rand_ids[i].item())
+                new_weight = teacher_w1[teacher_index, ...]
+                new_weight.unsqueeze_(0)
+                student_w1 = th.cat((student_w1, new_weight), dim=0)
+                profiling.record_copy(student_w1)
+                if teacher_b1 is not None:
+                    new_bias = teacher_b1[teacher_index]
+                    new_bias.unsqueeze_(0)
+                    student_b1 = th.cat((student_b1, new_bias))
+                    profiling.record_copy(student_b1)
+
+        with profiling.span('construct'):
+            new_current_layer = transform.resized_layer(layer1,
+                                                        out_width=new_width)
+
+        with profiling.span('noise'):
+            new_current_layer.weight.data = add_noise(student_w1, teacher_w1)
+            if teacher_b1 is not None:
+                new_current_layer.bias.data = add_noise(student_b1, teacher_b1)
         layer1 = new_current_layer
 
         # Widening input channels/features of second layer. Copy the weights
         # from teacher layer and only add noise to additional filter
         # channels/features in student layer. The student layer will have same
         # bias as teacher.
-        new_weight = th.zeros(teacher_w2.shape).cuda()
-        noise = add_noise(new_weight, teacher_w2)
-
-        student_w2 = th.cat((teacher_w2, noise), dim=1)
-
-        if isinstance(layer2, nn.Conv2d):
-            new_next_layer = nn.Conv2d(out_channels=layer2.out_channels,
-                                       in_channels=new_width,
-                                       kernel_size=(3, 3), stride=1, padding=1)
-        else:
-            new_next_layer = nn.Linear(
-                in_features=layer1.out_channels * layer1.kernel_size[0] * layer1.kernel_size[1],
-                out_features=layer2.out_features)
+        with profiling.span('widen_in'):
+            # A Linear layer following a conv layer sees every channel as a
+            # block of features, the new blocks follow the teacher ones.
+            features = teacher_w2.size(1) // teacher_w1.size(0)
+            assert out_size is None or int(np.prod(out_size)) == features, \
+                'Output size {} does not match the Linear layer'.format(
+                    out_size)
+            shape = list(teacher_w2.shape)
+            shape[1] = (new_width - teacher_w1.size(0)) * features
+            new_weight = th.zeros(shape, dtype=teacher_w2.dtype,
+                                  device=teacher_w2.device)
+            noise = add_noise(new_weight, teacher_w2)
+
+            student_w2 = th.cat((teacher_w2, noise), dim=1)
+            profiling.record_copy(student_w2)
+
+        with profiling.span('construct'):
+            new_next_layer = transform.resized_layer(
+                layer2, in_width=student_w2.size(1))
 
         new_next_layer.weight.data = student_w2
-        new_next_layer.bias.data = teacher_b2
+        if teacher_b2 is not None:
+            new_next_layer.bias.data = teacher_b2
         layer2 = new_next_layer
 
     # Widening batch normalisation layer if provided. Only add noise to
     # additional features for all 4 parameters in the layer i.e. mean, variance,
     # weight and bias.
-    if bnorm is not None:
-        n_add = new_width - bnorm.num_features
-
-        # get current parameter values
-        bn_weights = bnorm.weight.data
-        bn_bias = bnorm.bias.data
-        bn_running_mean = bnorm.running_mean.data
-        bn_running_var = bnorm.running_var.data
-
-        # set noise for all parameter values
-        weight_noise = add_noise(th.ones(n_add).cuda(), th.Tensor([0, 1]))
-        bias_noise = add_noise(th.zeros(n_add).cuda(), th.Tensor([0, 1]))
-        running_mean_noise = add_noise(th.zeros(n_add).cuda(),
-                                       th.Tensor([0, 1]))
-        running_var_noise = add_noise(th.ones(n_add).cuda(), th.Tensor([0, 1]))
-
-        # append noise to current parameter values to widen
-        new_bn_weights = th.cat((bn_weights, weight_noise))
-        new_bn_bias = th.cat((bn_bias, bias_noise))
-        new_bn_running_mean = th.cat((bn_running_mean, running_mean_noise))
-        new_bn_running_var = th.cat((bn_running_var, running_var_noise))
-
-        # assign new parameter values for new BN layer
-        new_bn_layer = nn.BatchNorm2d(num_features=bnorm.num_features + n_add)
-        new_bn_layer.weight.data = new_bn_weights
-        new_bn_layer.bias.data = new_bn_bias
-        new_bn_layer.running_mean.data = new_bn_running_mean
-        new_bn_layer.running_var.data = new_bn_running_var
-
-        bnorm = new_bn_layer
+    with profiling.span('bnorm'):
+        if bnorm is not None:
+            n_add = new_width - bnorm.num_features
+
+            # get current parameter values
+            bn_weights = bnorm.weight.data
+            bn_bias = bnorm.bias.data
+            bn_running_mean = bnorm.running_mean.data
+            bn_running_var = bnorm.running_var.data
+
+            # set noise for all parameter values
+            device = bn_weights.device
+            weight_noise = add_noise(th.ones(n_add, device=device),
+                                     th.Tensor([0, 1]))
+            bias_noise = add_noise(th.zeros(n_add, device=device),
+                                   th.Tensor([0, 1]))
+            running_mean_noise = add_noise(th.zeros(n_add, device=device),
+                                           th.Tensor([0, 1]))
+            running_var_noise = add_noise(th.ones(n_add, device=device),
+                                          th.Tensor([0, 1]))
+
+            # append noise to current parameter values to widen
+            new_bn_weights = th.cat((bn_weights, weight_noise))
+            new_bn_bias = th.cat((bn_bias, bias_noise))
+            new_bn_running_mean = th.cat((bn_running_mean, running_mean_noise))
+            new_bn_running_var = th.cat((bn_running_var, running_var_noise))
+            for tensor in (new_bn_weights, new_bn_bias, new_bn_running_mean,
+                           new_bn_running_var):
+                profiling.record_copy(tensor)
+
+            # assign new parameter values for new BN layer
+            new_bn_layer = nn.BatchNorm2d(num_features=bnorm.num_features + n_add)
+            new_bn_layer.weight.data = new_bn_weights
+            new_bn_layer.bias.data = new_bn_bias
+            new_bn_layer.running_mean.data = new_bn_running_mean
+            new_bn_layer.running_var.data = new_bn_running_var
+
+            bnorm = new_bn_layer
+
+    if return_mapping:
+        return layer1, layer2, bnorm, mapping
 
     return layer1, layer2, bnorm
 
@@ -240,6 +260,30 @@ def practical_netmorph(parent_filter_wt):
     pass
 
 
+def decomposition_error(parent_filter_wt, f1, f2):
+    r""" Error between a parent filter and its NetMorph decomposition.
+
+    The filters f1 and f2 are composed into a single filter without running
+    any forward pass and compared against the parent filter zero padded to
+    the size of the composed filter.
+
+    :param parent_filter_wt: Parent filter of shape (c2, c1, k, k)
+    :param f1: First filter of the decomposition of shape (c, c1, k1, k1)
+    :param f2: Second filter of the decomposition of shape (c2, c, k2, k2)
+    :return: Maximum absolute error over all filter elements
+    """
+    parent = np.asarray(parent_filter_wt)
+    composed = im2col.compose_filters(np.asarray(f1), np.asarray(f2))
+
+    pad_h = (composed.shape[2] - parent.shape[2]) // 2
+    pad_w = (composed.shape[3] - parent.shape[3]) // 2
+    assert pad_h >= 0 and pad_w >= 0, 'Decomposed filters are too small'
+    parent = np.pad(parent, ((0, 0), (0, 0), (pad_h, pad_h), (pad_w, pad_w)),
+                    'constant')
+
+    return np.abs(composed - parent).max()
+
+
 def decompose_filter(parent_filter_wt, filters=16):
     lamda = 0.0001
     error = 1e-7
@@ -250,7 +294,7 @@ def decompose_filter(parent_filter_wt, filters=16):
     k1 = k
     k2 = k
     k_expanded = k1 + k2 - 1
-    pad_zero = nn.ZeroPad2d((k_expanded - k) / 2)
+    pad_zero = nn.ZeroPad2d((k_expanded - k) // 2)
 
     new_weight = pad_zero(parent_filter_wt)
     # new_weight = add_noise(new_weight, new_weight)
@@ -417,53 +461,86 @@ def decompose_filter(parent_filter_wt, filters=16):
     print parent_filter_wt.shape
     print kernel.shape
     print img_calculated.shape
-    exit()
 
     return kernel, img_calculated
 
 
+@profiling.profiled('netmorph.deeper')
+@without_init
 def deeper(layer, activation_fn=nn.ReLU(), bnorm=True, prefix='', filters=16):
-    print 'NetMorph Deeper ...'
+    r""" NetMorph deepening replacing a conv layer by two conv layers whose
+    filters compose to the filter of the layer.
 
-    if isinstance(layer, nn.Linear) or isinstance(layer, nn.Conv2d):
-        if isinstance(layer, nn.Linear):
-            pass
-        else:
-            teacher_weight = layer.weight.data
-            teacher_bias = layer.bias.data
-
-            f1, f2 = decompose_filter(teacher_weight, filters)
-            # f1, f2 = practical_netmorph(teacher_weight)
-
-            # new_num_channels = layer.out_channels
-            new_layer1 = th.nn.Conv2d(f1.shape[1], f1.shape[0],
-                                      kernel_size=(f1.shape[2], f1.shape[3]),
-                                      padding=1)
-            new_layer2 = th.nn.Conv2d(f2.shape[1], f2.shape[0],
-                                      kernel_size=(f2.shape[2], f2.shape[3]),
-                                      padding=1)
-
-            new_layer1.weight.data = th.from_numpy(f1).float()
-            new_layer2.weight.data = th.from_numpy(f2).float()
-
-            new_layer1.bias.data = th.zeros(new_layer1.out_channels)
-            new_layer2.bias.data = teacher_bias
-            # new_layer2.bias.data = th.zeros(new_layer2.out_channels)
+    The first new layer keeps the input size (stride 1, padding for the
+    dilation of the layer), the second one takes over the stride, padding,
+    dilation and padding mode of the layer, so the output size is kept. A
+    bias is only used if the layer has one.
 
-            if bnorm:
-                new_num_features = new_layer1.out_channels
-                new_bn_layer = nn.BatchNorm2d(num_features=new_num_features)
+    :param layer: Conv layer to be deepened, with a square odd kernel
+    :param activation_fn: Activation function between the new layers
+    :param bnorm: Add a BN layer between the new layers if True
+    :param prefix: Prefix of the names of the new layers
+    :param filters: Number of filters of the first new layer
 
-                new_bn_layer.weight.data = add_noise(
-                    th.ones(new_num_features).cuda(), th.Tensor([0, 1]))
-                new_bn_layer.bias.data = add_noise(
-                    th.zeros(new_num_features).cuda(), th.Tensor([0, 1]))
-                new_bn_layer.running_mean.data = add_noise(
-                    th.zeros(new_num_features).cuda(), th.Tensor([0, 1]))
-                new_bn_layer.running_var.data = add_noise(
-                    th.ones(new_num_features).cuda(), th.Tensor([0, 1]))
+    :return: Sequential container with the new layers
+    """
 
-    seq_container = th.nn.Sequential().cuda()
+    print 'NetMorph Deeper ...'
+
+    if not isinstance(layer, nn.Conv2d):
+        raise RuntimeError(
+            "{} Module not supported".format(layer.__class__.__name__))
+
+    kh, kw = layer.kernel_size
+    assert kh == kw and kh % 2 == 1, 'Kernel size needs to be square and odd'
+    assert layer.groups == 1, 'Grouped convolutions not supported'
+    teacher_weight = layer.weight.data
+    has_bias = layer.bias is not None
+
+    with profiling.span('decompose'):
+        f1, f2 = decompose_filter(teacher_weight, filters)
+    # f1, f2 = practical_netmorph(teacher_weight)
+
+    with profiling.span('construct'):
+        kwargs = {}
+        if hasattr(layer, 'padding_mode'):
+            kwargs['padding_mode'] = layer.padding_mode
+        padding = tuple(d * (f1.shape[2] - 1) // 2 for d in layer.dilation)
+        new_layer1 = th.nn.Conv2d(f1.shape[1], f1.shape[0],
+                                  kernel_size=(f1.shape[2], f1.shape[3]),
+                                  padding=padding, dilation=layer.dilation,
+                                  bias=has_bias, **kwargs)
+        new_layer2 = th.nn.Conv2d(f2.shape[1], f2.shape[0],
+                                  kernel_size=(f2.shape[2], f2.shape[3]),
+                                  stride=layer.stride, padding=layer.padding,
+                                  dilation=layer.dilation, bias=has_bias,
+                                  **kwargs)
+
+        device = teacher_weight.device
+        new_layer1.weight.data = th.from_numpy(f1).float().to(device)
+        new_layer2.weight.data = th.from_numpy(f2).float().to(device)
+
+        if has_bias:
+            new_layer1.bias.data = th.zeros(new_layer1.out_channels,
+                                            device=device)
+            new_layer2.bias.data = layer.bias.data
+            # new_layer2.bias.data = th.zeros(new_layer2.out_channels)
+
+    if bnorm:
+        with profiling.span('bnorm'):
+            new_num_features = new_layer1.out_channels
+            new_bn_layer = nn.BatchNorm2d(num_features=new_num_features)
+
+            new_bn_layer.weight.data = add_noise(
+                th.ones(new_num_features, device=device), th.Tensor([0, 1]))
+            new_bn_layer.bias.data = add_noise(
+                th.zeros(new_num_features, device=device), th.Tensor([0, 1]))
+            new_bn_layer.running_mean.data = add_noise(
+                th.zeros(new_num_features, device=device), th.Tensor([0, 1]))
+            new_bn_layer.running_var.data = add_noise(
+                th.ones(new_num_features, device=device), th.Tensor([0, 1]))
+
+    seq_container = th.nn.Sequential()
     seq_container.add_module(prefix + '_conv', new_layer1)
     if bnorm:
         seq_container.add_module(prefix + '_bnorm', new_bn_layer)
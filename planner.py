@@ -0,0 +1,141 @@
+import copy
+import math
+import torch as th
+
+import analysis
+import fusion
+import transform
+
+METRICS = ('macs', 'params', 'latency')
+
+
+def _widen(pairs, base_widths, widths, transform_type):
+    # Transform widening every pair to its target width
+    plan = transform.Transform(transform_type)
+    for (layer, next_layer, bnorm), base, width in zip(pairs, base_widths,
+                                                        widths):
+        if width > base:
+            plan.wider(layer, next_layer, width, bnorm=bnorm)
+    return plan
+
+
+def _greedy(evaluate, base_widths, budget, max_steps=1000):
+    # Grow the widths while the cost returned by evaluate() fits the budget,
+    # at most max_steps times in case the cost does not grow with the widths
+    widths = list(base_widths)
+    current_cost = evaluate(widths)
+    assert current_cost <= budget, \
+        'Teacher cost {} exceeds the budget {}'.format(current_cost, budget)
+
+    steps = [max(1, width // 4) for width in base_widths]
+    for _ in range(max_steps):
+        best = None
+        for i, step in enumerate(steps):
+            candidate = list(widths)
+            candidate[i] += step
+            candidate_cost = evaluate(candidate)
+            if candidate_cost > budget:
+                continue
+            score = math.log(float(candidate[i]) / widths[i]) / \
+                max(candidate_cost - current_cost, 1e-12)
+            if best is None or score > best[0]:
+                best = (score, candidate, candidate_cost)
+
+        if best is not None:
+            _, widths, current_cost = best
+        elif max(steps) > 1:
+            steps = [max(1, step // 2) for step in steps]
+        else:
+            break
+    return widths, current_cost
+
+
+def plan_widths(model, input_shape, pairs, budget, metric='macs',
+                transform_type='net2net', batch_size=1, repeat=20,
+                calibration_rounds=3):
+    r""" Per-layer widths making the most of a cost budget.
+
+    The capacity of the student is measured as the sum of the logarithms of
+    the widths, so doubling any layer is worth the same and growth has
+    diminishing returns per layer. Starting from the teacher, the width of
+    one pair of layers is increased at a time, always choosing the increase
+    which adds the most capacity per unit of cost and still fits the budget.
+    Increments start at a quarter of the layer width and are halved down to
+    single units once nothing fits anymore, so the budget is filled up to the
+    cost of one unit. MACs and parameters are computed statically by
+    analysis.analyse().
+
+    The latency is modelled as linear in the MACs, fitted on the measured
+    latency of the teacher and of a uniformly 2x wider student. If the
+    measured latency does not grow, the latency is taken as proportional to
+    the MACs instead. The planned student is then measured and, while it
+    exceeds the budget, the model is refitted on it and the widths are
+    planned again. If no plan within calibration_rounds meets the budget,
+    the teacher widths are returned.
+
+    :param model: Teacher network, left unchanged
+    :param input_shape: Shape of a single input without batch dimension
+    :param pairs: List of (layer, next_layer, bnorm) names which can be
+     widened as in Transform.wider, bnorm may be None
+    :param budget: Maximum cost of the student
+    :param metric: 'macs', 'params' or 'latency' (s per batch)
+    :param transform_type: Type of the returned Transform
+    :param batch_size: Batch size the cost is given for
+    :param repeat: Number of timed forward passes per latency measurement
+    :param calibration_rounds: Maximum number of latency plans
+
+    :return: Transform widening the teacher and a dict with the 'widths' of
+     every pair (by layer name), the 'cost' predicted by the cost model and
+     for the latency the 'measured' latency of the student
+    """
+
+    assert metric in METRICS, 'Unknown metric {}'.format(metric)
+    base_widths = [transform._out_width(transform.get_module(model, layer))
+                   for layer, _, _ in pairs]
+
+    def analyse(widths):
+        return analysis.analyse(
+            model, input_shape, batch_size=batch_size,
+            transform=_widen(pairs, base_widths, widths, transform_type))
+
+    if metric != 'latency':
+        widths, cost = _greedy(lambda widths: analyse(widths)[metric],
+                               base_widths, budget)
+        report = {'cost': cost}
+    else:
+        device = next(model.parameters()).device
+        inputs = th.rand((batch_size,) + tuple(input_shape), device=device)
+
+        def measure(widths):
+            # MACs and measured latency of the student
+            student = _widen(pairs, base_widths, widths,
+                             transform_type).apply(copy.deepcopy(model))
+            return analyse(widths)['macs'], \
+                fusion.measure_latency(student, inputs, repeat)
+
+        teacher = (analyse(base_widths)['macs'],
+                   fusion.measure_latency(model, inputs, repeat))
+        # Last plan whose measured latency met the budget
+        fitted = (base_widths, teacher[1], teacher)
+        point = measure([width * 2 for width in base_widths])
+        for _ in range(calibration_rounds):
+            slope = (point[1] - teacher[1]) / (point[0] - teacher[0])
+            if slope <= 0:
+                # Timing noise, assume the latency is proportional to the MACs
+                slope = teacher[1] / teacher[0]
+            widths, cost = _greedy(
+                lambda widths: teacher[1] + slope * (
+                    analyse(widths)['macs'] - teacher[0]),
+                base_widths, budget)
+            if widths == base_widths:
+                break
+            point = measure(widths)
+            if point[1] <= budget:
+                fitted = (widths, cost, point)
+                break
+        widths, cost, point = fitted
+        report = {'cost': cost, 'measured': point[1]}
+
+    report['widths'] = dict((layer, width) for (layer, _, _), width
+                            in zip(pairs, widths))
+    return _widen(pairs, base_widths, widths, transform_type), report
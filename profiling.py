@@ -0,0 +1,147 @@
+import functools
+import time
+import torch as th
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+# Stack of active profilers and of the spans currently open in them. Spans
+# and copies are only recorded while a profiler is active, otherwise span()
+# and record_copy() return immediately.
+_profilers = []
+_open_spans = []
+
+
+class TransformProfiler(object):
+    r""" Opt-in instrumentation of the transform operators.
+
+    While the profiler is active (used as a context manager), every named
+    span of the transforms records its wall time, the bytes allocated by
+    Python/NumPy (tracemalloc), the CUDA allocator growth and the number and
+    size of tensor copies made inside it. Spans are nested, the name of a
+    span is the path of the enclosing spans e.g. 'net2net.wider/bnorm'. Time,
+    memory and copies of a span include those of its children.
+
+    Example::
+
+        with TransformProfiler() as profiler:
+            model.wider('net2net', widening_factor=2)
+        print(profiler.format_report())
+
+    :param trace_memory: Trace Python allocations with tracemalloc (not
+     available on Python 2).
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.records = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _profilers.remove(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def report(self):
+        r""" Records aggregated by span name in order of first occurrence.
+
+        :return: list of dicts with name, calls, time (s), allocated_bytes
+         (Python), cuda_allocated_bytes, copies and copied_bytes
+        """
+
+        summary = OrderedDict()
+        for record in self.records:
+            entry = summary.setdefault(record['name'], {
+                'name': record['name'], 'calls': 0, 'time': 0.0,
+                'allocated_bytes': 0, 'cuda_allocated_bytes': 0,
+                'copies': 0, 'copied_bytes': 0})
+            entry['calls'] += 1
+            for key in ('time', 'allocated_bytes', 'cuda_allocated_bytes',
+                        'copies', 'copied_bytes'):
+                entry[key] += record[key]
+        return list(summary.values())
+
+    def format_report(self):
+        lines = ['{:<40}{:>7}{:>12}{:>14}{:>14}{:>8}{:>14}'.format(
+            'span', 'calls', 'time (ms)', 'py alloc (B)', 'cuda alloc (B)',
+            'copies', 'copied (B)')]
+        for entry in self.report():
+            lines.append('{:<40}{:>7}{:>12.3f}{:>14}{:>14}{:>8}{:>14}'.format(
+                entry['name'], entry['calls'], entry['time'] * 1000,
+                entry['allocated_bytes'], entry['cuda_allocated_bytes'],
+                entry['copies'], entry['copied_bytes']))
+        return '\n'.join(lines)
+
+
+def _traced_memory():
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def _cuda_memory():
+    if th.cuda.is_available() and th.cuda.is_initialized():
+        return th.cuda.memory_allocated()
+    return 0
+
+
+@contextmanager
+def span(name):
+    r""" Named step of a transform, recorded by the active profilers. """
+
+    if not _profilers:
+        yield
+        return
+
+    parent = _open_spans[-1]['name'] + '/' if _open_spans else ''
+    record = {'name': parent + name, 'copies': 0, 'copied_bytes': 0}
+    _open_spans.append(record)
+    start_python = _traced_memory()
+    start_cuda = _cuda_memory()
+    start = time.time()
+    try:
+        yield
+    finally:
+        record['time'] = time.time() - start
+        record['allocated_bytes'] = max(_traced_memory() - start_python, 0)
+        record['cuda_allocated_bytes'] = max(_cuda_memory() - start_cuda, 0)
+        _open_spans.remove(record)
+        for profiler in _profilers:
+            profiler.records.append(record)
+
+
+def profiled(name):
+    r""" Decorator recording every call of a transform as a span. """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_copy(tensor):
+    r""" Account a tensor copy (clone, cat, ...) to all open spans. """
+
+    if not _open_spans:
+        return
+
+    nbytes = tensor.numel() * tensor.element_size()
+    for record in _open_spans:
+        record['copies'] += 1
+        record['copied_bytes'] += nbytes
@@ -0,0 +1,84 @@
+import itertools
+import torch as th
+import torch.nn as nn
+
+
+def _is_bnorm(module):
+    return isinstance(module, nn.modules.batchnorm._BatchNorm) and \
+        module.track_running_stats
+
+
+def changed_bnorms(teacher, student):
+    r""" Names of the BN layers of a student which differ from the teacher.
+
+    BN layers which have been added, widened or whose running statistics
+    have been changed by a transform are returned, the others still hold the
+    statistics of the teacher.
+
+    :param teacher: Network the student has been transformed from
+    :param student: Transformed network
+
+    :return: list of names of BN layers of the student
+    """
+
+    teacher_modules = dict(teacher.named_modules())
+    changed = []
+    for name, module in student.named_modules():
+        if not _is_bnorm(module):
+            continue
+        other = teacher_modules.get(name)
+        if not _is_bnorm(other) or \
+                other.running_mean.shape != module.running_mean.shape or \
+                not th.equal(other.running_mean, module.running_mean) or \
+                not th.equal(other.running_var, module.running_var):
+            changed.append(name)
+    return changed
+
+
+def recalibrate_bn(model, batches, bnorms=None, num_batches=None):
+    r""" Recompute the running statistics of BN layers from a few batches.
+
+    The statistics of the selected BN layers are reset and re-estimated as
+    the cumulative average over the batches (momentum=None). Forward passes
+    run without autograd and every other layer, including the other BN
+    layers, is in eval mode, so nothing else changes. The momentum and the
+    mode of the layers are restored afterwards.
+
+    :param model: Network, e.g. a student right after a transform
+    :param batches: Iterable of input tensors or (inputs, targets) pairs,
+     e.g. a DataLoader
+    :param bnorms: Names of the BN layers to be recalibrated, all BN layers
+     by default, see changed_bnorms()
+    :param num_batches: Maximum number of batches to be used
+
+    :return: the model
+    """
+
+    modules = dict(model.named_modules())
+    if bnorms is None:
+        bnorms = [name for name, module in modules.items()
+                  if _is_bnorm(module)]
+    layers = [modules[name] for name in bnorms]
+    assert all(_is_bnorm(layer) for layer in layers), \
+        'Only BN layers with running statistics can be recalibrated'
+    if num_batches is not None:
+        batches = itertools.islice(batches, num_batches)
+
+    training = model.training
+    momenta = [layer.momentum for layer in layers]
+    model.eval()
+    try:
+        for layer in layers:
+            layer.reset_running_stats()
+            layer.momentum = None
+            layer.train()
+        with th.no_grad():
+            for batch in batches:
+                if isinstance(batch, (tuple, list)):
+                    batch = batch[0]
+                model(batch)
+    finally:
+        for layer, momentum in zip(layers, momenta):
+            layer.momentum = momentum
+        model.train(training)
+    return model
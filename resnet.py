@@ -10,6 +10,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+import net2net
+from initialization import skip_init
+
 
 class BasicBlock(nn.Module):
     expansion = 1
@@ -85,6 +88,33 @@ class ResNet(nn.Module):
             self.in_planes = planes * block.expansion
         return nn.Sequential(*layers)
 
+    def narrower(self, narrowing_factor, importance='norm'):
+        r""" Narrow the inner layers of every block by the given factor.
+
+        The channels of the residual path are shared by all blocks of a stage
+        and are kept, only the layers inside the blocks are narrowed.
+
+        :param narrowing_factor: factor to decrease the width by
+        :param importance: Ranking of the units to be kept, see
+         net2net.narrower
+        """
+
+        for block in list(self.modules()):
+            pairs = []
+            if isinstance(block, BasicBlock):
+                pairs = [('conv1', 'conv2', 'bn1')]
+            elif isinstance(block, Bottleneck):
+                pairs = [('conv1', 'conv2', 'bn1'), ('conv2', 'conv3', 'bn2')]
+            for name1, name2, bnorm_name in pairs:
+                layer1 = getattr(block, name1)
+                layer1, layer2, bnorm = net2net.narrower(
+                    layer1, getattr(block, name2),
+                    layer1.out_channels // narrowing_factor,
+                    getattr(block, bnorm_name), importance=importance)
+                setattr(block, name1, layer1)
+                setattr(block, name2, layer2)
+                setattr(block, bnorm_name, bnorm)
+
     def forward(self, x):
         out = F.relu(self.bn1(self.conv1(x)))
         out = self.layer1(out)
@@ -97,21 +127,28 @@ class ResNet(nn.Module):
         return out
 
 
-def ResNet18():
-    return ResNet(BasicBlock, [2,2,2,2])
+# The constructors take init=False to skip the weight initialisation of the
+# Conv/Linear layers, e.g. when a checkpoint is loaded right after.
 
-def ResNet34():
-    return ResNet(BasicBlock, [3,4,6,3])
+def ResNet18(init=True):
+    with skip_init(not init):
+        return ResNet(BasicBlock, [2,2,2,2])
 
-def ResNet50():
-    return ResNet(Bottleneck, [3,4,6,3])
+def ResNet34(init=True):
+    with skip_init(not init):
+        return ResNet(BasicBlock, [3,4,6,3])
 
-def ResNet101():
-    return ResNet(Bottleneck, [3,4,23,3])
+def ResNet50(init=True):
+    with skip_init(not init):
+        return ResNet(Bottleneck, [3,4,6,3])
 
-def ResNet152():
-    return ResNet(Bottleneck, [3,8,36,3])
+def ResNet101(init=True):
+    with skip_init(not init):
+        return ResNet(Bottleneck, [3,4,23,3])
 
+def ResNet152(init=True):
+    with skip_init(not init):
+        return ResNet(Bottleneck, [3,8,36,3])
 
 def test():
     net = ResNet18()
@@ -0,0 +1,69 @@
+import copy
+import torch.nn as nn
+
+
+def shared_copy(model):
+    r""" Copy of a network whose parameters share storage with the network.
+
+    The copy has its own Parameter objects, so a transform replacing the data
+    of a parameter (e.g. widening it) leaves the original network unchanged,
+    but no parameter is copied. Buffers (e.g. BN running statistics) are
+    updated in place by the forward pass and are copied.
+
+    Parameters which are still shared are written in place by an optimizer,
+    wrap it with copy_on_write() before training the copy. The original
+    network must not be trained while the copy shares its storage.
+
+    :param model: Network to be copied, e.g. the teacher
+
+    :return: copy of the network
+    """
+
+    memo = {}
+    for param in model.parameters():
+        memo[id(param)] = nn.Parameter(param.data,
+                                       requires_grad=param.requires_grad)
+    return copy.deepcopy(model, memo)
+
+
+def shared_parameters(model, other):
+    r""" Parameters of the model sharing storage with the other network.
+
+    :param model: Network e.g. a student created by shared_copy
+    :param other: Network e.g. the teacher
+
+    :return: list of parameters of model
+    """
+
+    other_ptrs = set(param.data_ptr() for param in other.parameters())
+    return [param for param in model.parameters()
+            if param.data_ptr() in other_ptrs]
+
+
+def copy_on_write(optimizer, teacher):
+    r""" Copy shared parameters before the optimizer first writes them.
+
+    optimizer.step is wrapped so that every parameter which shares storage
+    with the teacher and has a gradient is given its own copy right before
+    the update. Parameters which are never updated, e.g. frozen layers, are
+    never copied.
+
+    :param optimizer: Optimizer of the student
+    :param teacher: Network the student shares storage with
+
+    :return: the optimizer
+    """
+
+    teacher_ptrs = set(param.data_ptr() for param in teacher.parameters())
+    step = optimizer.step
+
+    def copy_on_write_step(*args, **kwargs):
+        for group in optimizer.param_groups:
+            for param in group['params']:
+                if param.grad is not None and \
+                        param.data_ptr() in teacher_ptrs:
+                    param.data = param.data.clone()
+        return step(*args, **kwargs)
+
+    optimizer.step = copy_on_write_step
+    return optimizer
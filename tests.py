@@ -1,8 +1,30 @@
+import copy
 import unittest
+import numpy as np
 import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
+import alignment
+import analysis
+import fusion
+import growable
+import im2col
+import importance
+import initialization
+import monitor
+import netmorph
+import net2net
+import net2net_original
+import param_activation
+import planner
+import profiling
+import recalibration
+import shared_params
+import transform
+import verify
 from netmorph import wider, deeper
+from convnet import ConvNet, MNIST
+from resnet import ResNet18
 # from net2net import wider, deeper
 
 BASE_WIDTH = 8
@@ -106,5 +128,848 @@ class TestOperators(unittest.TestCase):
         print th.abs((out - nout).sum().data).item()  # [0]
         assert th.abs((out - nout).sum().data).item() < 1e-5, "New layer changes values by {}".format(th.abs(out - nout).sum().data[0])
 
+
+class TestVerify(unittest.TestCase):
+    def test_verify_wider(self):
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1 = wider(
+            student.conv1, student.conv2, student.conv1.out_channels * 2,
+            student.bn1)
+
+        report = verify.verify_preservation(teacher, student,
+                                            input_shape=(3, 32, 32),
+                                            num_batches=2)
+        assert len(report['outputs']) == 1
+        assert report['mean_abs_error'] <= report['max_abs_error']
+
+    def test_verify_wider_weights(self):
+        teacher = Net()
+        # Statistics which differ from the defaults of a fresh BN layer
+        for name in ('running_mean', 'running_var', 'weight', 'bias'):
+            tensor = getattr(teacher.bn3, name).data
+            tensor.copy_(th.rand(tensor.shape) + 0.5)
+        for operator, transform_type in ((wider, 'netmorph'),
+                                         (net2net.wider, 'net2net')):
+            student = copy.deepcopy(teacher)
+            student.conv3, student.fc1, student.bn3, mapping = operator(
+                student.conv3, student.fc1, student.conv3.out_channels * 2,
+                student.bn3, return_mapping=True)
+
+            verify.verify_wider_weights(
+                teacher.conv3, teacher.fc1, student.conv3, student.fc1,
+                mapping, teacher.bn3, student.bn3,
+                transform_type=transform_type)
+
+    def test_detects_change(self):
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        student.fc1.bias.data += 1
+
+        report = verify.compare_outputs(teacher, student,
+                                        inputs=th.rand(4, 3, 32, 32))
+        assert report['max_abs_error'] > verify.ERROR_TOLERANCE
+
+
+class TestDriftMonitor(unittest.TestCase):
+    def test_first_divergence(self):
+        teacher = Net()
+        teacher.eval()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1 = wider(
+            student.conv1, student.conv2, student.conv1.out_channels * 2,
+            student.bn1)
+        student.conv3.bias.data += 1
+        student.eval()
+
+        drift = monitor.DriftMonitor(teacher, student, max_steps=2)
+        for _ in range(3):
+            drift.step(th.rand(4, 3, 32, 32))
+
+        assert drift.steps == 2
+        assert drift.first_divergence() == 'conv3'
+        assert drift.stats['conv1'].max < monitor.ERROR_TOLERANCE
+        assert drift.stats['conv1'].count == 2 * 4 * 8 * 32 * 32
+
+    def test_running_stat(self):
+        values = th.rand(1000).double()
+        stat = monitor.RunningStat()
+        for chunk in values.split(300):
+            stat.update(chunk)
+
+        assert abs(stat.mean - values.mean().item()) < 1e-10
+        assert abs(stat.variance - values.var(unbiased=False).item()) < 1e-10
+        assert stat.max == values.max().item()
+
+
+class TestConvolution(unittest.TestCase):
+    def test_conv2d_forward(self):
+        inp = np.random.rand(2, 6, 11, 9)
+        weight = np.random.rand(4, 3, 3, 3)
+        bias = np.random.rand(4)
+
+        out = im2col.conv2d_forward(inp, weight, bias, stride=2, padding=1,
+                                    groups=2)
+        expected = F.conv2d(th.from_numpy(inp), th.from_numpy(weight),
+                            th.from_numpy(bias), stride=2, padding=1,
+                            groups=2).numpy()
+
+        assert out.shape == expected.shape
+        assert np.abs(out - expected).max() < 1e-8
+
+    def test_conv2d_transpose(self):
+        inp = np.random.rand(2, 6, 5, 7)
+        weight = np.random.rand(6, 2, 3, 3)
+
+        out = im2col.conv2d_transpose(inp, weight, stride=2, padding=1,
+                                      groups=3)
+        expected = F.conv_transpose2d(th.from_numpy(inp),
+                                      th.from_numpy(weight), stride=2,
+                                      padding=1, groups=3).numpy()
+
+        assert out.shape == expected.shape
+        assert np.abs(out - expected).max() < 1e-8
+
+    def test_compose_filters(self):
+        f1 = np.random.rand(5, 3, 3, 3)
+        f2 = np.random.rand(4, 5, 3, 3)
+        inp = th.rand(2, 3, 12, 12).double()
+
+        composed = im2col.compose_filters(f1, f2)
+        out = F.conv2d(F.conv2d(inp, th.from_numpy(f1)), th.from_numpy(f2))
+        nout = F.conv2d(inp, th.from_numpy(composed))
+
+        assert composed.shape == (4, 3, 5, 5)
+        assert th.abs(out - nout).max().item() < 1e-8
+
+
+class TestProfiling(unittest.TestCase):
+    def test_spans(self):
+        net = Net()
+        with profiling.TransformProfiler() as profiler:
+            wider(net.conv1, net.conv2, net.conv1.out_channels * 2, net.bn1)
+        # Spans are only recorded while a profiler is active
+        wider(net.conv2, net.conv3, net.conv2.out_channels * 2, net.bn2)
+
+        report = dict((entry['name'], entry) for entry in profiler.report())
+        assert report['netmorph.wider']['calls'] == 1
+        assert 'netmorph.wider/replicate_out' in report
+        assert report['netmorph.wider/bnorm']['copies'] == 4
+        assert report['netmorph.wider']['copies'] >= \
+            report['netmorph.wider/replicate_out']['copies']
+        assert report['netmorph.wider']['copied_bytes'] > 0
+
+    def test_deeper_spans(self):
+        with profiling.TransformProfiler() as profiler:
+            net2net.deeper(nn.Conv2d(3, 4, 3, padding=1), filters=4)
+            net2net_original.deeper(nn.Conv2d(3, 4, 3, padding=1), None)
+            deeper(nn.Conv2d(3, 4, 3, padding=1), filters=4)
+
+        report = dict((entry['name'], entry) for entry in profiler.report())
+        for module in ('net2net', 'net2net_original', 'netmorph'):
+            assert report[module + '.deeper']['calls'] == 1, module
+            assert module + '.deeper/construct' in report, module
+            assert module + '.deeper/bnorm' in report, module
+        assert 'net2net.deeper/noise' in report
+        assert 'netmorph.deeper/decompose' in report
+
+
+class TestSharedParams(unittest.TestCase):
+    def test_copy_on_write(self):
+        teacher = Net()
+        teacher_state = copy.deepcopy(teacher.state_dict())
+        student = shared_params.shared_copy(teacher)
+        assert len(shared_params.shared_parameters(student, teacher)) == \
+            len(list(teacher.parameters()))
+
+        student.conv1, student.conv2, student.bn1 = wider(
+            student.conv1, student.conv2, student.conv1.out_channels * 2,
+            student.bn1)
+        student.fc1.weight.requires_grad = False
+        optimizer = shared_params.copy_on_write(
+            th.optim.SGD([p for p in student.parameters() if p.requires_grad],
+                         lr=0.1), teacher)
+
+        optimizer.zero_grad()
+        student(th.rand(4, 3, 32, 32)).sum().backward()
+        optimizer.step()
+
+        shared = shared_params.shared_parameters(student, teacher)
+        assert len(shared) == 1 and shared[0] is student.fc1.weight
+        for name, tensor in teacher.state_dict().items():
+            assert th.equal(tensor, teacher_state[name]), name
+
+    def test_operators_keep_teacher(self):
+        teacher = Net()
+        teacher_state = copy.deepcopy(teacher.state_dict())
+        for operator in (netmorph.wider, net2net.wider,
+                         net2net_original.wider):
+            student = shared_params.shared_copy(teacher)
+            operator(student.conv1, student.conv2,
+                     student.conv1.out_channels * 2, student.bn1)
+        for operator in (lambda layer: netmorph.deeper(layer, filters=8),
+                         lambda layer: net2net.deeper(layer, filters=8),
+                         lambda layer: net2net_original.deeper(layer, None)):
+            student = shared_params.shared_copy(teacher)
+            operator(student.conv1)
+        for name, tensor in teacher.state_dict().items():
+            assert th.equal(tensor, teacher_state[name]), name
+
+
+class TestNarrower(unittest.TestCase):
+    def test_inverse_of_wider(self):
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        student.conv2, student.conv3, student.bn2, mapping = wider(
+            student.conv2, student.conv3, student.conv2.out_channels * 2,
+            student.bn2, return_mapping=True)
+
+        student.conv2, student.conv3, student.bn2, kept = net2net.narrower(
+            student.conv2, student.conv3, teacher.conv2.out_channels,
+            student.bn2, mapping=mapping, return_mapping=True)
+
+        assert kept.tolist() == list(range(teacher.conv2.out_channels))
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+    def test_fold_replicas(self):
+        teacher = Net()
+        teacher.eval()
+        student = copy.deepcopy(teacher)
+        student.conv2, student.conv3, student.bn2, mapping = net2net.wider(
+            student.conv2, student.conv3, student.conv2.out_channels * 2,
+            student.bn2, return_mapping=True)
+        # Keep the last replica of every original unit, the others fold in
+        last = dict((unit, index) for index, unit in enumerate(mapping.tolist()))
+        scores = -th.ones(mapping.numel())
+        scores[list(last.values())] = 0
+
+        student.conv2, student.conv3, student.bn2 = net2net.narrower(
+            student.conv2, student.conv3, teacher.conv2.out_channels,
+            student.bn2, importance=scores)
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+    def test_resnet(self):
+        net = ResNet18()
+        net.narrower(2)
+        assert net.layer1[0].conv1.out_channels == 32
+        assert net(th.rand(2, 3, 32, 32)).shape == (2, 10)
+
+
+class TestParamActivation(unittest.TestCase):
+    def test_matches_reference(self):
+        activation = param_activation.ParamActivation(4)
+        activation.weight.data = th.Tensor([0, 0.25, 0.5, 1])
+        inputs = th.randn(2, 4, 3, 3, requires_grad=True)
+        reference = param_activation._reference_forward(
+            inputs, activation.weight)
+        grads = th.autograd.grad(reference.sum(),
+                                 (inputs, activation.weight))
+
+        output = activation(inputs)
+        assert th.allclose(output, reference)
+        for grad, expected in zip(th.autograd.grad(
+                output.sum(), (inputs, activation.weight)), grads):
+            assert th.allclose(grad, expected)
+
+    def test_short_circuit(self):
+        activation = param_activation.ParamActivation()
+        inputs = th.randn(2, 4, 3, 3)
+        with th.no_grad():
+            assert activation(inputs) is inputs
+            activation.weight.data.fill_(0)
+            assert th.equal(activation(inputs), F.relu(inputs))
+
+    def test_alpha_scheduler(self):
+        net = nn.Sequential(nn.Linear(4, 4),
+                            param_activation.ParamActivation(4),
+                            nn.Linear(4, 2))
+        scheduler = param_activation.AlphaScheduler(net, total_steps=4)
+        alphas = [scheduler.step() for _ in range(3)]
+        assert alphas == [0.75, 0.5, 0.25]
+        assert th.equal(net[1].weight.data, th.Tensor([0.25] * 4))
+
+        inputs = th.randn(3, 4)
+        expected = net[2](F.relu(net[0](inputs)))
+        assert scheduler.step() == 0
+        assert isinstance(net[1], nn.ReLU)
+        assert th.allclose(net(inputs), expected)
+
+
+class TestAnalysis(unittest.TestCase):
+    def test_pending_transform(self):
+        net = Net()
+        plan = transform.Transform('net2net') \
+            .wider('conv2', 'conv3', 24, bnorm='bn2') \
+            .wider('conv3', 'fc1', 40, bnorm='bn3').deeper('conv3')
+        report = analysis.analyse(net, (3, 32, 32), batch_size=4,
+                                  transform=plan)
+        assert report['layers']['conv3.conv_new']['output_shape'] == (40, 7, 7)
+        assert report['layers']['fc1']['macs'] == 4 * 40 * 9 * 10
+
+        student = plan.apply(copy.deepcopy(net))
+        outputs = []
+        for module in student.modules():
+            if not list(module.children()):
+                module.register_forward_hook(
+                    lambda m, i, output: outputs.append(output))
+        student(th.rand(4, 3, 32, 32))
+        assert report['params'] == sum(p.numel()
+                                       for p in student.parameters())
+        assert report['activation_bytes'] == sum(
+            output.numel() * 4 for output in outputs)
+
+    def test_resnet(self):
+        net = ResNet18()
+        report = analysis.analyse(net, (3, 32, 32))
+        assert report['params'] == sum(p.numel() for p in net.parameters())
+        assert report['output_shape'] == (10,)
+
+    def test_mnist_convnet(self):
+        net = ConvNet(MNIST)
+        assert net(th.rand(2, 1, 28, 28)).shape == (2, 10)
+
+
+class TestPlanner(unittest.TestCase):
+    def test_macs_budget(self):
+        net = Net()
+        pairs = [('conv1', 'conv2', 'bn1'), ('conv2', 'conv3', 'bn2'),
+                 ('conv3', 'fc1', 'bn3')]
+        budget = 3 * analysis.analyse(net, (3, 32, 32))['macs']
+        plan, report = planner.plan_widths(net, (3, 32, 32), pairs, budget)
+
+        student = plan.apply(copy.deepcopy(net))
+        macs = analysis.analyse(student, (3, 32, 32))['macs']
+        assert macs == report['cost'] <= budget
+        # Not even one more unit fits
+        for layer, next_layer, bnorm in pairs:
+            wider = transform.Transform('net2net').wider(
+                layer, next_layer, report['widths'][layer] + 1, bnorm=bnorm)
+            assert analysis.analyse(student, (3, 32, 32),
+                                    transform=wider)['macs'] > budget
+        verify.verify_preservation(net, student, input_shape=(3, 32, 32))
+
+    def test_latency_budget(self):
+        net = Net()
+        net.eval()
+        pairs = [('conv1', 'conv2', 'bn1'), ('conv2', 'conv3', 'bn2')]
+        inputs = th.rand(1, 3, 32, 32)
+        budget = 2 * fusion.measure_latency(net, inputs, repeat=5)
+        plan, report = planner.plan_widths(net, (3, 32, 32), pairs, budget,
+                                           metric='latency', repeat=5)
+        assert report['measured'] <= budget
+
+        student = plan.apply(copy.deepcopy(net))
+        for layer, _, _ in pairs:
+            assert transform._out_width(transform.get_module(
+                student, layer)) == report['widths'][layer]
+        verify.verify_preservation(net, student, input_shape=(3, 32, 32))
+
+    def test_constant_cost(self):
+        widths, cost = planner._greedy(lambda widths: 1.0, [8, 16], 2.0)
+        assert cost == 1.0 and widths != [8, 16]
+
+        # Latency not growing with the width, planned proportional to MACs
+        net = Net()
+        measure_latency = fusion.measure_latency
+        fusion.measure_latency = lambda model, inputs, repeat: 1e-3
+        try:
+            plan, report = planner.plan_widths(
+                net, (3, 32, 32), [('conv1', 'conv2', 'bn1')], 2e-3,
+                metric='latency')
+        finally:
+            fusion.measure_latency = measure_latency
+        macs = analysis.analyse(net, (3, 32, 32))['macs']
+        assert report['cost'] <= 2e-3 and report['measured'] == 1e-3
+        assert analysis.analyse(net, (3, 32, 32),
+                                transform=plan)['macs'] <= 2 * macs
+
+
+class TestAlignment(unittest.TestCase):
+    def test_aligned_wider(self):
+        assert alignment.align_width(17, 8) == 24
+        assert alignment.align_width(17) == 17
+
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1 = wider(
+            student.conv1, student.conv2, 10, student.bn1, align=8)
+        assert student.conv1.out_channels == 16
+        assert student.conv2.in_channels == 16
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+        plan = transform.Transform('net2net').wider('conv2', 'conv3', 20,
+                                                    bnorm='bn2', align=16)
+        assert plan.validate(teacher)['conv2'] == (32, 8, 3, 3)
+
+    def test_aligned_wider_beyond_double(self):
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1 = net2net.wider(
+            student.conv1, student.conv2, 10, student.bn1, align=32)
+        assert student.conv1.out_channels == 32
+        assert student.conv2.in_channels == 32
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+    def test_fastest_width(self):
+        width, timings = alignment.fastest_width(20, 4, 8, batch_size=2,
+                                                 repeat=1)
+        assert width in timings and width >= 20
+        assert list(timings) == [20, 24]
+
+
+class TestImportance(unittest.TestCase):
+    def test_top_units(self):
+        scores = th.Tensor([0.1, 3, 2, 0])
+        assert importance.top_units(scores, 2).tolist() == [1, 2]
+        assert importance.top_units(scores, 6).tolist() == [1, 2, 0, 3, 1, 2]
+
+    def test_collect_scores(self):
+        net = Net()
+        batches = [(th.rand(4, 3, 32, 32), th.randint(0, 10, (4,)))
+                   for _ in range(3)]
+        scores = importance.collect_scores(net, ['conv1', 'fc1'], batches)
+        outputs = th.cat([net.conv1(inputs) for inputs, _ in batches])
+        expected = outputs.transpose(0, 1).contiguous().view(BASE_WIDTH, -1) \
+            .double().var(1, unbiased=False)
+        assert th.allclose(scores['conv1'], expected.detach())
+        assert scores['fc1'].numel() == 10
+
+        scores = importance.collect_scores(
+            net, ['conv2'], batches, criterion='gradient',
+            loss_fn=nn.CrossEntropyLoss())
+        assert scores['conv2'].numel() == 2 * BASE_WIDTH
+        assert all(p.grad is None for p in net.parameters())
+
+    def test_guided_wider(self):
+        teacher = Net()
+        scores = th.arange(BASE_WIDTH).float()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1, mapping = net2net.wider(
+            student.conv1, student.conv2, BASE_WIDTH + 3, student.bn1,
+            return_mapping=True, scores=scores)
+        assert mapping[BASE_WIDTH:].tolist() == [7, 6, 5]
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+        student = transform.Transform('net2net') \
+            .wider('conv1', 'conv2', BASE_WIDTH + 2, bnorm='bn1',
+                   scores=scores) \
+            .wider('conv1', 'conv2', BASE_WIDTH + 4, bnorm='bn1',
+                   scores=scores).apply(copy.deepcopy(teacher))
+        # The replicas of unit 7 share its score, so unit 5 comes next
+        new_units = student.conv1.weight.data[BASE_WIDTH:]
+        for unit, teacher_unit in zip(new_units, [7, 6, 5, 4]):
+            assert th.equal(unit, teacher.conv1.weight.data[teacher_unit])
+
+
+class TestRecalibration(unittest.TestCase):
+    def test_recalibrate_changed(self):
+        teacher = Net()
+        teacher.eval()
+        student = copy.deepcopy(teacher)
+        student.conv1, student.conv2, student.bn1 = wider(
+            student.conv1, student.conv2, 2 * BASE_WIDTH, student.bn1)
+        bnorms = recalibration.changed_bnorms(teacher, student)
+        assert bnorms == ['bn1']
+
+        batches = [(th.rand(4, 3, 32, 32), None) for _ in range(3)]
+        recalibration.recalibrate_bn(student, batches, bnorms, num_batches=2)
+        # Cumulative average of the statistics of the first two batches
+        outputs = th.stack([
+            student.conv1(inputs).transpose(0, 1).contiguous().view(
+                2 * BASE_WIDTH, -1) for inputs, _ in batches[:2]]).detach()
+        assert th.allclose(student.bn1.running_mean, outputs.mean(2).mean(0),
+                           atol=1e-6)
+        assert th.allclose(student.bn1.running_var, outputs.var(2).mean(0),
+                           atol=1e-6)
+        assert student.bn1.momentum == teacher.bn1.momentum
+        assert not student.training and not student.bn1.training
+        assert th.equal(student.bn2.running_mean, teacher.bn2.running_mean)
+        assert all(p.grad is None for p in student.parameters())
+
+
+class MobileBlock(nn.Module):
+    # Pointwise, depthwise and grouped pointwise convolutions
+    def __init__(self):
+        super(MobileBlock, self).__init__()
+        self.conv1 = nn.Conv2d(3, 8, kernel_size=1)
+        self.bn1 = nn.BatchNorm2d(8)
+        self.dw = nn.Conv2d(8, 16, kernel_size=3, padding=1, groups=8)
+        self.bn2 = nn.BatchNorm2d(16)
+        self.conv2 = nn.Conv2d(16, 8, kernel_size=1, groups=2)
+        self.conv3 = nn.Conv2d(8, 4, kernel_size=3, padding=1, groups=4)
+
+    def forward(self, x):
+        x = F.relu(self.bn1(self.conv1(x)))
+        x = F.relu(self.bn2(self.dw(x)))
+        return self.conv3(F.relu(self.conv2(x)))
+
+
+class TestGrouped(unittest.TestCase):
+    def test_wider(self):
+        for transform_type in transform.TRANSFORM_TYPES:
+            teacher = MobileBlock()
+            plan = transform.Transform(transform_type) \
+                .wider_depthwise('conv1', 'dw', 'conv2', 12, bnorm='bn1',
+                                 depthwise_bnorm='bn2') \
+                .wider('conv2', 'conv3', 16) \
+                .wider_depthwise('conv1', 'dw', 'conv2', 20, bnorm='bn1',
+                                 depthwise_bnorm='bn2')
+            shapes = plan.validate(teacher)
+            assert shapes['dw'] == (40, 1, 3, 3)
+            assert shapes['conv2'] == (16, 20, 1, 1)
+
+            student = plan.apply(copy.deepcopy(teacher))
+            assert student.dw.groups == 20 and student.conv2.groups == 2
+            assert student.conv3.groups == 4
+            verify.verify_preservation(teacher, student,
+                                       input_shape=(3, 8, 8))
+
+    def test_group_multiple(self):
+        plan = transform.Transform('net2net').wider('conv2', 'conv3', 10)
+        self.assertRaises(AssertionError, plan.validate, MobileBlock())
+
+    def test_operators(self):
+        teacher = MobileBlock()
+        student = copy.deepcopy(teacher)
+        net2net.wider_depthwise(student.conv1, student.dw, student.conv2, 16,
+                                bnorm1=student.bn1, bnorm2=student.bn2)
+        net2net.wider(student.conv2, student.conv3, 12)
+        assert student.dw.weight.shape == (32, 1, 3, 3)
+        assert student.conv3.weight.shape == (4, 3, 3, 3)
+        verify.verify_preservation(teacher, student, input_shape=(3, 8, 8),
+                                   tolerance=1e-1)
+
+        for operator in (wider, net2net_original.wider):
+            student = copy.deepcopy(teacher)
+            student.conv2, student.conv3, _ = operator(student.conv2,
+                                                       student.conv3, 12)
+            assert student.conv2.groups == 2 and student.conv3.groups == 4
+            assert student.conv3.weight.shape == (4, 3, 3, 3)
+            verify.verify_preservation(teacher, student,
+                                       input_shape=(3, 8, 8), tolerance=1e-1)
+        self.assertRaises(AssertionError, netmorph.deeper, teacher.dw)
+
+    def test_deeper(self):
+        teacher = MobileBlock()
+        student = transform.Transform('net2net').deeper('dw', bnorm=False) \
+            .apply(copy.deepcopy(teacher))
+        assert student.dw.conv_new.groups == 8
+        verify.verify_preservation(teacher, student, input_shape=(3, 8, 8))
+
+    def test_growable(self):
+        teacher = nn.Sequential(nn.Conv2d(4, 8, 3, groups=2), nn.ReLU(),
+                                nn.Conv2d(8, 4, 3, groups=2))
+        student = copy.deepcopy(teacher)
+        student[0] = growable.from_module(student[0])
+        student[2] = growable.from_module(student[2])
+        weight = student[0].weight
+        net2net.wider(student[0], student[2], 12)
+        assert student[0].weight is weight
+        assert student[0].groups == 2 and student[2].groups == 2
+        assert student[2].weight.shape == (4, 6, 3, 3)
+        verify.verify_preservation(teacher, student, input_shape=(4, 8, 8))
+        self.assertRaises(AssertionError, growable.wider, student[0],
+                          student[2], 16)
+
+
+GEOMETRIES = (
+    {'kernel_size': 1},
+    {'kernel_size': 5, 'stride': 2, 'padding': 2},
+    {'kernel_size': (3, 5), 'padding': (1, 2)},
+    {'kernel_size': 3, 'padding': 2, 'dilation': 2},
+    {'kernel_size': 3, 'padding': 1, 'bias': False},
+    {'kernel_size': 3, 'padding': 1, 'padding_mode': 'circular'},
+)
+
+
+def _geometry(layer):
+    return (layer.kernel_size, layer.stride, layer.padding, layer.dilation,
+            layer.bias is not None, getattr(layer, 'padding_mode', 'zeros'))
+
+
+class TestGeometry(unittest.TestCase):
+    def _teacher(self, geometry):
+        return nn.Sequential(nn.Conv2d(3, 6, **geometry), nn.BatchNorm2d(6),
+                             nn.ReLU(), nn.Conv2d(6, 4, **geometry))
+
+    def _check(self, teacher, student, geometry, tolerance):
+        for index in (0, 3):
+            assert _geometry(student[index]) == _geometry(teacher[index]), \
+                geometry
+        verify.verify_preservation(teacher, student, tolerance=tolerance,
+                                   input_shape=(3, 12, 12))
+
+    def test_operators(self):
+        for geometry in GEOMETRIES:
+            for operator in (net2net.wider, wider):
+                teacher = self._teacher(geometry)
+                student = copy.deepcopy(teacher)
+                student[0], student[3], student[1] = operator(
+                    student[0], student[3], 10, student[1])
+                assert student[0].weight.size(0) == 10
+                self._check(teacher, student, geometry, 1e-1)
+
+    def test_transform(self):
+        for geometry in GEOMETRIES:
+            for transform_type in transform.TRANSFORM_TYPES:
+                teacher = self._teacher(geometry)
+                student = transform.Transform(transform_type) \
+                    .wider('0', '3', 10, bnorm='1') \
+                    .apply(copy.deepcopy(teacher))
+                self._check(teacher, student, geometry,
+                            verify.ERROR_TOLERANCE)
+
+    def test_narrower(self):
+        for geometry in GEOMETRIES:
+            teacher = self._teacher(geometry)
+            student = copy.deepcopy(teacher)
+            student[0], student[3], student[1], mapping = wider(
+                student[0], student[3], 10, student[1], return_mapping=True)
+            student[0], student[3], student[1] = net2net.narrower(
+                student[0], student[3], 6, student[1], mapping=mapping)
+            assert student[0].weight.size(0) == 6
+            self._check(teacher, student, geometry, verify.ERROR_TOLERANCE)
+
+    def test_deeper(self):
+        for geometry in GEOMETRIES:
+            teacher = nn.Sequential(nn.Conv2d(3, 6, **geometry))
+            student = copy.deepcopy(teacher)
+            student[0] = net2net.deeper(student[0], bnorm=False, filters=6)
+            new_layer = student[0][-1]
+            assert new_layer.dilation == teacher[0].dilation, geometry
+            assert (new_layer.bias is None) == (teacher[0].bias is None)
+            verify.verify_preservation(teacher, student, tolerance=1e-1,
+                                       input_shape=(3, 12, 12))
+
+            student = copy.deepcopy(teacher)
+            student[0] = net2net_original.deeper(student[0], None,
+                                                 bnorm_flag=False, noise=False)
+            new_layer = student[0][-1]
+            assert new_layer.dilation == teacher[0].dilation, geometry
+            assert (new_layer.bias is None) == (teacher[0].bias is None)
+            verify.verify_preservation(teacher, student,
+                                       input_shape=(3, 12, 12))
+
+    def test_netmorph_deeper(self):
+        # The filter decomposition is approximate, only the geometry and the
+        # output shape are checked
+        inputs = th.rand(2, 3, 12, 12)
+        for geometry in GEOMETRIES:
+            teacher = nn.Conv2d(3, 6, **geometry)
+            if teacher.kernel_size[0] != teacher.kernel_size[1]:
+                self.assertRaises(AssertionError, netmorph.deeper, teacher)
+                continue
+            student = netmorph.deeper(copy.deepcopy(teacher), None,
+                                      bnorm=False, filters=6)
+            first, last = student[0], student[-1]
+            assert first.stride == (1, 1) and last.stride == teacher.stride
+            assert last.padding == teacher.padding, geometry
+            assert last.dilation == teacher.dilation, geometry
+            assert getattr(last, 'padding_mode', None) == \
+                getattr(teacher, 'padding_mode', None), geometry
+            assert (last.bias is None) == (teacher.bias is None), geometry
+            assert student(inputs).shape == teacher(inputs).shape, geometry
+        self.assertRaises(RuntimeError, netmorph.deeper, nn.Linear(4, 4))
+
+
+class FlatNet(nn.Module):
+    # Conv layer followed by a Linear layer on a non-square feature map
+    def __init__(self):
+        super(FlatNet, self).__init__()
+        self.conv1 = nn.Conv2d(3, 6, kernel_size=3, padding=1)
+        self.bn1 = nn.BatchNorm2d(6)
+        self.pool1 = nn.AvgPool2d(kernel_size=(2, 4))
+        self.fc1 = nn.Linear(6 * 6 * 5, 10)
+
+    def forward(self, x):
+        x = self.pool1(F.relu(self.bn1(self.conv1(x))))
+        return self.fc1(x.view(x.size(0), -1))
+
+
+class TestFlatten(unittest.TestCase):
+    def test_operators(self):
+        operators = (net2net.wider, wider,
+                     lambda *args, **kwargs: net2net_original.wider(
+                         *args, noise=False, weight_norm=False, **kwargs))
+        for operator in operators:
+            teacher = FlatNet()
+            student = copy.deepcopy(teacher)
+            student.conv1, student.fc1, student.bn1 = operator(
+                student.conv1, student.fc1, 10, student.bn1, out_size=(6, 5))
+            assert student.fc1.weight.shape == (10, 10 * 6 * 5)
+            verify.verify_preservation(teacher, student, tolerance=1e-1,
+                                       input_shape=(3, 12, 20))
+
+    def test_out_size(self):
+        net = FlatNet()
+        self.assertRaises(AssertionError, net2net.wider, net.conv1, net.fc1,
+                          10, net.bn1, out_size=(5, 5))
+
+    def test_convnet(self):
+        teacher = ConvNet(MNIST)
+        student = copy.deepcopy(teacher)
+        student.wider('net2net', 2)
+        assert student.fc1.in_features == 2 * teacher.fc1.in_features
+        verify.verify_preservation(teacher, student, tolerance=1e-1,
+                                   input_shape=(1, 28, 28))
+
+
+class TestFusion(unittest.TestCase):
+    def test_fuse(self):
+        net = Net()
+        for _ in range(2):
+            net(th.rand(4, 3, 32, 32))
+        transform.Transform('net2net').deeper('conv2').deeper('fc1', False) \
+            .apply(net)
+
+        fused, report = fusion.fuse_and_report(net, (3, 32, 32),
+                                               batch_size=4, repeat=2)
+        assert report['folded_bnorms'] == 4
+        assert report['merged_layers'] == 2
+        assert report['max_abs_error'] < verify.ERROR_TOLERANCE
+        assert isinstance(fused.conv2[0], nn.Conv2d) and len(fused.conv2) == 1
+        assert net.training and isinstance(net.bn1, nn.BatchNorm2d)
+
+    def test_inexact_merge(self):
+        first = nn.Conv2d(3, 4, 3, padding=1)
+        second = nn.Conv2d(4, 5, 3, padding=1)
+        assert fusion.merge_linear_layers(first, second) is None
+
+
+class TestGrowable(unittest.TestCase):
+    def test_wider_in_place(self):
+        teacher = Net()
+        student = copy.deepcopy(teacher)
+        for name in ('conv1', 'bn1', 'conv2', 'conv3', 'bn3', 'fc1'):
+            setattr(student, name, growable.from_module(getattr(student, name)))
+        conv1_weight = student.conv1.weight
+        student.conv1.reserve(out_width=32)
+
+        student.conv1, student.conv2, student.bn1 = growable.wider(
+            student.conv1, student.conv2, 16, student.bn1, noise=False)
+        storage = student.conv1.weight.data_ptr()
+        student.conv1, student.conv2, student.bn1 = growable.wider(
+            student.conv1, student.conv2, 32, student.bn1, noise=False)
+        student.conv3, student.fc1, student.bn3 = growable.wider(
+            student.conv3, student.fc1, 48, student.bn3, noise=False)
+
+        assert student.conv1.weight is conv1_weight
+        assert student.conv1.weight.data_ptr() == storage
+        assert student.conv1.weight.shape == (32, 3, 3, 3)
+        assert student.fc1.in_features == 48 * 9
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+
+    def test_grow_optimizer_state(self):
+        layer = growable.GrowableLinear(4, 3)
+        optimizer = th.optim.SGD(layer.parameters(), lr=0.1, momentum=0.9)
+        layer(th.rand(2, 4)).sum().backward()
+        optimizer.step()
+        momentum = optimizer.state[layer.weight]['momentum_buffer'].clone()
+
+        layer.grow(out_width=5, in_width=6)
+        growable.grow_optimizer_state(optimizer, layer.parameters())
+        state = optimizer.state[layer.weight]['momentum_buffer']
+        assert state.shape == (5, 6)
+        assert th.equal(state[:3, :4], momentum)
+        assert state[3:].abs().sum().item() == 0
+
+        optimizer.zero_grad()
+        layer(th.rand(2, 6)).sum().backward()
+        optimizer.step()
+
+
+class TestInitialization(unittest.TestCase):
+    def test_skip_init(self):
+        reset_parameters = nn.Linear.__dict__['reset_parameters']
+        with initialization.skip_init():
+            assert nn.Linear.__dict__['reset_parameters'] is not \
+                reset_parameters
+            layer = nn.Linear(4, 3)
+        assert nn.Linear.__dict__['reset_parameters'] is reset_parameters
+        assert layer.weight.shape == (3, 4)
+
+    def test_load_without_init(self):
+        teacher = ResNet18()
+        student = ResNet18(init=False)
+        student.load_state_dict(teacher.state_dict())
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32),
+                                   batch_size=2)
+
+
+class TestTransform(unittest.TestCase):
+    def test_apply(self):
+        for transform_type in transform.TRANSFORM_TYPES:
+            teacher = Net()
+            plan = transform.Transform(transform_type) \
+                .wider('conv1', 'conv2', 12, bnorm='bn1') \
+                .wider('conv1', 'conv2', 20, bnorm='bn1') \
+                .wider('conv2', 'conv3', 40, bnorm='bn2') \
+                .wider('conv3', 'fc1', 64, bnorm='bn3') \
+                .deeper('conv2')
+
+            shapes = plan.validate(teacher)
+            assert shapes['conv2'] == (40, 20, 3, 3)
+            assert shapes['conv2.conv_new'] == (40, 40, 3, 3)
+            assert shapes['fc1'] == (10, 64 * 9)
+
+            student = plan.apply(copy.deepcopy(teacher))
+            assert student.bn1.running_mean.numel() == 20
+            verify.verify_preservation(teacher, student,
+                                       input_shape=(3, 32, 32))
+
+    def test_validate(self):
+        net = Net()
+        plan = transform.Transform('net2net').deeper('conv1') \
+            .wider('conv1', 'conv2', 16)
+        self.assertRaises(AssertionError, plan.validate, net)
+
+        plan = transform.Transform('net2net').wider('conv1', 'conv2', 16,
+                                                    bnorm='bn2')
+        self.assertRaises(AssertionError, plan.apply, net)
+        assert net.conv1.out_channels == BASE_WIDTH
+
+    def test_lazy_student(self):
+        teacher = Net()
+        teacher_state = copy.deepcopy(teacher.state_dict())
+        plan = transform.Transform('net2net') \
+            .wider('conv1', 'conv2', 16, bnorm='bn1') \
+            .wider('conv2', 'conv3', 32, bnorm='bn2').deeper('conv3')
+
+        student = transform.LazyStudent(teacher, plan)
+        assert not student.materialized
+        assert len(list(student.parameters())) == 0
+        assert student.shapes['conv2'] == (32, 16, 3, 3)
+
+        verify.verify_preservation(teacher, student, input_shape=(3, 32, 32))
+        assert student.materialized
+        assert student.student.conv1.weight.size(0) == 16
+        for name, tensor in teacher.state_dict().items():
+            assert th.equal(tensor, teacher_state[name]), name
+        assert teacher.conv2.bias.data_ptr() != \
+            student.student.conv2.bias.data_ptr()
+
+    def test_flatten_sequential(self):
+        net = Net()
+        for name in ('conv2', 'conv2.conv_new', 'conv2.conv_new.conv'):
+            transform.Transform('net2net').deeper(name).apply(net)
+        nested = copy.deepcopy(net)
+        inputs = th.rand(2, 3, 32, 32)
+        nested.eval()
+        net.eval()
+
+        key_map = transform.flatten_sequential(net)
+        assert not any(isinstance(child, nn.Sequential)
+                       for child in net.conv2.children())
+        assert list(net.conv2._modules) == [
+            'conv', 'bnorm', 'conv_new_conv_conv', 'conv_new_conv_bnorm',
+            'conv_new_conv_conv_new', 'conv_new_bnorm', 'conv_new_conv_new']
+        assert key_map['conv2.conv_new.conv.conv.weight'] == \
+            'conv2.conv_new_conv_conv.weight'
+        assert th.allclose(nested(inputs), net(inputs))
+
+        state = transform.remap_state_dict(nested.state_dict(), key_map)
+        net.load_state_dict(state)
+
+
 if __name__ == '__main__':
     unittest.main()
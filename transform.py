@@ -1,11 +1,768 @@
+import copy
+import sys
+import torch as th
+import torch.nn as nn
+from collections import OrderedDict
+
+import alignment
+import importance
+import profiling
+from initialization import skip_init, without_init
+
+sys.path.append('./')
+from utils import add_noise
+
+TRANSFORM_TYPES = ('net2net', 'netmorph', 'net2net_original')
+
+
+def get_module(model, name):
+    r""" Module of the model with the given (dotted) name. """
+
+    modules = dict(model.named_modules())
+    if name not in modules:
+        raise KeyError('{} has no module {}'.format(
+            model.__class__.__name__, name))
+    return modules[name]
+
+
+def set_module(model, name, module):
+    r""" Replace the module of the model with the given (dotted) name. """
+
+    parent_name, _, child_name = name.rpartition('.')
+    parent = get_module(model, parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+
+def resized_layer(module, out_width=None, in_width=None):
+    r""" New Conv2d/Linear layer with the geometry of a layer.
+
+    The kernel size, stride, padding, dilation, groups, padding mode and
+    the presence of a bias are copied, only the widths differ. The weights
+    are left uninitialised to be set by the caller.
+
+    :param module: Conv2d or Linear layer
+    :param out_width: Number of output channels/features, kept by default
+    :param in_width: Number of input channels/features, kept by default
+
+    :return: new layer
+    """
+
+    out_width = _out_width(module) if out_width is None else out_width
+    in_width = _in_width(module) if in_width is None else in_width
+    bias = module.bias is not None
+    with skip_init():
+        if isinstance(module, nn.Conv2d):
+            kwargs = {}
+            if hasattr(module, 'padding_mode'):
+                kwargs['padding_mode'] = module.padding_mode
+            return nn.Conv2d(in_width, out_width, module.kernel_size,
+                             stride=module.stride, padding=module.padding,
+                             dilation=module.dilation, groups=module.groups,
+                             bias=bias, **kwargs)
+        if isinstance(module, nn.Linear):
+            return nn.Linear(in_width, out_width, bias=bias)
+    raise RuntimeError('{} Module not supported'.format(
+        module.__class__.__name__))
+
+
+def wider_layers(transform_type, layer1, layer2, new_width, bnorm1=None,
+                 depthwise=None, bnorm2=None, scores=None, noise=True):
+    r""" Widen layers which are not part of a model in place by a Transform.
+
+    Used by the wider() operators for grouped convolutions: units are
+    replicated within their group and the group counts are kept.
+
+    :param transform_type: 'net2net', 'netmorph' or 'net2net_original'
+    :param layer1: Layer to be widened
+    :param layer2: Layer consuming the output of layer1 (or of depthwise)
+    :param new_width: New number of output channels of layer1
+    :param bnorm1: BN layer following layer1 if any
+    :param depthwise: Depthwise convolution between layer1 and layer2 if any,
+     see Transform.wider_depthwise()
+    :param bnorm2: BN layer following depthwise if any
+    :param scores: Importance of every unit of layer1
+    :param noise: Add symmetry breaking noise to the new units
+    """
+
+    container = nn.Module()
+    names = ('layer1', 'layer2', 'bnorm1', 'depthwise', 'bnorm2')
+    for name, module in zip(names, (layer1, layer2, bnorm1, depthwise,
+                                    bnorm2)):
+        if module is not None:
+            container.add_module(name, module)
+    bnorm1 = 'bnorm1' if bnorm1 is not None else None
+    bnorm2 = 'bnorm2' if bnorm2 is not None else None
+    plan = Transform(transform_type)
+    if noise:
+        plan.add_noise()
+    if depthwise is not None:
+        plan.wider_depthwise('layer1', 'depthwise', 'layer2', new_width,
+                             bnorm=bnorm1, depthwise_bnorm=bnorm2,
+                             scores=scores)
+    else:
+        plan.wider('layer1', 'layer2', new_width, bnorm=bnorm1, scores=scores)
+    plan.apply(container)
+
+
+def _state_keys(model):
+    # state_dict key of every parameter/buffer as (module, local name) pairs
+    keys = []
+    for prefix, module in model.named_modules():
+        for local, tensor in list(module._parameters.items()) + \
+                list(module._buffers.items()):
+            if tensor is not None:
+                keys.append((id(module), local,
+                             prefix + '.' + local if prefix else local))
+    return keys
+
+
+def _flattened_children(sequential, prefix=''):
+    # Children of nested Sequential containers, named after their path
+    for name, child in sequential.named_children():
+        if type(child) is nn.Sequential:
+            for item in _flattened_children(child, prefix + name + '_'):
+                yield item
+        else:
+            yield prefix + name, child
+
+
+def flatten_sequential(model):
+    r""" Splice nested Sequential containers into their parent, in place.
+
+    deeper() wraps a layer in a Sequential, so repeated deepening nests them
+    and every level adds a Python call to the forward pass. Every Sequential
+    nested directly in a Sequential is replaced by its children, named after
+    their path joined by '_' (e.g. 'conv' and 'bnorm' become 'conv_bnorm'),
+    with a numeric suffix if the name is taken. Subclasses of Sequential may
+    override forward() and are left alone.
+
+    :param model: Network to be flattened
+    :return: dict mapping every old state_dict key to the new one
+    """
+
+    old_keys = _state_keys(model)
+    for parent in list(model.modules()):
+        if type(parent) is not nn.Sequential or \
+                not any(type(child) is nn.Sequential
+                        for child in parent.children()):
+            continue
+        children = OrderedDict()
+        for name, child in _flattened_children(parent):
+            unique, suffix = name, 1
+            while unique in children:
+                unique = '{}_{}'.format(name, suffix)
+                suffix += 1
+            children[unique] = child
+        parent._modules = children
+
+    new_keys = dict(((module, local), key)
+                    for module, local, key in _state_keys(model))
+    return OrderedDict((key, new_keys[(module, local)])
+                       for module, local, key in old_keys)
+
+
+def remap_state_dict(state_dict, key_map):
+    r""" Rename the keys of a state_dict saved before flatten_sequential().
+
+    :param state_dict: State dict of the nested network
+    :param key_map: Mapping returned by flatten_sequential()
+    :return: state dict for the flattened network
+    """
+
+    return OrderedDict((key_map.get(key, key), value)
+                       for key, value in state_dict.items())
+
+
+def _out_width(module):
+    return module.out_channels if isinstance(module, nn.Conv2d) \
+        else module.out_features
+
+
+def _in_width(module):
+    return module.in_channels if isinstance(module, nn.Conv2d) \
+        else module.in_features
+
+
+def _groups(module):
+    return module.groups if isinstance(module, nn.Conv2d) else 1
+
+
+def _is_depthwise(module):
+    # Every group sees a single input channel
+    return isinstance(module, nn.Conv2d) and module.groups > 1 and \
+        module.groups == module.in_channels
+
+
+def _lcm(a, b):
+    x, y = a, b
+    while y:
+        x, y = y, x % y
+    return a * b // x
+
+
+def _check_layer(name, module):
+    if not isinstance(module, (nn.Conv2d, nn.Linear)):
+        raise RuntimeError('{} ({}) Module not supported'.format(
+            name, module.__class__.__name__))
+
+
+class _LayerPlan(object):
+    # Planned widths of a layer and, once sampled, the teacher unit of every
+    # student output unit (out_map) and input channel (in_map) together with
+    # the factor the input channel is multiplied with (in_scale). out_new and
+    # in_new mark the units which are replicas.
+
+    def __init__(self, module):
+        self.module = module
+        self.out_width = _out_width(module)
+        self.in_width = _in_width(module)
+        self.groups = _groups(module)
+        # A Linear layer following a conv layer sees every input channel as a
+        # block of features (the flattened spatial positions).
+        self.features = 1
+        self.in_channels = self.in_width
+        self.out_map = None
+        self.in_map = None
+        self.in_scale = None
+        self.out_new = None
+        self.in_new = None
+        self.bnorm = None
+        self.deepened = False
 
 
 class Transform(object):
+    r""" Declarative growth plan of a network.
+
+    Operations are recorded by name with the chainable wider() and deeper()
+    methods, validated against the model before any weight is touched and
+    executed by apply(). Repeated widenings of a layer are composed into a
+    single mapping from student to teacher units, so every affected layer is
+    gathered from the teacher weights exactly once, whatever the number of
+    steps in the plan. Deepening operations are applied after all widenings
+    and use the final widths.
+
+    'net2net' and 'net2net_original' replicate units and divide the
+    replicated input channels of the next layer by the replication factor.
+    'netmorph' replicates units and zero-initialises the new input channels
+    of the next layer. Both preserve the function of the network unless
+    add_noise() is requested.
+
+    Grouped convolutions keep their number of groups, units are replicated
+    within their group. wider_depthwise() widens a layer through a depthwise
+    convolution, whose groups are replicated as a whole.
+
+    Example::
+
+        plan = Transform('net2net').wider('conv1', 'conv2', 16, bnorm='bn1') \
+            .wider('conv1', 'conv2', 32, bnorm='bn1').deeper('conv2')
+        plan.validate(model)
+        plan.apply(model)
+
+    :param transform_type: 'net2net', 'netmorph' or 'net2net_original'
+    """
+
     def __init__(self, transform_type):
+        assert transform_type in TRANSFORM_TYPES, \
+            'Unknown transform {}'.format(transform_type)
         self.transform_type = transform_type
+        self.operations = []
+        self.noise = False
 
     def add_noise(self):
-        pass
+        r""" Add symmetry breaking noise to the units created by the plan. """
+
+        self.noise = True
+        return self
+
+    def wider(self, layer, next_layer, new_width, bnorm=None, align=None,
+              scores=None):
+        r""" Widen a layer and the input of the layer following it.
+
+        :param layer: Name of the layer to be widened
+        :param next_layer: Name of the layer consuming its output
+        :param new_width: New number of output channels/features of layer
+        :param bnorm: Name of the BN layer between the two layers if any
+        :param align: Round new_width up to a multiple of align
+        :param scores: Importance of every teacher unit of layer, the most
+         important units are replicated instead of random ones
+
+        :return: the transform, for chaining
+        """
+
+        self.operations.append(('wider', {
+            'layer': layer, 'next_layer': next_layer,
+            'new_width': alignment.align_width(new_width, align),
+            'bnorm': bnorm, 'scores': scores}))
+        return self
+
+    def wider_depthwise(self, layer, depthwise, next_layer, new_width,
+                        bnorm=None, depthwise_bnorm=None, align=None,
+                        scores=None):
+        r""" Widen a layer, the depthwise convolution and the input of the layer
+        following it, e.g. the pointwise layers of a MobileNet block.
+
+        Every new channel of layer is fed to a new group of the depthwise
+        convolution which is a copy of the group of the replicated channel,
+        the number of groups grows with the width.
+
+        :param layer: Name of the layer to be widened
+        :param depthwise: Name of the depthwise convolution consuming its output
+        :param next_layer: Name of the layer consuming the depthwise output
+        :param new_width: New number of output channels/features of layer
+        :param bnorm: Name of the BN layer between layer and depthwise if any
+        :param depthwise_bnorm: Name of the BN layer between depthwise and
+         next_layer if any
+        :param align: Round new_width up to a multiple of align
+        :param scores: Importance of every teacher unit of layer
+
+        :return: the transform, for chaining
+        """
+
+        self.operations.append(('wider_depthwise', {
+            'layer': layer, 'depthwise': depthwise, 'next_layer': next_layer,
+            'new_width': alignment.align_width(new_width, align),
+            'bnorm': bnorm, 'depthwise_bnorm': depthwise_bnorm,
+            'scores': scores}))
+        return self
+
+    def deeper(self, layer, bnorm=True):
+        r""" Add an identity initialised layer on top of a layer.
+
+        :param layer: Name of the layer to be deepened. It is replaced by a
+         Sequential of the layer, a BN layer (optional) and the new layer.
+        :param bnorm: Add a BN layer between the two layers if True
+
+        :return: the transform, for chaining
+        """
+
+        self.operations.append(('deeper', {'layer': layer, 'bnorm': bnorm}))
+        return self
+
+    def _plan(self, model):
+        # Validated plan of every affected layer, the deepened layers and the
+        # number of blocks every widening step replicates units within
+        layers = OrderedDict()
+        bnorms = OrderedDict()
+        deeper = OrderedDict()
+        blocks = []
+
+        def layer_plan(name):
+            if name not in layers:
+                module = get_module(model, name)
+                _check_layer(name, module)
+                layers[name] = _LayerPlan(module)
+            return layers[name]
+
+        def follow(plan, layer, bnorm_name, location):
+            # BN layer bnorm_name normalises the output of the planned layer
+            bnorm = get_module(model, bnorm_name)
+            assert isinstance(bnorm, nn.modules.batchnorm._BatchNorm), \
+                '{}: {} is not a BN layer'.format(location, bnorm_name)
+            owner = bnorms.setdefault(bnorm_name, layer)
+            assert owner == layer, \
+                '{}: {} already follows {}'.format(location, bnorm_name, owner)
+            assert plan.bnorm in (None, bnorm_name), \
+                '{}: Layer is already followed by {}'.format(location,
+                                                             plan.bnorm)
+            if plan.bnorm is None:
+                assert bnorm.num_features == plan.out_width, \
+                    '{}: BN features are not compatible'.format(location)
+            plan.bnorm = bnorm_name
+
+        for step, (operation, args) in enumerate(self.operations):
+            location = 'Step {} ({} {})'.format(step, operation, args['layer'])
+            if operation == 'deeper':
+                plan = layer_plan(args['layer'])
+                if isinstance(plan.module, nn.Conv2d):
+                    assert all(k % 2 == 1 for k in plan.module.kernel_size), \
+                        '{}: Kernel size needs to be odd'.format(location)
+                assert not plan.deepened, \
+                    '{}: Layer is already deepened'.format(location)
+                plan.deepened = True
+                deeper[args['layer']] = args
+                blocks.append(None)
+                continue
+
+            plan = layer_plan(args['layer'])
+            next_plan = layer_plan(args['next_layer'])
+            assert not plan.deepened, \
+                '{}: Layer is widened after being deepened'.format(location)
+            assert args['new_width'] > plan.out_width, \
+                '{}: New size should be larger'.format(location)
+
+            # Layer whose output the next layer consumes
+            producer = plan
+            multiplier = 1
+            if operation == 'wider_depthwise':
+                producer = layer_plan(args['depthwise'])
+                assert _is_depthwise(producer.module), \
+                    '{}: {} is not a depthwise convolution'.format(
+                        location, args['depthwise'])
+                assert not producer.deepened, \
+                    '{}: Layer is widened after being deepened'.format(location)
+                assert isinstance(plan.module, nn.Conv2d) and \
+                    producer.in_width == plan.out_width, \
+                    '{}: Module weights are not compatible'.format(location)
+                multiplier = producer.out_width // producer.groups
+
+            if isinstance(producer.module, nn.Conv2d) and \
+                    isinstance(next_plan.module, nn.Linear):
+                if next_plan.features == 1 and \
+                        next_plan.in_width != producer.out_width:
+                    assert next_plan.in_width % producer.out_width == 0, \
+                        '{}: Linear units need to be multiple'.format(location)
+                    next_plan.features = next_plan.in_width // \
+                        producer.out_width
+                    next_plan.in_channels = producer.out_width
+            else:
+                assert isinstance(next_plan.module, nn.Conv2d) == isinstance(
+                    producer.module, nn.Conv2d), \
+                    '{}: Module types are not compatible'.format(location)
+            assert next_plan.in_width == \
+                producer.out_width * next_plan.features, \
+                '{}: Module weights are not compatible'.format(location)
+
+            # Replicas stay within the groups of the layer and of the layer
+            # consuming them, so the number of groups of both is kept
+            step_blocks = _lcm(plan.groups, next_plan.groups)
+            assert plan.out_width % step_blocks == 0 and \
+                args['new_width'] % step_blocks == 0, \
+                '{}: Width needs to be a multiple of {} for the groups'.format(
+                    location, step_blocks)
+            blocks.append(step_blocks)
+
+            if args['bnorm'] is not None:
+                follow(plan, args['layer'], args['bnorm'], location)
+            if args.get('depthwise_bnorm') is not None:
+                follow(producer, args['depthwise'], args['depthwise_bnorm'],
+                       location)
+
+            plan.out_width = args['new_width']
+            if producer is not plan:
+                producer.in_width = producer.groups = args['new_width']
+                producer.out_width = args['new_width'] * multiplier
+            next_plan.in_width = producer.out_width * next_plan.features
+
+        return layers, deeper, blocks
+
+    def validate(self, model):
+        r""" Check the plan against the model without touching any weight.
+
+        :param model: Network the plan is meant for
+
+        :return: OrderedDict with the weight shape of every affected layer
+         after the plan, deepening adds the new layer as '<layer>.conv_new'.
+        """
+
+        layers, deeper, _ = self._plan(model)
+        shapes = OrderedDict()
+        for name, plan in layers.items():
+            module = plan.module
+            if isinstance(module, nn.Conv2d):
+                shape = (plan.out_width, plan.in_width // plan.groups) + \
+                    tuple(module.kernel_size)
+            else:
+                shape = (plan.out_width, plan.in_width)
+            shapes[name] = shape
+            if name in deeper:
+                shapes[name + '.conv_new'] = \
+                    (shape[0], shape[0] // plan.groups) + shape[2:]
+        return shapes
+
+    def replaced_tensors(self, model):
+        r""" Parameters and buffers of the model which apply() replaces by
+        new tensors gathered from them, all other tensors are kept.
+
+        :param model: Network the plan is meant for
+
+        :return: list of tensors
+        """
+
+        layers, _, _ = self._plan(model)
+        tensors = []
+        for plan in layers.values():
+            module = plan.module
+            widened_out = plan.out_width != _out_width(module)
+            if widened_out or plan.in_width != _in_width(module):
+                tensors.append(module.weight)
+            if widened_out and module.bias is not None:
+                tensors.append(module.bias)
+            if plan.bnorm is not None:
+                bnorm = get_module(model, plan.bnorm)
+                tensors.extend([bnorm.running_mean, bnorm.running_var])
+                if bnorm.affine:
+                    tensors.extend([bnorm.weight, bnorm.bias])
+        return tensors
+
+    @staticmethod
+    def _step_map(plan, new_width, blocks, scores):
+        # Student unit every unit is copied from after a widening step and the
+        # mask of the new units. Units are replicated within their block of
+        # consecutive units, the originals of every block come first.
+        width = plan.out_map.numel()
+        size, extra = width // blocks, (new_width - width) // blocks
+        if scores is not None:
+            # Teacher scores shared by the replicas of every unit
+            out_map = plan.out_map
+            counts = th.bincount(out_map).double()
+            scores = scores.detach().cpu().double()[out_map] / counts[out_map]
+            rand_ids = th.stack([importance.top_units(block, extra)
+                                 for block in scores.view(blocks, size)])
+        else:
+            rand_ids = th.randint(low=0, high=size, size=(blocks, extra),
+                                  dtype=th.long)
+        rand_ids = rand_ids + th.arange(0, width, size).view(-1, 1)
+        step_map = th.cat((th.arange(width).view(blocks, size), rand_ids), 1)
+        step_new = th.cat((th.zeros(blocks, size), th.ones(blocks, extra)), 1)
+        return step_map.view(-1), step_new.view(-1) > 0
+
+    def _sample(self, layers, blocks):
+        # Compose the mapping of every widening step with the mappings of the
+        # earlier steps of the same layers, no weights are touched.
+        for (operation, args), step_blocks in zip(self.operations, blocks):
+            if operation == 'deeper':
+                continue
+            plan = layers[args['layer']]
+            next_plan = layers[args['next_layer']]
+            width = plan.out_map.numel()
+            step_map, step_new = self._step_map(plan, args['new_width'],
+                                                step_blocks, args['scores'])
+            plan.out_map = plan.out_map[step_map]
+            plan.out_new = plan.out_new[step_map] | step_new
+
+            if self.transform_type == 'netmorph':
+                step_scale = 1. - step_new.float()
+            else:
+                counts = th.bincount(step_map, minlength=width).float()
+                step_scale = 1. / counts[step_map]
+
+            if operation == 'wider_depthwise':
+                # Every new channel gets a copy of the group of its original
+                dw_plan = layers[args['depthwise']]
+                dw_plan.in_map = dw_plan.in_map[step_map]
+                dw_plan.in_scale = dw_plan.in_scale[step_map]
+                dw_plan.in_new = dw_plan.in_new[step_map] | step_new
+                multiplier = dw_plan.out_map.numel() // width
+                size = (step_map.numel(), multiplier)
+                step_map = (step_map.view(-1, 1) * multiplier +
+                            th.arange(multiplier).view(1, -1)).view(-1)
+                step_new = step_new.view(-1, 1).expand(*size).contiguous() \
+                    .view(-1)
+                step_scale = step_scale.view(-1, 1).expand(*size) \
+                    .contiguous().view(-1)
+                dw_plan.out_map = dw_plan.out_map[step_map]
+                dw_plan.out_new = dw_plan.out_new[step_map] | step_new
+
+            next_plan.in_scale = next_plan.in_scale[step_map] * step_scale
+            next_plan.in_map = next_plan.in_map[step_map]
+            next_plan.in_new = next_plan.in_new[step_map] | step_new
+
+    def _materialize(self, name, plan):
+        module = plan.module
+        weight = module.weight.data
+        device = weight.device
+        out_map = plan.out_map.to(device)
+        in_map = plan.in_map.to(device)
+        teacher_out, teacher_in = weight.size(0), plan.in_channels
+        widened_out = out_map.numel() > teacher_out
+        widened_in = in_map.numel() > teacher_in
+        if not (widened_out or widened_in):
+            # Only deepened
+            return
+
+        if plan.features > 1:
+            weight = weight.view(weight.size(0), plan.in_channels,
+                                 plan.features)
+
+        out_new = plan.out_new.to(device)
+        in_new = plan.in_new.to(device)
+        scale = plan.in_scale.to(weight)
+        if _groups(module) > 1:
+            # Input channel j of student unit o is channel j of its group,
+            # taken from the group of the teacher unit it is copied from
+            out_group = out_map.numel() // plan.groups
+            in_group = in_map.numel() // plan.groups
+            columns = th.arange(0, out_map.numel(), device=device) \
+                // out_group * in_group
+            columns = columns.view(-1, 1) + \
+                th.arange(0, in_group, device=device).view(1, -1)
+            new_weight = weight[out_map.view(-1, 1),
+                                in_map[columns] % weight.size(1)]
+            scale = scale[columns]
+            in_new = in_new[columns]
+        elif widened_out and widened_in:
+            # Single gather of the teacher weights for output and input units
+            new_weight = weight[out_map.view(-1, 1), in_map.view(1, -1)]
+        elif widened_out:
+            new_weight = weight[out_map]
+        else:
+            new_weight = weight[:, in_map]
+        profiling.record_copy(new_weight)
+
+        if scale.dim() == 1:
+            scale = scale.view(1, -1)
+        if widened_in:
+            new_weight.mul_(scale.view(
+                scale.shape + (1,) * (new_weight.dim() - 2)))
+
+        if self.noise:
+            teacher_weight = module.weight.data
+            if widened_out:
+                new_weight[out_new] = add_noise(new_weight[out_new],
+                                                teacher_weight)
+            if self.transform_type == 'netmorph' and widened_in:
+                if in_new.dim() == 1:
+                    new_weight[:, in_new] = add_noise(new_weight[:, in_new],
+                                                      teacher_weight)
+                else:
+                    new_weight[in_new] = add_noise(new_weight[in_new],
+                                                   teacher_weight)
+
+        if plan.features > 1:
+            new_weight = new_weight.view(new_weight.size(0), -1)
+
+        if isinstance(module, nn.Conv2d):
+            module.out_channels, module.in_channels = \
+                out_map.numel(), in_map.numel()
+            module.groups = plan.groups
+        else:
+            module.out_features, module.in_features = new_weight.shape
+        module.weight.data = new_weight
+        if module.bias is not None and widened_out:
+            module.bias.data = module.bias.data[out_map]
+
+    @without_init
+    def _deepen(self, model, name, args):
+        layer = get_module(model, name)
+        width = _out_width(layer)
+        device = layer.weight.device
+
+        if isinstance(layer, nn.Linear):
+            new_layer = nn.Linear(width, width, bias=layer.bias is not None)
+            new_layer.weight.data = th.eye(width, device=device)
+            bnorm = nn.BatchNorm1d(width) if args['bnorm'] else None
+        else:
+            kh, kw = layer.kernel_size
+            # Grouped (e.g. depthwise) layers get a grouped identity
+            groups = layer.groups
+            new_layer = nn.Conv2d(width, width, kernel_size=(kh, kw),
+                                  padding=(kh // 2, kw // 2), groups=groups,
+                                  bias=layer.bias is not None)
+            weight = th.zeros(width, width // groups, kh, kw, device=device)
+            units = th.arange(0, width, device=device)
+            weight[units, units % (width // groups), kh // 2, kw // 2] = 1.
+            new_layer.weight.data = weight
+            bnorm = nn.BatchNorm2d(width) if args['bnorm'] else None
+        if new_layer.bias is not None:
+            new_layer.bias.data = th.zeros(width, device=device)
+        if self.noise:
+            new_layer.weight.data = add_noise(new_layer.weight.data,
+                                              layer.weight.data)
+
+        seq_container = nn.Sequential()
+        seq_container.add_module('conv', layer)
+        if bnorm is not None:
+            # Identity in eval mode: (x - 0) / sqrt(1 - eps + eps) * 1 + 0
+            bnorm.running_var.fill_(1 - bnorm.eps)
+            seq_container.add_module('bnorm', bnorm.to(device))
+        seq_container.add_module('conv_new', new_layer)
+        set_module(model, name, seq_container)
+
+    @profiling.profiled('transform.apply')
+    def apply(self, model):
+        r""" Execute the plan on the model in place.
+
+        :param model: Network to be transformed
+
+        :return: the transformed model
+        """
+
+        with profiling.span('validate'):
+            layers, deeper, blocks = self._plan(model)
+
+        with profiling.span('sample'):
+            for plan in layers.values():
+                plan.out_map = th.arange(_out_width(plan.module))
+                plan.in_map = th.arange(plan.in_channels)
+                plan.in_scale = th.ones(plan.in_channels)
+                plan.out_new = plan.out_map < 0
+                plan.in_new = plan.in_map < 0
+            self._sample(layers, blocks)
+
+        with profiling.span('materialize'):
+            with th.no_grad():
+                for name, plan in layers.items():
+                    self._materialize(name, plan)
+                for name, plan in layers.items():
+                    if plan.bnorm is None:
+                        continue
+                    bnorm = get_module(model, plan.bnorm)
+                    out_map = plan.out_map.to(bnorm.running_mean.device)
+                    bnorm.num_features = out_map.numel()
+                    bnorm.running_mean = bnorm.running_mean[out_map]
+                    bnorm.running_var = bnorm.running_var[out_map]
+                    if bnorm.affine:
+                        bnorm.weight.data = bnorm.weight.data[out_map]
+                        bnorm.bias.data = bnorm.bias.data[out_map]
+
+        with profiling.span('deeper'):
+            for name, args in deeper.items():
+                self._deepen(model, name, args)
+
+        return model
+
+
+class LazyStudent(nn.Module):
+    r""" Student network which is only built when it is used.
+
+    Only the teacher reference and the transform are kept, the plan is
+    validated on construction so the planned shapes are available in
+    `shapes` without allocating any weight. The student is materialised on
+    the first forward or an explicit materialize(): the teacher is deep
+    copied except for the tensors the transform replaces anyway, those are
+    gathered straight from the teacher storage.
+
+    :param teacher: Network to be transformed, left unchanged
+    :param transform: Transform to be applied to the copy of the teacher
+    """
+
+    def __init__(self, teacher, transform):
+        super(LazyStudent, self).__init__()
+        self.transform = transform
+        self.shapes = transform.validate(teacher)
+        # Not registered as a submodule, the teacher parameters must not be
+        # seen as parameters of the student.
+        self.__dict__['teacher'] = teacher
+        self.student = None
+
+    @property
+    def materialized(self):
+        return self.student is not None
+
+    @profiling.profiled('transform.materialize')
+    def materialize(self):
+        r""" Build the student if not done yet.
+
+        :return: the student network
+        """
+
+        if self.student is None:
+            teacher = self.teacher
+            # Parameters the transform replaces are not copied, the memo
+            # hands the copy new Parameters sharing the teacher storage, which
+            # are only read from before their data is replaced.
+            memo = {}
+            for tensor in self.transform.replaced_tensors(teacher):
+                if isinstance(tensor, nn.Parameter):
+                    memo[id(tensor)] = nn.Parameter(
+                        tensor.data, requires_grad=tensor.requires_grad)
+                else:
+                    memo[id(tensor)] = tensor
+            student = copy.deepcopy(teacher, memo)
+            self.student = self.transform.apply(student)
+            self.student.train(self.training)
+            del self.__dict__['teacher']
+        return self.student
 
-    def wider(self):
-        pass
+    def forward(self, *args, **kwargs):
+        return self.materialize()(*args, **kwargs)
@@ -0,0 +1,244 @@
+import copy
+import torch as th
+
+ERROR_TOLERANCE = 1e-3
+
+
+def _as_tuple(output):
+    if isinstance(output, (tuple, list)):
+        return tuple(output)
+    return (output,)
+
+
+def _probe_batches(inputs, input_shape, num_batches, batch_size, device):
+    if inputs is None:
+        assert input_shape is not None, 'Either inputs or input_shape needed'
+        for _ in range(num_batches):
+            yield th.rand((batch_size,) + tuple(input_shape), device=device)
+    elif th.is_tensor(inputs):
+        yield inputs
+    else:
+        # Any iterable of batches, e.g. a DataLoader yielding
+        # (inputs, targets) pairs.
+        for i, batch in enumerate(inputs):
+            if i == num_batches:
+                break
+            if isinstance(batch, (tuple, list)):
+                batch = batch[0]
+            yield batch.to(device)
+
+
+def compare_outputs(teacher, student, inputs=None, input_shape=None,
+                    num_batches=1, batch_size=8):
+    r""" Compare the outputs of a teacher and a student network.
+
+    Both networks are run in eval mode under torch.no_grad on the same probe
+    batches, either real batches or random ones, and the absolute error is
+    accumulated for every output of the networks. The train/eval mode of the
+    networks is restored afterwards.
+
+    :param teacher: Network before the transformation
+    :param student: Network after the transformation
+    :param inputs: Probe batch (tensor) or an iterable of batches. Random
+     batches are used if not given.
+    :param input_shape: Shape of a single input without batch dimension,
+     needed for random probe batches.
+    :param num_batches: Number of probe batches to be used
+    :param batch_size: Batch size of random probe batches
+
+    :return: dict with 'max_abs_error' and 'mean_abs_error' over all outputs
+     and the same statistics per network output under 'outputs'.
+    """
+
+    device = next(teacher.parameters()).device
+    teacher_mode, student_mode = teacher.training, student.training
+    teacher.eval()
+    student.eval()
+
+    outputs = []
+    try:
+        with th.no_grad():
+            for batch in _probe_batches(inputs, input_shape, num_batches,
+                                        batch_size, device):
+                teacher_out = _as_tuple(teacher(batch))
+                student_out = _as_tuple(student(batch))
+                assert len(teacher_out) == len(student_out), \
+                    'Networks have different number of outputs'
+
+                if not outputs:
+                    outputs = [{'max_abs_error': 0.0, 'sum_abs_error': 0.0,
+                                'count': 0} for _ in teacher_out]
+
+                for stats, out, nout in zip(outputs, teacher_out, student_out):
+                    assert out.shape == nout.shape, \
+                        'Output shapes differ: {} and {}'.format(
+                            tuple(out.shape), tuple(nout.shape))
+                    err = (out - nout).abs()
+                    stats['max_abs_error'] = max(stats['max_abs_error'],
+                                                 err.max().item())
+                    stats['sum_abs_error'] += err.sum().item()
+                    stats['count'] += err.numel()
+    finally:
+        teacher.train(teacher_mode)
+        student.train(student_mode)
+
+    total_error = sum([s['sum_abs_error'] for s in outputs])
+    total_count = sum([s['count'] for s in outputs])
+    for stats in outputs:
+        stats['mean_abs_error'] = stats.pop('sum_abs_error') / max(
+            stats.pop('count'), 1)
+
+    return {
+        'max_abs_error': max([s['max_abs_error'] for s in outputs] or [0.0]),
+        'mean_abs_error': total_error / max(total_count, 1),
+        'outputs': outputs}
+
+
+def verify_preservation(teacher, student, tolerance=ERROR_TOLERANCE, **kwargs):
+    r""" Assert that the student computes the same function as the teacher.
+
+    :param teacher: Network before the transformation
+    :param student: Network after the transformation
+    :param tolerance: Maximum absolute error allowed for any output element
+    :param kwargs: Passed to compare_outputs
+
+    :return: report of compare_outputs
+    """
+
+    report = compare_outputs(teacher, student, **kwargs)
+    err = report['max_abs_error']
+    assert err < tolerance, 'Verification failed: [ERROR] {}'.format(err)
+    return report
+
+
+def verify_transform(model, transform_fn, tolerance=ERROR_TOLERANCE, **kwargs):
+    r""" Apply a transformation on a copy of the model and verify it.
+
+    :param model: Teacher network, left unchanged
+    :param transform_fn: Function transforming the given network in place
+    :param tolerance: Maximum absolute error allowed for any output element
+    :param kwargs: Passed to compare_outputs
+
+    :return: transformed student network and the report of compare_outputs
+    """
+
+    student = copy.deepcopy(model)
+    transform_fn(student)
+    report = verify_preservation(model, student, tolerance, **kwargs)
+    return student, report
+
+
+def _fold_inputs(teacher_w2, student_w2, mapping, old_width):
+    # Sum the input channels/features of the student layer which were
+    # replicated from the same teacher channel. A Linear layer following a
+    # conv layer sees every channel as a contiguous block of features.
+    if teacher_w2.size(1) != old_width:
+        features = teacher_w2.size(1) // old_width
+        teacher_w2 = teacher_w2.view(teacher_w2.size(0), old_width, features)
+        student_w2 = student_w2.view(student_w2.size(0), mapping.numel(),
+                                     features)
+
+    folded = th.zeros((student_w2.size(0), old_width) + student_w2.shape[2:],
+                      dtype=student_w2.dtype, device=student_w2.device)
+    folded.index_add_(1, mapping.to(student_w2.device), student_w2)
+    return teacher_w2, folded
+
+
+def _max_abs_diff(a, b):
+    return (a - b).abs().max().item() if a.numel() else 0.0
+
+
+def compare_wider_weights(teacher_layer1, teacher_layer2, student_layer1,
+                          student_layer2, mapping, teacher_bnorm=None,
+                          student_bnorm=None, transform_type='net2net'):
+    r""" Compare widened layers against the teacher layers without any input.
+
+    Every output channel of the first student layer (and the BN layer) must
+    be a copy of the teacher channel given by the mapping, and folding the
+    input channels of the second student layer back onto their teacher
+    channels must give the teacher weights. The check is O(parameters).
+
+    NetMorph initialises the new BN channels freshly instead of copying them
+    and cancels the new channels by zero input channels of the second layer,
+    so only the teacher BN channels are compared and the new input channels
+    must be zero ('layer2_new_inputs').
+
+    :param teacher_layer1: Teacher layer which was widened
+    :param teacher_layer2: Teacher layer following teacher_layer1
+    :param student_layer1: Widened layer
+    :param student_layer2: Layer following the widened layer
+    :param mapping: Teacher channel of every student channel, as returned by
+     wider(..., return_mapping=True)
+    :param teacher_bnorm: Teacher BN layer between the two layers if any
+    :param student_bnorm: Student BN layer between the two layers if any
+    :param transform_type: 'net2net', 'netmorph' or 'net2net_original'
+
+    :return: dict with the maximum absolute error of every compared tensor
+    """
+
+    mapping = th.as_tensor(mapping).long()
+    assert mapping.numel() == student_layer1.weight.size(0), \
+        'Mapping does not match the widened layer'
+
+    report = {}
+    with th.no_grad():
+        device = student_layer1.weight.device
+        out_mapping = mapping.to(device)
+        report['layer1_weight'] = _max_abs_diff(
+            student_layer1.weight, teacher_layer1.weight[out_mapping])
+        if teacher_layer1.bias is not None:
+            report['layer1_bias'] = _max_abs_diff(
+                student_layer1.bias, teacher_layer1.bias[out_mapping])
+
+        teacher_w2, folded = _fold_inputs(
+            teacher_layer2.weight, student_layer2.weight, mapping,
+            teacher_layer1.weight.size(0))
+        report['layer2_weight'] = _max_abs_diff(folded, teacher_w2)
+        old_width = teacher_layer1.weight.size(0)
+        if transform_type == 'netmorph':
+            student_w2 = student_layer2.weight.view(
+                student_layer2.weight.size(0), mapping.numel(), -1)
+            new_inputs = student_w2.narrow(1, old_width,
+                                           mapping.numel() - old_width)
+            report['layer2_new_inputs'] = _max_abs_diff(
+                new_inputs, th.zeros_like(new_inputs))
+        if teacher_layer2.bias is not None:
+            report['layer2_bias'] = _max_abs_diff(student_layer2.bias,
+                                                  teacher_layer2.bias)
+
+        if teacher_bnorm is not None:
+            for name in ('running_mean', 'running_var', 'weight', 'bias'):
+                teacher_param = getattr(teacher_bnorm, name)
+                if teacher_param is None:
+                    continue
+                student_param = getattr(student_bnorm, name)
+                if transform_type == 'netmorph':
+                    student_param = student_param.narrow(0, 0, old_width)
+                    teacher_param = teacher_param.narrow(0, 0, old_width)
+                else:
+                    teacher_param = teacher_param[out_mapping]
+                report['bnorm_' + name] = _max_abs_diff(student_param,
+                                                        teacher_param)
+
+    report['max_abs_error'] = max(report.values())
+    return report
+
+
+def verify_wider_weights(teacher_layer1, teacher_layer2, student_layer1,
+                         student_layer2, mapping, teacher_bnorm=None,
+                         student_bnorm=None, tolerance=ERROR_TOLERANCE,
+                         transform_type='net2net'):
+    r""" Assert that widened layers are a replicate-and-divide of the teacher.
+
+    See compare_wider_weights for the parameters.
+
+    :return: report of compare_wider_weights
+    """
+
+    report = compare_wider_weights(teacher_layer1, teacher_layer2,
+                                   student_layer1, student_layer2, mapping,
+                                   teacher_bnorm, student_bnorm,
+                                   transform_type)
+    err = report['max_abs_error']
+    assert err < tolerance, 'Verification failed: [ERROR] {}'.format(err)
+    return report